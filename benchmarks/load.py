@@ -0,0 +1,511 @@
+"""
+Load test of the transactions, users, ingestion and SSE endpoints.
+
+Scenarios, each reported as throughput and p50/p95/p99 latency:
+
+- transactions_first: first page of GET /transactions for a random user
+- transactions_deep: pages 2 to --depth of a user, following the cursor
+- users: GET /users pages, following the cursor
+- ingest_batch: POST /transactions/batch of --batch-size NDJSON rows spread
+  over the users, the rows per second are printed alongside. Batches refused
+  with a 409, their users' detector locks staying busy, count as conflicts
+  rather than errors
+- sse_connect: time until a /sse/transactions/{user_id} stream sends its
+  first byte, for --streams concurrent streams
+- sse_delivery: age of each streamed transaction when it reaches the client,
+  from its txn_date
+
+By default the app is served in process against a temporary SQLite database
+seeded with synthetic transactions and an in-memory Redis (fakeredis), so the
+suite runs anywhere. Pass --base-url to load a running server instead, for
+example the docker compose stack once `load_data.py` has filled it.
+
+A run can be saved as a JSON baseline and later runs compared against it. The
+comparison fails when a p50/p95 latency grows, or the throughput drops, by
+more than --threshold.
+
+    uv run python -m benchmarks.load --save-baseline baseline.json
+    uv run python -m benchmarks.load --baseline baseline.json --threshold 0.2
+    uv run python -m benchmarks.load --base-url http://localhost:8000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import httpx
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--base-url", help="server to load, the in-process SQLite stand-in if unset"
+    )
+    parser.add_argument("--requests", type=int, default=2000, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--depth", type=int, default=10, help="pages per cursor walk")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batches", type=int, default=100, help="ingest requests")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per batch")
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--sse-seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--uncached",
+        action="store_true",
+        help="vary the date window of every request so the page cache misses",
+    )
+    parser.add_argument("--users", type=int, default=50, help="stand-in users")
+    parser.add_argument(
+        "--rows-per-user", type=int, default=2000, help="stand-in transactions"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", type=Path, help="write the results here")
+    parser.add_argument("--baseline", type=Path, help="compare the results to this")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed regression, 0.2 = 20%%"
+    )
+    return parser.parse_args()
+
+
+@dataclass
+class ScenarioResult:
+    count: int
+    errors: int
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    conflicts: int = 0
+
+    @classmethod
+    def from_samples(
+        cls, samples: list[float], errors: int, elapsed: float, conflicts: int = 0
+    ) -> "ScenarioResult":
+        if len(samples) >= 2:
+            cuts = statistics.quantiles(samples, n=100, method="inclusive")
+            p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+        else:
+            p50 = p95 = p99 = samples[0] if samples else 0.0
+        return cls(
+            count=len(samples),
+            errors=errors,
+            throughput=len(samples) / elapsed if elapsed else 0.0,
+            p50_ms=p50 * 1e3,
+            p95_ms=p95 * 1e3,
+            p99_ms=p99 * 1e3,
+            conflicts=conflicts,
+        )
+
+
+class Recorder:
+    """Collects latencies, errors and 409 conflicts of one scenario."""
+
+    def __init__(self):
+        self.samples: list[float] = []
+        self.errors = 0
+        self.conflicts = 0
+        self._started = time.perf_counter()
+
+    async def timed(self, request: Awaitable[httpx.Response]) -> httpx.Response | None:
+        began = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.errors += 1
+            return None
+        if response.status_code == 409:
+            self.conflicts += 1
+            return None
+        if response.is_error:
+            self.errors += 1
+            return None
+        self.samples.append(time.perf_counter() - began)
+        return response
+
+    def result(self) -> ScenarioResult:
+        elapsed = time.perf_counter() - self._started
+        return ScenarioResult.from_samples(
+            self.samples, self.errors, elapsed, self.conflicts
+        )
+
+
+async def run_workers(
+    concurrency: int, iterations: int, work: Callable[[int], Awaitable[None]]
+) -> None:
+    """Runs `work(i)` for i in range(iterations) on `concurrency` workers."""
+    remaining = iter(range(iterations))
+
+    async def worker() -> None:
+        for i in remaining:
+            await work(i)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.user_ids: list[str] = []
+        # Every request of a run shares the window unless --uncached is set
+        self.window_end = datetime.now(tz=UTC)
+
+    def _transactions_params(self, user_id: str, cursor: str | None = None) -> dict:
+        end = self.window_end
+        if self.args.uncached:
+            end += timedelta(microseconds=self.rng.randrange(1, 10**6))
+        params = {
+            "user_id": user_id,
+            "from_date": (end - timedelta(days=30)).isoformat(),
+            "to_date": end.isoformat(),
+            "limit": self.args.page_size,
+        }
+        if cursor:
+            params["cursor"] = cursor
+        return params
+
+    async def load_users(self) -> None:
+        response = await self.client.get("/users", params={"limit": 1000})
+        response.raise_for_status()
+        self.user_ids = [str(user_id) for user_id in response.json()["users"]]
+        if not self.user_ids:
+            raise SystemExit("The server has no users, load some data first")
+
+    async def warm_up(self) -> None:
+        """Opens the connections and fills the caches outside the measurements."""
+
+        async def work(i: int) -> None:
+            user_id = self.user_ids[i]
+            await self.client.get(
+                "/transactions", params=self._transactions_params(user_id)
+            )
+
+        await run_workers(self.args.concurrency, len(self.user_ids), work)
+
+    async def transactions_first(self) -> ScenarioResult:
+        recorder = Recorder()
+
+        async def work(_: int) -> None:
+            user_id = self.rng.choice(self.user_ids)
+            await recorder.timed(
+                self.client.get(
+                    "/transactions", params=self._transactions_params(user_id)
+                )
+            )
+
+        await run_workers(self.args.concurrency, self.args.requests, work)
+        return recorder.result()
+
+    async def transactions_deep(self) -> ScenarioResult:
+        recorder = Recorder()
+        # The first page of each walk is not recorded, it is the other scenario
+        walks = max(1, self.args.requests // max(1, self.args.depth - 1))
+
+        async def work(_: int) -> None:
+            user_id = self.rng.choice(self.user_ids)
+            response = await self.client.get(
+                "/transactions", params=self._transactions_params(user_id)
+            )
+            cursor = response.json()["cursor"] if response.is_success else ""
+            for _ in range(self.args.depth - 1):
+                if not cursor:
+                    return
+                response = await recorder.timed(
+                    self.client.get(
+                        "/transactions",
+                        params=self._transactions_params(user_id, cursor),
+                    )
+                )
+                cursor = response.json()["cursor"] if response is not None else ""
+
+        await run_workers(self.args.concurrency, walks, work)
+        return recorder.result()
+
+    async def users(self) -> ScenarioResult:
+        recorder = Recorder()
+        # Small pages, so following the cursor takes a few requests
+        limit = max(1, len(self.user_ids) // 5)
+
+        async def work(_: int) -> None:
+            cursor = ""
+            for _ in range(5):
+                params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+                response = await recorder.timed(
+                    self.client.get("/users", params=params)
+                )
+                cursor = response.json()["cursor"] if response is not None else ""
+                if not cursor:
+                    return
+
+        await run_workers(self.args.concurrency, self.args.requests // 5, work)
+        return recorder.result()
+
+    def _batch_body(self) -> bytes:
+        now = datetime.now(tz=UTC)
+        rows = (
+            {
+                "user_id": self.rng.choice(self.user_ids),
+                "amount": f"{self.rng.uniform(1, 500):.2f}",
+                "currency": "INR",
+                "txn_date": (now - timedelta(seconds=i)).isoformat(),
+                "status": "paid",
+            }
+            for i in range(self.args.batch_size)
+        )
+        return "\n".join(json.dumps(row) for row in rows).encode()
+
+    async def ingest_batch(self) -> ScenarioResult:
+        recorder = Recorder()
+
+        async def work(_: int) -> None:
+            await recorder.timed(
+                self.client.post(
+                    "/transactions/batch",
+                    content=self._batch_body(),
+                    headers={"Content-Type": "application/x-ndjson"},
+                )
+            )
+
+        await run_workers(self.args.concurrency, self.args.batches, work)
+        result = recorder.result()
+        rows_per_second = result.throughput * self.args.batch_size
+        print(f"  ingested {rows_per_second:.0f} rows/s")
+        return result
+
+    async def sse(self) -> tuple[ScenarioResult, ScenarioResult]:
+        connect = Recorder()
+        delivery = Recorder()
+        deadline = time.perf_counter() + self.args.sse_seconds
+
+        async def stream(user_id: str) -> None:
+            began = time.perf_counter()
+            try:
+                async with self.client.stream(
+                    "GET", f"/sse/transactions/{user_id}", timeout=None
+                ) as response:
+                    if response.is_error:
+                        connect.errors += 1
+                        return
+                    lines = response.aiter_lines()
+                    await anext(lines)
+                    connect.samples.append(time.perf_counter() - began)
+                    async for line in lines:
+                        if line.startswith("data: "):
+                            received = datetime.now(tz=UTC)
+                            txn = json.loads(line.removeprefix("data: "))
+                            sent = datetime.fromisoformat(txn["txn_date"])
+                            delivery.samples.append((received - sent).total_seconds())
+                        elif line.startswith("event: error"):
+                            delivery.errors += 1
+            except httpx.HTTPError:
+                connect.errors += 1
+
+        async def stream_until_deadline(user_id: str) -> None:
+            try:
+                await asyncio.wait_for(stream(user_id), deadline - time.perf_counter())
+            except TimeoutError:
+                pass
+
+        users = [self.rng.choice(self.user_ids) for _ in range(self.args.streams)]
+        await asyncio.gather(*(stream_until_deadline(user_id) for user_id in users))
+        return connect.result(), delivery.result()
+
+    async def run(self) -> dict[str, ScenarioResult]:
+        await self.load_users()
+        await self.warm_up()
+        results = {}
+        for name in (
+            "transactions_first",
+            "transactions_deep",
+            "users",
+            "ingest_batch",
+        ):
+            print(f"Running {name}...")
+            results[name] = await getattr(self, name)()
+        print(f"Running sse ({self.args.streams} streams)...")
+        results["sse_connect"], results["sse_delivery"] = await self.sse()
+        return results
+
+
+@asynccontextmanager
+async def standin_server(args: argparse.Namespace) -> AsyncIterator[str]:
+    """
+    Serves the app on a free local port, backed by a temporary SQLite
+    database and fakeredis, and yields its base URL.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        # The settings are read when the app is imported
+        os.environ["POSTGRES_URL"] = f"sqlite+aiosqlite:///{directory}/bench.db"
+        os.environ.setdefault("REDIS_URL", "redis://localhost")
+        # Streams pick their users at random, several may land on one
+        os.environ.setdefault("SSE_MAX_CONNECTIONS_PER_USER", str(args.streams))
+
+        import uvicorn
+        from fakeredis import FakeAsyncRedis, FakeServer
+
+        from src import redis as app_redis
+        from src.database import engine
+        from src.main import app
+        from src.redis import InstrumentedConnectionPool
+
+        # Keep the app's logging from drowning the report
+        logging.getLogger().setLevel(logging.ERROR)
+
+        await seed(engine, args)
+        # The lifespan keeps a pool that is already set
+        app_redis._pool = FakeAsyncRedis(
+            server=FakeServer(),
+            connection_pool_class=InstrumentedConnectionPool,
+            max_connections=args.concurrency + args.streams + 10,
+            decode_responses=True,
+        ).connection_pool
+
+        server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+        )
+        task = asyncio.create_task(server.serve())
+        while not server.started:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.05)
+        host, port = server.servers[0].sockets[0].getsockname()[:2]
+        try:
+            yield f"http://{host}:{port}"
+        finally:
+            server.should_exit = True
+            await task
+            await engine.dispose()
+
+
+async def seed(engine, args: argparse.Namespace) -> None:
+    """Fills the stand-in database with users and a month of transactions."""
+    from sqlmodel import SQLModel
+
+    from src.models import Transaction, User
+    from src.rollups import rebuild_rollups
+
+    rng = random.Random(args.seed)
+    now = datetime.now(tz=UTC)
+    user_ids = [
+        uuid.UUID(int=rng.getrandbits(128), version=4) for _ in range(args.users)
+    ]
+    print(f"Seeding {args.users} users x {args.rows_per_user} transactions...")
+
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.execute(User.__table__.insert(), [{"id": u} for u in user_ids])
+        for user_id in user_ids:
+            rows = [
+                {
+                    "id": uuid.UUID(int=rng.getrandbits(128), version=4),
+                    "user_id": user_id,
+                    "amount": Decimal(f"{rng.uniform(1, 500):.2f}"),
+                    "currency": "INR",
+                    "txn_date": now - timedelta(seconds=rng.uniform(0, 29 * 86400)),
+                    "status": rng.choice(["paid", "failed"]),
+                    "meta_data": {"is_anomaly": False},
+                }
+                for _ in range(args.rows_per_user)
+            ]
+            await conn.execute(Transaction.__table__.insert(), rows)
+        await rebuild_rollups(conn)
+
+
+def print_results(results: dict[str, ScenarioResult]) -> None:
+    print(
+        f"{'scenario':<20}{'count':>8}{'errors':>8}{'409s':>8}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<20}{result.count:>8}{result.errors:>8}{result.conflicts:>8}"
+            f"{result.throughput:>10.1f}"
+            f"{result.p50_ms:>10.2f}{result.p95_ms:>10.2f}{result.p99_ms:>10.2f}"
+        )
+
+
+def compare(
+    results: dict[str, ScenarioResult], baseline: dict, threshold: float
+) -> list[str]:
+    """Returns a description of every regression past `threshold`."""
+    regressions = []
+    for name, base in baseline["scenarios"].items():
+        result = results.get(name)
+        if result is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if getattr(result, metric) > base[metric] * (1 + threshold):
+                regressions.append(
+                    f"{name} {metric}: {base[metric]:.2f} -> "
+                    f"{getattr(result, metric):.2f}"
+                )
+        # SSE throughput follows the simulator interval, not the server's speed
+        if not name.startswith("sse") and result.throughput < base["throughput"] * (
+            1 - threshold
+        ):
+            regressions.append(
+                f"{name} throughput: {base['throughput']:.1f} -> "
+                f"{result.throughput:.1f} req/s"
+            )
+    return regressions
+
+
+async def main() -> int:
+    args = parse_args()
+
+    async with AsyncExitStack() as stack:
+        base_url = args.base_url
+        if not base_url:
+            base_url = await stack.enter_async_context(standin_server(args))
+        limits = httpx.Limits(max_connections=args.concurrency + args.streams)
+        client = await stack.enter_async_context(
+            httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30)
+        )
+        results = await LoadTest(client, args).run()
+
+    print_results(results)
+
+    if args.save_baseline:
+        document = {
+            "target": args.base_url or "sqlite stand-in",
+            "created_at": datetime.now(tz=UTC).isoformat(),
+            "args": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("save_baseline", "baseline")
+            },
+            "scenarios": {name: asdict(result) for name, result in results.items()},
+        }
+        args.save_baseline.write_text(json.dumps(document, indent=2) + "\n")
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.threshold
+        )
+        if regressions:
+            print(f"Regressed by more than {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regression past {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
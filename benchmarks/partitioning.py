@@ -0,0 +1,252 @@
+"""
+Single table vs monthly partitions for the transactions workload.
+
+Loads the same synthetic rows into a plain table and into a table range
+partitioned by month, both shaped and indexed like `transactions`, then
+compares:
+
+- latency of the /transactions page query over random 30 day windows
+- VACUUM after rescoring 1% of the latest month (only its partition is dirty)
+- expiring the oldest month: DELETE vs DETACH + DROP
+
+The data is generated inside Postgres, so loading 50M rows is bound by the
+server and not by this script. Plan for ~25 GB of disk at that size. The
+bench_* tables are dropped at the end unless --keep is given.
+
+    uv run python -m benchmarks.partitioning --rows 50000000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+from src.partitions import add_months, month_start
+
+SINGLE = "bench_single"
+PARTITIONED = "bench_partitioned"
+LOAD_CHUNK_ROWS = 1_000_000
+
+COLUMNS = """
+    id uuid NOT NULL,
+    user_id uuid NOT NULL,
+    amount numeric(20, 2) NOT NULL,
+    currency varchar(3) NOT NULL,
+    txn_date timestamptz NOT NULL,
+    status varchar(32) NOT NULL,
+    meta_data jsonb
+"""
+
+PAGE_QUERY = """
+    SELECT user_id, amount, currency, txn_date, status, meta_data, id
+    FROM {table}
+    WHERE user_id = md5('user' || CAST(:user AS text))::uuid
+      AND txn_date >= :from_date AND txn_date <= :to_date
+      AND amount >= 0 AND amount <= 10000000000
+    ORDER BY txn_date DESC, id DESC
+    LIMIT 100
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default=os.environ.get("POSTGRES_URL"))
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--months", type=int, default=24, help="history to spread")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the bench tables")
+    return parser.parse_args()
+
+
+async def create_tables(conn: AsyncConnection, first: datetime, months: int) -> None:
+    await conn.execute(text(f"DROP TABLE IF EXISTS {SINGLE}, {PARTITIONED} CASCADE"))
+    await conn.execute(text(f"CREATE TABLE {SINGLE} ({COLUMNS})"))
+    await conn.execute(
+        text(f"CREATE TABLE {PARTITIONED} ({COLUMNS}) PARTITION BY RANGE (txn_date)")
+    )
+    await conn.execute(
+        text(f"CREATE TABLE {PARTITIONED}_default PARTITION OF {PARTITIONED} DEFAULT")
+    )
+    for i in range(months + 1):
+        start = add_months(first, i)
+        await conn.execute(
+            text(
+                f"CREATE TABLE {PARTITIONED}_p{start:%Y_%m} PARTITION OF {PARTITIONED} "
+                f"FOR VALUES FROM ('{start.isoformat()}') "
+                f"TO ('{add_months(start, 1).isoformat()}')"
+            )
+        )
+
+
+async def load(
+    db_engine: AsyncEngine, rows: int, users: int, start: datetime, end: datetime
+) -> None:
+    loaded = 0
+    started = time.perf_counter()
+    while loaded < rows:
+        size = min(LOAD_CHUNK_ROWS, rows - loaded)
+        async with db_engine.begin() as conn:
+            await conn.execute(
+                text(
+                    f"INSERT INTO {SINGLE} "
+                    "SELECT gen_random_uuid(), "
+                    # Deterministic user ids, the page query derives them the same way
+                    "md5('user' || (g % :users))::uuid, "
+                    "round((random() * 500)::numeric, 2), 'INR', "
+                    "CAST(:start AS timestamptz) + random() * CAST(:span AS interval), "
+                    "'paid', '{\"is_anomaly\": false}' "
+                    "FROM generate_series("
+                    "CAST(:first AS bigint), CAST(:last AS bigint)) AS g"
+                ),
+                {
+                    "users": users,
+                    "start": start,
+                    "span": end - start,
+                    "first": loaded,
+                    "last": loaded + size - 1,
+                },
+            )
+        loaded += size
+        elapsed = time.perf_counter() - started
+        print(f"  {loaded}/{rows} rows ({loaded / elapsed:,.0f} rows/s)")
+
+    # Indexes are built once the rows are in, maintaining them row by row with
+    # random ids gets slower and slower as they outgrow shared buffers
+    print("  copying into the partitioned table and indexing...")
+    async with db_engine.begin() as conn:
+        await conn.execute(text(f"INSERT INTO {PARTITIONED} SELECT * FROM {SINGLE}"))
+        await conn.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+        for table in (SINGLE, PARTITIONED):
+            await conn.execute(
+                text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, txn_date)")
+            )
+            await conn.execute(text(f"CREATE INDEX ON {table} (user_id, txn_date, id)"))
+
+
+def percentiles(samples: list[float]) -> str:
+    cuts = statistics.quantiles(samples, n=100)
+    return (
+        f"p50 {cuts[49] * 1e3:.2f} ms, p95 {cuts[94] * 1e3:.2f} ms, "
+        f"p99 {cuts[98] * 1e3:.2f} ms"
+    )
+
+
+async def query_latency(
+    db_engine: AsyncEngine, args: argparse.Namespace, start: datetime, end: datetime
+) -> None:
+    rng = random.Random(args.seed)
+    span = (end - start - timedelta(days=30)).total_seconds()
+    windows = []
+    for _ in range(args.queries):
+        from_date = start + timedelta(seconds=rng.uniform(0, span))
+        windows.append((rng.randrange(args.users), from_date))
+
+    async with db_engine.connect() as conn:
+        for table in (SINGLE, PARTITIONED):
+            query = text(PAGE_QUERY.format(table=table))
+            samples = []
+            for user, from_date in windows:
+                params = {
+                    "user": str(user),
+                    "from_date": from_date,
+                    "to_date": from_date + timedelta(days=30),
+                }
+                began = time.perf_counter()
+                await conn.execute(query, params)
+                samples.append(time.perf_counter() - began)
+            # The first queries warm up the cache and the statement cache
+            print(f"  {table:<18} {percentiles(samples[len(samples) // 10 :])}")
+
+
+async def relation_size(conn: AsyncConnection, table: str) -> int:
+    return await conn.scalar(
+        text("SELECT pg_total_relation_size(CAST(:table AS regclass))"),
+        {"table": table},
+    )
+
+
+async def vacuum_cost(db_engine: AsyncEngine, latest: datetime) -> None:
+    latest_partition = f"{PARTITIONED}_p{latest:%Y_%m}"
+    async with db_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for table, vacuumed in ((SINGLE, SINGLE), (PARTITIONED, latest_partition)):
+            await conn.execute(
+                text(
+                    f"UPDATE {table} SET meta_data = '{{\"is_anomaly\": true}}' "
+                    "WHERE txn_date >= :latest AND random() < 0.01"
+                ),
+                {"latest": latest},
+            )
+            size = await relation_size(conn, vacuumed)
+            began = time.perf_counter()
+            await conn.execute(text(f"VACUUM (ANALYZE) {vacuumed}"))
+            elapsed = time.perf_counter() - began
+            print(
+                f"  {table:<18} VACUUM {vacuumed} "
+                f"({size / 2**20:,.0f} MiB): {elapsed * 1e3:,.0f} ms"
+            )
+
+
+async def expiry_cost(db_engine: AsyncEngine, oldest: datetime) -> None:
+    oldest_partition = f"{PARTITIONED}_p{oldest:%Y_%m}"
+    async with db_engine.begin() as conn:
+        began = time.perf_counter()
+        result = await conn.execute(
+            text(f"DELETE FROM {SINGLE} WHERE txn_date < :end"),
+            {"end": add_months(oldest, 1)},
+        )
+        elapsed = time.perf_counter() - began
+        print(f"  {SINGLE:<18} DELETE {result.rowcount} rows: {elapsed * 1e3:,.0f} ms")
+
+        began = time.perf_counter()
+        await conn.execute(
+            text(f"ALTER TABLE {PARTITIONED} DETACH PARTITION {oldest_partition}")
+        )
+        await conn.execute(text(f"DROP TABLE {oldest_partition}"))
+        elapsed = time.perf_counter() - began
+        print(f"  {PARTITIONED:<18} DETACH + DROP: {elapsed * 1e3:,.0f} ms")
+
+
+async def main() -> None:
+    args = parse_args()
+    if not args.url:
+        raise SystemExit("Pass --url or set POSTGRES_URL")
+    db_engine = create_async_engine(args.url)
+
+    end = datetime.now(tz=UTC)
+    first = month_start(add_months(month_start(end), -args.months))
+    start = max(first, end - timedelta(days=30 * args.months))
+
+    print(f"Loading {args.rows} rows for {args.users} users...")
+    async with db_engine.begin() as conn:
+        await create_tables(conn, first, args.months)
+    await load(db_engine, args.rows, args.users, start, end)
+    async with db_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(f"VACUUM (ANALYZE) {SINGLE}"))
+        await conn.execute(text(f"VACUUM (ANALYZE) {PARTITIONED}"))
+
+    try:
+        print("Page query over a random 30 day window:")
+        await query_latency(db_engine, args, start, end)
+        print("Rescoring 1% of the latest month, then vacuuming:")
+        await vacuum_cost(db_engine, month_start(end))
+        print("Expiring the oldest month:")
+        await expiry_cost(db_engine, month_start(start))
+    finally:
+        if not args.keep:
+            async with db_engine.begin() as conn:
+                await conn.execute(text(f"DROP TABLE {SINGLE}, {PARTITIONED} CASCADE"))
+        await db_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Per-page CPU cost of building a /transactions response.
+
+Compares the previous path (ORM entities validated into a
+ListTransactionsResponse and dumped by pydantic) with the current one (column
+tuples encoded by orjson). Both run the same query against the same rows, and
+their output is checked to decode to the same document.
+
+    uv run python -m benchmarks.transactions_page --rows 100 --iterations 2000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
+# The app settings are required at import time but unused by the benchmark
+os.environ.setdefault("POSTGRES_URL", "postgresql+asyncpg://bench@localhost/bench")
+os.environ.setdefault("REDIS_URL", "redis://localhost")
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, desc, select
+
+from src.models import ListTransactionsResponse, Transaction, TransactionFilters
+from src.routers.transaction import _fetch_transactions, _filter_conditions
+from src.utils import encode_cursor
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--url",
+        default="sqlite+aiosqlite:///:memory:",
+        help="database to seed and query, an in-memory SQLite by default",
+    )
+    parser.add_argument("--rows", type=int, default=100, help="rows per page")
+    parser.add_argument("--iterations", type=int, default=2000)
+    return parser.parse_args()
+
+
+async def orm_page(params: TransactionFilters, db: AsyncSession) -> bytes:
+    """The response path before column tuples and orjson."""
+    query = (
+        select(Transaction)
+        .where(*_filter_conditions(params))
+        .limit(params.limit)
+        .order_by(desc(Transaction.txn_date), desc(Transaction.id))
+    )
+    txns = list((await db.execute(query)).scalars().all())
+    cursor = encode_cursor(txns[-1].txn_date, txns[-1].id) if txns else ""
+    response = ListTransactionsResponse(transactions=txns, cursor=cursor)
+    return response.model_dump_json().encode("utf-8")
+
+
+async def measure(fetch, params, session_maker, iterations: int) -> float:
+    """Returns the CPU seconds spent per page."""
+    async with session_maker() as db:
+        await fetch(params, db)  # warm up the statement cache
+        started = time.process_time()
+        for _ in range(iterations):
+            await fetch(params, db)
+            # Fresh entities every time, like a new request would get
+            db.expunge_all()
+        return (time.process_time() - started) / iterations
+
+
+async def main() -> None:
+    args = parse_args()
+    engine = create_async_engine(args.url)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+    user_id = uuid.uuid4()
+    now = datetime.now(tz=UTC)
+    async with session_maker() as db:
+        db.add_all(
+            Transaction(
+                user_id=user_id,
+                amount=Decimal(f"{100 + i}.25"),
+                currency="INR",
+                txn_date=now - timedelta(minutes=i),
+                status="paid",
+                meta_data={"is_anomaly": i % 7 == 0},
+            )
+            for i in range(args.rows)
+        )
+        await db.commit()
+
+    params = TransactionFilters(
+        user_id=user_id,
+        from_date=now - timedelta(days=1),
+        to_date=now,
+        limit=args.rows,
+    )
+
+    async with session_maker() as db:
+        before = await orm_page(params, db)
+        after = await _fetch_transactions(params, db)
+    assert json.loads(before) == json.loads(after), "outputs differ"
+
+    before_cpu = await measure(orm_page, params, session_maker, args.iterations)
+    after_cpu = await measure(
+        _fetch_transactions, params, session_maker, args.iterations
+    )
+
+    async with session_maker() as db:
+        await db.execute(delete(Transaction).where(Transaction.user_id == user_id))
+        await db.commit()
+    await engine.dispose()
+
+    print(f"{args.rows}-row page, {args.iterations} iterations")
+    print(f"  ORM + pydantic:   {before_cpu * 1e3:.3f} ms CPU per page")
+    print(f"  columns + orjson: {after_cpu * 1e3:.3f} ms CPU per page")
+    print(f"  speedup:          {before_cpu / after_cpu:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
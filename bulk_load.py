@@ -0,0 +1,232 @@
+"""
+High-speed fixture loader for capacity tests.
+
+Transactions are synthesized with NumPy one chunk at a time and streamed into
+Postgres with COPY, so memory use depends on --chunk-size and not on the
+total number of rows.
+
+    uv run python bulk_load.py --users 100 --rows-per-user 50000 --recreate
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import Iterator
+from datetime import UTC, date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlmodel import SQLModel
+
+from src.config import CONFIG
+from src.detectors import DETECTORS, Detector, create_detector
+from src.models import Transaction
+from src.partitions import ensure_partitions, is_partitioned
+from src.rollups import upsert_rollups
+from src.simulator import ANOMALY_CHANCE
+from src.user_registry import register_users
+
+COLUMNS = ["id", "user_id", "amount", "currency", "txn_date", "status", "meta_data"]
+META_DATA = {
+    False: json.dumps({"is_anomaly": False}),
+    True: json.dumps({"is_anomaly": True}),
+}
+STATUSES = np.array(["paid", "failed"])
+EPOCH = date(1970, 1, 1)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rows-per-user", type=int, default=15_000)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=365, help="history to spread")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--detector",
+        choices=list(DETECTORS),
+        default=CONFIG.ANOMALY_DETECTOR,
+        help="anomaly detector that flags the rows",
+    )
+    parser.add_argument(
+        "--recreate", action="store_true", help="drop and recreate the tables first"
+    )
+    return parser.parse_args()
+
+
+def generate_chunks(
+    rng: np.random.Generator,
+    detector: Detector,
+    rows: int,
+    chunk_size: int,
+    start: float,
+    end: float,
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Yields (timestamps, amounts in paise, failed mask, anomaly flags) for one
+    user, chunk by chunk, in chronological order.
+    """
+    state = detector.new_state()
+    num_chunks = -(-rows // chunk_size)
+    if num_chunks == 0:
+        return
+    span = (end - start) / num_chunks
+
+    for i in range(num_chunks):
+        size = min(chunk_size, rows - i * chunk_size)
+        chunk_start = start + i * span
+        timestamps = np.sort(rng.uniform(chunk_start, chunk_start + span, size))
+
+        # Occasional large spikes so that there are anomalies to find
+        spikes = rng.random(size) < ANOMALY_CHANCE
+        amounts = np.where(
+            spikes,
+            rng.uniform(5_000.0, 100_000.0, size),
+            rng.uniform(10.0, 500.0, size),
+        )
+        amounts_cents = np.rint(amounts * 100).astype(np.int64)
+
+        flags = detector.score_batch(amounts_cents, state)
+
+        yield timestamps, amounts_cents, rng.random(size) < 0.5, flags
+
+
+def to_records(
+    rng: np.random.Generator,
+    user_id: uuid.UUID,
+    timestamps: np.ndarray,
+    amounts_cents: np.ndarray,
+    failed: np.ndarray,
+    flags: np.ndarray,
+) -> list[tuple]:
+    # Random version 4 UUIDs, generated in bulk from the seeded generator
+    id_bytes = rng.integers(0, 256, (len(timestamps), 16), dtype=np.uint8)
+    id_bytes[:, 6] = (id_bytes[:, 6] & 0x0F) | 0x40
+    id_bytes[:, 8] = (id_bytes[:, 8] & 0x3F) | 0x80
+
+    return [
+        (
+            uuid.UUID(bytes=raw),
+            user_id,
+            Decimal(cents).scaleb(-2),
+            "INR",
+            datetime.fromtimestamp(ts, tz=UTC),
+            status,
+            META_DATA[flag],
+        )
+        for raw, cents, ts, status, flag in zip(
+            map(bytes, id_bytes),
+            amounts_cents.tolist(),
+            timestamps.tolist(),
+            STATUSES[failed.astype(np.int8)].tolist(),
+            flags.tolist(),
+            strict=True,
+        )
+    ]
+
+
+def chunk_rollups(
+    user_id: uuid.UUID,
+    timestamps: np.ndarray,
+    amounts_cents: np.ndarray,
+    failed: np.ndarray,
+    flags: np.ndarray,
+) -> list[dict]:
+    """Daily rollup rows of one user's chunk, aggregated with NumPy."""
+    days, index = np.unique(timestamps // 86_400, return_inverse=True)
+
+    def total(values: np.ndarray) -> list[int]:
+        sums = np.zeros(len(days), dtype=np.int64)
+        np.add.at(sums, index, values.astype(np.int64))
+        return sums.tolist()
+
+    paid = ~failed
+    counts = {
+        "txn_count": np.ones_like(failed),
+        "anomaly_count": flags,
+        "paid_count": paid,
+        "failed_count": failed,
+    }
+    cents = {
+        "amount_sum": amounts_cents,
+        "paid_amount": np.where(paid, amounts_cents, 0),
+        "failed_amount": np.where(failed, amounts_cents, 0),
+    }
+    columns = {metric: total(values) for metric, values in counts.items()}
+    for metric, values in cents.items():
+        columns[metric] = [
+            Decimal(total_cents).scaleb(-2) for total_cents in total(values)
+        ]
+
+    return [
+        {
+            "user_id": user_id,
+            "day": EPOCH + timedelta(days=day),
+            **{metric: column[i] for metric, column in columns.items()},
+        }
+        for i, day in enumerate(days.tolist())
+    ]
+
+
+async def copy_records(conn: AsyncConnection, records: list[tuple]) -> None:
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        Transaction.__tablename__, records=records, columns=COLUMNS
+    )
+
+
+async def main() -> None:
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    detector = create_detector(args.detector)
+    engine = create_async_engine(CONFIG.POSTGRES_URL, future=True)
+
+    if args.recreate:
+        print("Recreating tables...")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    end = time.time()
+    start = end - args.days * 86_400
+    async with engine.begin() as conn:
+        if await is_partitioned(conn):
+            created = await ensure_partitions(
+                conn,
+                datetime.fromtimestamp(start, tz=UTC),
+                datetime.fromtimestamp(end, tz=UTC),
+            )
+            if created:
+                print(f"Created {len(created)} monthly partitions.")
+        else:
+            print("transactions is not partitioned, loading into the single table.")
+    total = args.users * args.rows_per_user
+    loaded = 0
+    started = time.perf_counter()
+
+    print(f"Loading {total} transactions for {args.users} users...")
+
+    for _ in range(args.users):
+        user_id = uuid.UUID(bytes=rng.bytes(16), version=4)
+        async with engine.begin() as conn:
+            await register_users(conn, [user_id])
+        for chunk in generate_chunks(
+            rng, detector, args.rows_per_user, args.chunk_size, start, end
+        ):
+            records = to_records(rng, user_id, *chunk)
+            async with engine.begin() as conn:
+                await copy_records(conn, records)
+                await upsert_rollups(conn, chunk_rollups(user_id, *chunk))
+            loaded += len(records)
+        elapsed = time.perf_counter() - started
+        print(f"  {loaded}/{total} rows ({loaded / elapsed:,.0f} rows/s)")
+
+    await engine.dispose()
+    print("Data loading complete.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -11,7 +11,9 @@ from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
 
 from src.config import CONFIG
-from src.models import Transaction
+from src.models import Transaction, User
+from src.partitions import ensure_partitions
+from src.rollups import rollup_rows, upsert_rollups
 
 engine = create_async_engine(CONFIG.POSTGRES_URL, echo=True, future=True)
 
@@ -35,6 +37,9 @@ async def main() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.drop_all)
         await conn.run_sync(SQLModel.metadata.create_all)
+        # Monthly partitions for the year of history generated below
+        now = datetime.now(tz=UTC)
+        await ensure_partitions(conn, now - timedelta(days=365), now)
 
     print("Table created.")
 
@@ -95,7 +100,9 @@ async def main() -> None:
 
     async for session in get_session():
         async with session.begin():
+            session.add_all([User(id=user_id) for user_id in user_ids])
             session.add_all(transactions_to_create)
+            await upsert_rollups(session, rollup_rows(transactions_to_create))
 
     print("Data loading complete.")
 
@@ -0,0 +1,67 @@
+"""
+Rebuilds the anomaly detector state in Redis from the stored transactions, for
+every user or only the given ones. Run it after Redis lost its data, so the
+first events after a restart are scored against each user's history rather
+than from scratch.
+
+The latest amounts of all users are read in one query, ranked per user with
+ROW_NUMBER(), and the states written in one pipelined call per batch of users.
+
+    uv run python rebuild_detector_state.py
+    uv run python rebuild_detector_state.py --user <user_id> --user <user_id>
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import redis.asyncio as redis
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.config import CONFIG
+from src.detector_state import rebuild_states, save_detector_states
+from src.detectors import DETECTORS, create_detector
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--user", type=uuid.UUID, action="append", help="only rebuild this user"
+    )
+    parser.add_argument(
+        "--detector", choices=list(DETECTORS), default=CONFIG.ANOMALY_DETECTOR
+    )
+    parser.add_argument(
+        "--batch-users", type=int, default=1000, help="users written per pipeline"
+    )
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    engine = create_async_engine(CONFIG.POSTGRES_URL)
+    redis_client = redis.Redis.from_url(CONFIG.REDIS_URL, decode_responses=True)
+    detector = create_detector(args.detector)
+
+    print(
+        f"Rebuilding {detector.name} detector state from the last "
+        f"{detector.history_size} transactions of each user..."
+    )
+    started = time.perf_counter()
+    rebuilt = 0
+    async with engine.connect() as conn:
+        async for states in rebuild_states(
+            conn, detector, args.user, chunk_users=args.batch_users
+        ):
+            await save_detector_states(redis_client, detector, states)
+            rebuilt += len(states)
+            print(f"  {rebuilt} users")
+
+    await redis_client.aclose()
+    await engine.dispose()
+    print(f"Rebuilt {rebuilt} users in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
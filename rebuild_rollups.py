@@ -0,0 +1,57 @@
+"""
+Rebuilds the daily rollups behind /transactions/summary from the raw
+transactions, for every user or only the given ones.
+
+    uv run python rebuild_rollups.py
+    uv run python rebuild_rollups.py --user <user_id> --user <user_id>
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+
+from src.config import CONFIG
+from src.models import DailyRollup, User
+from src.rollups import rebuild_rollups
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--user", type=uuid.UUID, action="append", help="only rebuild this user"
+    )
+    parser.add_argument(
+        "--batch-users", type=int, default=100, help="users rebuilt per transaction"
+    )
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    engine = create_async_engine(CONFIG.POSTGRES_URL)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(
+            SQLModel.metadata.create_all, tables=[DailyRollup.__table__]
+        )
+        user_ids = args.user or list((await conn.execute(select(User.id))).scalars())
+
+    print(f"Rebuilding daily rollups of {len(user_ids)} users...")
+    started = time.perf_counter()
+    # A batch of users per transaction keeps each transaction short
+    for i in range(0, len(user_ids), args.batch_users):
+        async with engine.begin() as conn:
+            await rebuild_rollups(conn, user_ids[i : i + args.batch_users])
+        print(f"  {min(i + args.batch_users, len(user_ids))}/{len(user_ids)} users")
+
+    await engine.dispose()
+    print(f"Rebuild complete in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
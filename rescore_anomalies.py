@@ -0,0 +1,300 @@
+"""
+Recomputes the stored is_anomaly flags with the current anomaly settings.
+
+Each user's transactions are streamed in txn_date order through a server-side
+cursor and scored in chunks by the configured anomaly detector. Only flags that
+changed are written back, in batched UPDATEs. Users are processed in parallel
+by a process pool, and finished users are recorded in a checkpoint file so an
+interrupted run picks up where it stopped. A user that fails is reported and
+left out of the checkpoint, the others carry on, and the run exits non-zero.
+Once a user is done, their cached /transactions pages are invalidated.
+
+    uv run python rescore_anomalies.py --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import redis.asyncio as redis
+from sqlalchemy import bindparam, func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src.cache import bump_transactions_version
+from src.config import CONFIG
+from src.detectors import DETECTORS, create_detector
+from src.models import Transaction, User
+from src.rollups import rebuild_rollups
+
+UPDATE_FLAGS = text(
+    """
+    UPDATE transactions AS t
+    SET meta_data = jsonb_set(
+        coalesce(t.meta_data, '{}'::jsonb), '{is_anomaly}', to_jsonb(v.is_anomaly)
+    )
+    FROM unnest(
+        CAST(:ids AS uuid[]), CAST(:dates AS timestamptz[]), CAST(:flags AS boolean[])
+    ) AS v(id, txn_date, is_anomaly)
+    WHERE t.id = v.id AND t.txn_date = v.txn_date
+        AND t.txn_date BETWEEN :min_date AND :max_date
+    """
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--fetch-size", type=int, default=10_000, help="rows per cursor fetch"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=5_000, help="flags per UPDATE"
+    )
+    parser.add_argument(
+        "--checkpoint", type=Path, default=Path("rescore_checkpoint.json")
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore an existing checkpoint"
+    )
+    parser.add_argument(
+        "--detector", choices=list(DETECTORS), default=CONFIG.ANOMALY_DETECTOR
+    )
+    return parser.parse_args()
+
+
+def load_checkpoint(path: Path) -> set[str]:
+    if not path.exists():
+        return set()
+    return set(json.loads(path.read_text())["done"])
+
+
+def save_checkpoint(path: Path, done: set[str]) -> None:
+    # Write to a temporary file first so a crash never leaves half a checkpoint
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"done": sorted(done)}))
+    tmp.replace(path)
+
+
+async def write_flags(
+    conn: AsyncConnection,
+    ids: list[uuid.UUID],
+    dates: list[datetime],
+    flags: list[bool],
+) -> None:
+    if conn.dialect.name != "postgresql":
+        await _write_flags_per_row(conn, ids, dates, flags)
+        return
+    # The date bounds let Postgres skip the partitions outside the batch
+    await conn.execute(
+        UPDATE_FLAGS,
+        {
+            "ids": ids,
+            "dates": dates,
+            "flags": flags,
+            "min_date": min(dates),
+            "max_date": max(dates),
+        },
+    )
+    await conn.commit()
+
+
+async def _write_flags_per_row(
+    conn: AsyncConnection,
+    ids: list[uuid.UUID],
+    dates: list[datetime],
+    flags: list[bool],
+) -> None:
+    """SQLite version of `write_flags`, an executemany UPDATE."""
+    await conn.execute(
+        update(Transaction)
+        .where(
+            Transaction.id == bindparam("txn_id"),
+            Transaction.txn_date == bindparam("txn_date_"),
+        )
+        .values(
+            meta_data=func.json_set(
+                func.coalesce(Transaction.meta_data, "{}"),
+                "$.is_anomaly",
+                func.json(bindparam("flag")),
+            )
+        ),
+        [
+            {"txn_id": txn_id, "txn_date_": txn_date, "flag": json.dumps(flag)}
+            for txn_id, txn_date, flag in zip(ids, dates, flags, strict=True)
+        ],
+    )
+    await conn.commit()
+
+
+def _redis_client() -> redis.Redis:
+    return redis.Redis.from_url(CONFIG.REDIS_URL, decode_responses=True)
+
+
+async def _rescore_user(
+    user_id: uuid.UUID, detector_name: str, fetch_size: int, batch_size: int
+) -> tuple[int, int]:
+    engine = create_async_engine(CONFIG.POSTGRES_URL, poolclass=NullPool)
+    query = (
+        select(
+            Transaction.id,
+            Transaction.txn_date,
+            Transaction.amount,
+            Transaction.meta_data,
+        )
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.txn_date, Transaction.id)
+        .execution_options(yield_per=fetch_size)
+    )
+    detector = create_detector(detector_name)
+    state = detector.new_state()
+    scanned = changed = 0
+    pending_ids: list[uuid.UUID] = []
+    pending_dates: list[datetime] = []
+    pending_flags: list[bool] = []
+
+    try:
+        async with engine.connect() as reader, engine.connect() as writer:
+            result = await reader.stream(query)
+            async for rows in result.partitions():
+                ids, dates, amounts, meta_data = zip(*rows, strict=True)
+                amounts_cents = np.array(
+                    [int(amount.scaleb(2)) for amount in amounts], dtype=np.int64
+                )
+                flags = detector.score_batch(amounts_cents, state)
+
+                for txn_id, txn_date, meta, flag in zip(
+                    ids, dates, meta_data, flags.tolist(), strict=True
+                ):
+                    if (meta or {}).get("is_anomaly") is not flag:
+                        pending_ids.append(txn_id)
+                        pending_dates.append(txn_date)
+                        pending_flags.append(flag)
+
+                if len(pending_ids) >= batch_size:
+                    await write_flags(writer, pending_ids, pending_dates, pending_flags)
+                    changed += len(pending_ids)
+                    pending_ids, pending_dates, pending_flags = [], [], []
+                scanned += len(rows)
+
+            if pending_ids:
+                await write_flags(writer, pending_ids, pending_dates, pending_flags)
+                changed += len(pending_ids)
+            if changed:
+                # Anomaly counts of the daily rollups follow the new flags
+                await rebuild_rollups(writer, [user_id])
+                await writer.commit()
+    finally:
+        await engine.dispose()
+
+    # Cached pages still carry the old flags. Invalidated even when nothing
+    # changed, so rerunning a user whose invalidation failed retries it.
+    redis_client = _redis_client()
+    try:
+        await bump_transactions_version(redis_client, {user_id})
+    finally:
+        await redis_client.aclose()
+
+    return scanned, changed
+
+
+def rescore_user(
+    user_id: str, detector_name: str, fetch_size: int, batch_size: int
+) -> tuple[int, int]:
+    """Process pool entry point, runs one user's rescoring on its own loop."""
+    return asyncio.run(
+        _rescore_user(uuid.UUID(user_id), detector_name, fetch_size, batch_size)
+    )
+
+
+async def fetch_user_ids() -> list[str]:
+    engine = create_async_engine(CONFIG.POSTGRES_URL, poolclass=NullPool)
+    async with engine.connect() as conn:
+        result = await conn.execute(select(User.id))
+        user_ids = [str(user_id) for user_id in result.scalars()]
+    await engine.dispose()
+    return user_ids
+
+
+def rescore_users(
+    pool: Executor,
+    user_ids: list[str],
+    done: set[str],
+    checkpoint: Path,
+    detector_name: str,
+    fetch_size: int,
+    batch_size: int,
+) -> tuple[int, int, list[str]]:
+    """
+    Rescores the users on the pool, adding each one that finishes to `done`
+    and the checkpoint. A failed user is reported and skipped.
+
+    :return: The rows scanned, the flags changed and the users that failed.
+    """
+    futures = {
+        pool.submit(
+            rescore_user, user_id, detector_name, fetch_size, batch_size
+        ): user_id
+        for user_id in user_ids
+    }
+    total_scanned = total_changed = 0
+    failed = []
+    for future in as_completed(futures):
+        user_id = futures[future]
+        try:
+            scanned, changed = future.result()
+        except Exception as e:
+            failed.append(user_id)
+            print(f"  {user_id}: failed: {e!r}", file=sys.stderr)
+            continue
+        total_scanned += scanned
+        total_changed += changed
+        done.add(user_id)
+        save_checkpoint(checkpoint, done)
+        print(f"  {user_id}: {scanned} rows scanned, {changed} flags changed")
+    return total_scanned, total_changed, failed
+
+
+def main() -> None:
+    args = parse_args()
+    done = set() if args.restart else load_checkpoint(args.checkpoint)
+    user_ids = [u for u in asyncio.run(fetch_user_ids()) if u not in done]
+
+    print(f"Rescoring {len(user_ids)} users ({len(done)} already done)...")
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        scanned, changed, failed = rescore_users(
+            pool,
+            user_ids,
+            done,
+            args.checkpoint,
+            args.detector,
+            args.fetch_size,
+            args.batch_size,
+        )
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Rescoring complete: {scanned} rows scanned, "
+        f"{changed} flags changed in {elapsed:.1f}s."
+    )
+    if failed:
+        print(
+            f"{len(failed)} users failed and were left out of the checkpoint, "
+            "run again to retry them.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import time
+
+# Read by src.main to report how long importing the application took
+IMPORT_STARTED = time.perf_counter()
@@ -0,0 +1,41 @@
+import numpy as np
+
+# Anomaly detection constants
+ROLLING_WINDOW_SIZE = 20
+MIN_TXNS_FOR_ANOMALY_CHECK = 10
+ANOMALY_MULTIPLIER = 5
+
+
+def rolling_anomaly_flags(
+    amounts_cents: np.ndarray, history_cents: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Vectorized version of the rolling mean check for one user's transactions.
+
+    Each amount is compared to the mean of the `ROLLING_WINDOW_SIZE` amounts
+    before it, exactly like the live check does one transaction at a time.
+    Amounts are integer paise in chronological order, so sums stay exact.
+    `history_cents` holds the amounts preceding the first one, which lets a
+    long series be scored chunk by chunk.
+
+    :return: A boolean array, True where the amount is an anomaly.
+    """
+    if history_cents is None:
+        history_cents = np.empty(0, dtype=np.int64)
+    history_cents = history_cents[-ROLLING_WINDOW_SIZE:]
+
+    values = np.concatenate([history_cents, amounts_cents]).astype(np.int64)
+    cumsum = np.concatenate([[0], np.cumsum(values)])
+
+    # Window of the i-th amount is values[start:position]
+    position = np.arange(len(history_cents), len(values))
+    start = np.maximum(position - ROLLING_WINDOW_SIZE, 0)
+    count = position - start
+    window_sum = cumsum[position] - cumsum[start]
+
+    # amount > multiplier * (window_sum / count), without dividing
+    return (
+        (count >= MIN_TXNS_FOR_ANOMALY_CHECK)
+        & (window_sum > 0)
+        & (amounts_cents * count > ANOMALY_MULTIPLIER * window_sum)
+    )
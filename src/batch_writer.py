@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from src.cache import bump_transactions_version
+from src.config import CONFIG
+from src.database import AsyncSessionMaker
+from src.metrics import TXN_BATCH_RETRIES, TXN_BATCH_ROWS_SHED, stage
+from src.models import Transaction
+from src.redis import get_redis_pool
+from src.rollups import rollup_rows, upsert_rollups
+from src.user_registry import register_users
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the queue when the writer is stopped
+_STOP = object()
+
+
+class TransactionBatchWriter:
+    """
+    Write-behind inserter for transactions.
+
+    Producers enqueue `Transaction` objects and a single background task
+    writes them out with one multi-row INSERT per batch. A batch is flushed
+    when it reaches `max_batch_size` rows or `flush_interval_ms` after its
+    first row arrived, whichever comes first. The queue is bounded, so
+    producers wait when the database falls behind. The daily rollups of the
+    batch are updated in the same database transaction.
+
+    A batch that fails to insert is retried up to `max_retries` times, waiting
+    `retry_backoff_ms` and then twice as long after each further failure.
+    Its rows are dropped only once the retries are exhausted, or straight
+    away on an integrity error, which retrying cannot fix.
+
+    When a Redis client is given, the cached /transactions pages of the users
+    in a batch are invalidated once the batch is committed.
+    """
+
+    def __init__(
+        self,
+        session_maker: sessionmaker[AsyncSession],
+        max_batch_size: int,
+        flush_interval_ms: int,
+        max_queue_size: int,
+        redis_client: redis.Redis | None = None,
+        max_retries: int = 3,
+        retry_backoff_ms: int = 100,
+        max_known_users: int = 100_000,
+    ):
+        self.session_maker = session_maker
+        self.redis_client = redis_client
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        # Users recently written, least recent first, known to be in the
+        # registry so they are not inserted every batch. Bounded, a user
+        # evicted from it is inserted again, which is a no-op.
+        self.max_known_users = max_known_users
+        self._known_users: OrderedDict[uuid.UUID, None] = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        """Transactions waiting in the queue."""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="txn-batch-writer")
+
+    async def enqueue(self, txn: Transaction) -> None:
+        """Queues a transaction for insertion, waiting while the queue is full."""
+        if self._stopping:
+            raise RuntimeError("Transaction batch writer is stopped.")
+        await self._queue.put(txn)
+
+    async def stop(self) -> None:
+        """Flushes everything that was queued and stops the background task."""
+        if self._task is None or self._stopping:
+            return
+        self._stopping = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                await self._drain()
+                return
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            stop = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except TimeoutError:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stop:
+                await self._drain()
+                return
+
+    async def _drain(self) -> None:
+        """
+        Flushes what is still queued once the stop marker was read. A producer
+        woken from a full queue can land its row behind the marker.
+        """
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: list[Transaction]) -> None:
+        attempt = 0
+        while True:
+            try:
+                await self._insert(batch)
+                break
+            except Exception as exc:
+                if attempt >= self.max_retries or isinstance(exc, IntegrityError):
+                    logger.exception(
+                        f"Failed to insert a batch of {len(batch)} transactions, "
+                        f"dropping it after {attempt} retries"
+                    )
+                    TXN_BATCH_ROWS_SHED.inc(len(batch))
+                    return
+                delay = self.retry_backoff * 2**attempt
+                logger.warning(
+                    f"Failed to insert a batch of {len(batch)} transactions, "
+                    f"retrying in {delay:.2f}s: {exc!r}"
+                )
+                TXN_BATCH_RETRIES.inc()
+                attempt += 1
+                await asyncio.sleep(delay)
+
+        if self.redis_client is not None:
+            try:
+                with stage("cache_invalidate"):
+                    await bump_transactions_version(
+                        self.redis_client, {txn.user_id for txn in batch}
+                    )
+            except RedisError:
+                logger.exception("Failed to invalidate cached transactions")
+
+    async def _insert(self, batch: list[Transaction]) -> None:
+        """Inserts a batch and its rollups in one database transaction."""
+        user_ids = {txn.user_id for txn in batch}
+        new_users = {
+            user_id for user_id in user_ids if user_id not in self._known_users
+        }
+        with stage("db_flush"):
+            async with self.session_maker() as session:
+                await register_users(session, new_users)
+                await session.execute(
+                    insert(Transaction), [txn.model_dump() for txn in batch]
+                )
+                await upsert_rollups(session, rollup_rows(batch))
+                await session.commit()
+        self._remember_users(user_ids)
+
+    def _remember_users(self, user_ids: set[uuid.UUID]) -> None:
+        for user_id in user_ids:
+            self._known_users[user_id] = None
+            self._known_users.move_to_end(user_id)
+        while len(self._known_users) > self.max_known_users:
+            self._known_users.popitem(last=False)
+
+
+_writer: TransactionBatchWriter | None = None
+
+
+def init_batch_writer() -> TransactionBatchWriter:
+    """
+    Creates and starts the process-wide batch writer.
+    Called once from the application lifespan.
+    """
+    global _writer
+    if _writer is None:
+        _writer = TransactionBatchWriter(
+            AsyncSessionMaker,
+            max_batch_size=CONFIG.TXN_BATCH_MAX_ROWS,
+            flush_interval_ms=CONFIG.TXN_BATCH_FLUSH_INTERVAL_MS,
+            max_queue_size=CONFIG.TXN_BATCH_QUEUE_SIZE,
+            redis_client=redis.Redis(connection_pool=get_redis_pool()),
+            max_retries=CONFIG.TXN_BATCH_MAX_RETRIES,
+            retry_backoff_ms=CONFIG.TXN_BATCH_RETRY_BACKOFF_MS,
+        )
+        _writer.start()
+    return _writer
+
+
+async def close_batch_writer() -> None:
+    """Flushes pending transactions before the application shuts down."""
+    global _writer
+    if _writer is not None:
+        await _writer.stop()
+        _writer = None
+
+
+def get_batch_writer() -> TransactionBatchWriter:
+    if _writer is None:
+        raise RuntimeError("Transaction batch writer has not been initialised.")
+    return _writer
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from collections.abc import Awaitable, Callable
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.config import CONFIG
+from src.models import TransactionFilters
+from src.redis import lua_script
+
+logger = logging.getLogger(__name__)
+
+# Reads the user's version counter and the page cached under that version in
+# a single round trip. Returns [version, page or false].
+_READ_SCRIPT = lua_script("""
+local version = redis.call('GET', KEYS[1]) or '0'
+local page = redis.call('GET', ARGV[1] .. version .. ':' .. ARGV[2])
+return {version, page}
+""")
+
+
+def transactions_version_key(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}:txn_version"
+
+
+def _page_key_prefix(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}:txn_pages:"
+
+
+def _filters_digest(params: TransactionFilters) -> str:
+    normalized = json.dumps(params.model_dump(mode="json"), sort_keys=True)
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+async def bump_transactions_version(
+    redis_client: Redis, user_ids: set[uuid.UUID]
+) -> None:
+    """
+    Invalidates every cached /transactions page of the given users.
+    Must be called after their new transactions are committed.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.incr(transactions_version_key(user_id))
+        await pipe.execute()
+
+
+class TransactionsCache:
+    """
+    Redis cache for /transactions responses.
+
+    Pages are keyed on the user's version counter plus a hash of the
+    normalized filters. Writers bump the counter, so invalidation is a single
+    INCR and a stale page is never served; old pages simply expire. Concurrent
+    misses for the same key in this process share one database query.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight: dict[str, asyncio.Future[str | bytes]] = {}
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+    async def get_or_compute(
+        self,
+        redis_client: Redis,
+        params: TransactionFilters,
+        compute: Callable[[], Awaitable[str | bytes]],
+    ) -> str | bytes:
+        """
+        Returns the cached JSON page for the filters, or computes and caches
+        it. Falls back to `compute` alone when Redis is unavailable.
+        """
+        prefix = _page_key_prefix(params.user_id)
+        digest = _filters_digest(params)
+        try:
+            version, page = await _READ_SCRIPT(
+                keys=[transactions_version_key(params.user_id)],
+                args=[prefix, digest],
+                client=redis_client,
+            )
+        except RedisError:
+            logger.warning("Transactions cache unavailable, querying the database")
+            return await compute()
+
+        if page:
+            self.hits += 1
+            return page
+        self.misses += 1
+
+        key = f"{prefix}{version}:{digest}"
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fill(redis_client, key, compute))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    async def _fill(
+        self,
+        redis_client: Redis,
+        key: str,
+        compute: Callable[[], Awaitable[str | bytes]],
+    ) -> str | bytes:
+        page = await compute()
+        try:
+            await redis_client.set(key, page, ex=self.ttl_seconds)
+        except RedisError:
+            logger.warning("Could not store a transactions page in the cache")
+        return page
+
+
+transactions_cache = TransactionsCache(CONFIG.TRANSACTIONS_CACHE_TTL_SECONDS)
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,5 +8,107 @@ class Settings(BaseSettings):
     POSTGRES_URL: str
     REDIS_URL: str
 
+    # Logging. Records go through a queue of LOG_QUEUE_SIZE to a writer
+    # thread and are dropped when it is full. Below WARNING, each logging
+    # call site is limited to LOG_RATE_LIMIT_PER_SECOND records, in bursts of
+    # LOG_RATE_LIMIT_BURST; a rate of 0 logs everything.
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: Literal["text", "json"] = "text"
+    LOG_QUEUE_SIZE: int = 10_000
+    LOG_RATE_LIMIT_PER_SECOND: float = 10.0
+    LOG_RATE_LIMIT_BURST: int = 20
+
+    # Database engine. The statement timeout is enforced by Postgres, 0 turns
+    # it off. Set the prepared statement cache size to 0 behind pgbouncer in
+    # transaction mode.
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+    DB_STATEMENT_TIMEOUT_MS: int = 30_000
+    DB_ECHO: bool = False
+    # Connections opened on startup, before the app reports ready
+    DB_PREWARM_CONNECTIONS: int = 5
+
+    # Optional read replica, used by the read-only endpoints
+    POSTGRES_READ_URL: str | None = None
+
+    # Anomaly detector: "rolling_mean" flags amounts above 5x the mean of the
+    # last 20. "ewma" and "welford" flag amounts ANOMALY_Z_THRESHOLD standard
+    # deviations above an exponentially weighted or a running mean. "mad"
+    # does the same with the median and median absolute deviation of the last
+    # ANOMALY_MAD_WINDOW amounts.
+    ANOMALY_DETECTOR: Literal["rolling_mean", "ewma", "welford", "mad"] = "rolling_mean"
+    ANOMALY_Z_THRESHOLD: float = 3.5
+    ANOMALY_EWMA_ALPHA: float = 0.1
+    ANOMALY_MAD_WINDOW: int = 50
+    # A state missing from Redis is rebuilt from the user's latest amounts,
+    # this many for "ewma" and "welford", a window's worth for the others
+    ANOMALY_REBUILD_HISTORY: int = 500
+
+    # Redis connection pool
+    REDIS_MAX_CONNECTIONS: int = 100
+    REDIS_POOL_TIMEOUT_SECONDS: float = 5.0
+    REDIS_PREWARM_CONNECTIONS: int = 5
+
+    # Write-behind transaction inserts
+    TXN_BATCH_MAX_ROWS: int = 500
+    TXN_BATCH_FLUSH_INTERVAL_MS: int = 200
+    TXN_BATCH_QUEUE_SIZE: int = 10_000
+    # A failed batch is retried this many times, the backoff doubling each
+    # time, before its rows are dropped
+    TXN_BATCH_MAX_RETRIES: int = 3
+    TXN_BATCH_RETRY_BACKOFF_MS: int = 100
+
+    # "local" serves SSE clients from this process only. "redis" lets several
+    # workers share users: one worker holds a user's producer lease and
+    # publishes its events, every worker relays them to its own clients.
+    SSE_FANOUT_MODE: Literal["local", "redis"] = "local"
+    PRODUCER_LEASE_TTL_MS: int = 6_000
+
+    # SSE connection caps, beyond which new streams get a 429. Each client
+    # buffers at most SSE_QUEUE_SIZE frames, per user watched for stream
+    # sessions; a client that falls further
+    # behind loses its oldest frames ("drop_oldest") or is disconnected
+    # ("disconnect"). Idle streams get a comment every SSE_HEARTBEAT_SECONDS.
+    SSE_MAX_CONNECTIONS: int = 1000
+    SSE_MAX_CONNECTIONS_PER_USER: int = 5
+    SSE_QUEUE_SIZE: int = 100
+    SSE_SLOW_CONSUMER: Literal["drop_oldest", "disconnect"] = "drop_oldest"
+    SSE_HEARTBEAT_SECONDS: float = 15.0
+    # Users one multiplexed stream session may watch
+    SSE_MAX_SESSION_USERS: int = 1000
+
+    # Each user's latest events are kept in a Redis stream, from which
+    # reconnecting clients are replayed what followed their Last-Event-ID.
+    # The stream is trimmed to about SSE_REPLAY_MAXLEN events and expires
+    # SSE_REPLAY_TTL_SECONDS after the last one.
+    SSE_REPLAY_MAXLEN: int = 1000
+    SSE_REPLAY_TTL_SECONDS: int = 3600
+
+    # Largest batch accepted by POST /transactions/batch
+    TXN_INGEST_MAX_ROWS: int = 10_000
+    TXN_INGEST_MAX_BYTES: int = 8 * 1024 * 1024
+    # A batch holds its users' detector locks while it is scored and stored,
+    # for at most this long, so a user's detector state has a single writer.
+    # A batch waits this long for locks held by other batches or the simulator
+    TXN_INGEST_LEASE_TTL_MS: int = 30_000
+    TXN_INGEST_LEASE_WAIT_MS: int = 5_000
+
+    # Redis cache for GET /transactions
+    TRANSACTIONS_CACHE_ENABLED: bool = True
+    TRANSACTIONS_CACHE_TTL_SECONDS: int = 60
+
+    # Monthly partitions of the transactions table. Partitions are created
+    # this many months ahead. Those that ended more than the retention ago
+    # are detached and kept as plain tables, or dropped, no retention keeps
+    # everything.
+    TXN_PARTITIONS_AHEAD: int = 3
+    TXN_PARTITION_RETENTION_MONTHS: int | None = None
+    TXN_PARTITION_EXPIRY: Literal["detach", "drop"] = "detach"
+    TXN_PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 3600
+
 
 CONFIG = Settings()
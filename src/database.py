@@ -1,21 +1,102 @@
+import asyncio
 from collections.abc import AsyncGenerator
+from typing import Any
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from src.config import CONFIG
+from src.metrics import instrument_engine
 
-engine = create_async_engine(CONFIG.POSTGRES_URL, echo=True, future=True)
 
-AsyncSessionMaker = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
+def _engine_options(url: str) -> dict[str, Any]:
+    options: dict[str, Any] = {
+        "echo": CONFIG.DB_ECHO,
+        "pool_size": CONFIG.DB_POOL_SIZE,
+        "max_overflow": CONFIG.DB_MAX_OVERFLOW,
+        "pool_timeout": CONFIG.DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": CONFIG.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": CONFIG.DB_POOL_PRE_PING,
+    }
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            "prepared_statement_cache_size": CONFIG.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            "server_settings": {
+                "application_name": "anomaly-detector",
+                # 0 disables the timeout in Postgres as well
+                "statement_timeout": str(CONFIG.DB_STATEMENT_TIMEOUT_MS),
+            },
+        }
+    return options
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    db_engine = create_async_engine(url, **_engine_options(url))
+    instrument_engine(db_engine)
+    return db_engine
+
+
+def _session_maker(db_engine: AsyncEngine) -> sessionmaker[AsyncSession]:
+    return sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=db_engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+    )
+
+
+engine = _create_engine(CONFIG.POSTGRES_URL)
+AsyncSessionMaker = _session_maker(engine)
+
+# Read-only endpoints use the replica when one is configured
+read_engine = (
+    _create_engine(CONFIG.POSTGRES_READ_URL) if CONFIG.POSTGRES_READ_URL else engine
+)
+AsyncReadSessionMaker = (
+    _session_maker(read_engine) if read_engine is not engine else AsyncSessionMaker
 )
 
 
+def _engines() -> list[AsyncEngine]:
+    return [engine] if read_engine is engine else [engine, read_engine]
+
+
+async def prewarm_engines(connections: int) -> None:
+    """
+    Opens up to `connections` connections on each engine, at most its pool
+    size, and returns them to the pool, so the first requests do not pay for
+    connecting. Every connection that was opened is returned, even when
+    others failed, and the first failure is raised afterwards.
+    """
+    for db_engine in _engines():
+        pool_size = getattr(db_engine.pool, "size", None)
+        count = min(connections, pool_size()) if pool_size else 1
+        results = await asyncio.gather(
+            *(db_engine.connect().start() for _ in range(count)),
+            return_exceptions=True,
+        )
+        conns = [conn for conn in results if not isinstance(conn, BaseException)]
+        try:
+            results += await asyncio.gather(
+                *(conn.execute(text("SELECT 1")) for conn in conns),
+                return_exceptions=True,
+            )
+        finally:
+            await asyncio.gather(*(conn.close() for conn in conns))
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+
+async def dispose_engines() -> None:
+    """Closes every pooled connection. Called from the application lifespan."""
+    for db_engine in _engines():
+        await db_engine.dispose()
+
+
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """
     Dependency to get an async database session.
@@ -23,3 +104,12 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """
     async with AsyncSessionMaker() as session:
         yield session
+
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency to get a session for read-only endpoints, on the read replica
+    if `POSTGRES_READ_URL` is set and on the primary otherwise.
+    """
+    async with AsyncReadSessionMaker() as session:
+        yield session
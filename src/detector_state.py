@@ -0,0 +1,127 @@
+import uuid
+from collections.abc import AsyncGenerator
+
+import numpy as np
+from redis.asyncio import Redis
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from src.detectors import Detector, DetectorState
+from src.models import Transaction
+
+
+def detector_state_key(user_id: uuid.UUID, detector: Detector) -> str:
+    """Each detector keeps its own hash, so switching detectors starts afresh."""
+    return f"user:{user_id}:detector:{detector.name}"
+
+
+async def load_detector_states(
+    redis_client: Redis,
+    detector: Detector,
+    user_ids: list[uuid.UUID],
+    db: AsyncSession | AsyncConnection | None = None,
+) -> dict[uuid.UUID, DetectorState]:
+    """
+    Reads the detector state of many users in a single round trip.
+
+    With `db`, the states missing from Redis, after a flush or a failover,
+    are rebuilt from the users' stored transactions in one query, so their
+    anomalies keep being detected. The rebuilt states are saved with the
+    next `save_detector_states`.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.hgetall(detector_state_key(user_id, detector))
+        results = await pipe.execute()
+    states = {
+        user_id: detector.load_state(fields)
+        for user_id, fields in zip(user_ids, results, strict=True)
+    }
+
+    missing = [
+        user_id for user_id, fields in zip(user_ids, results, strict=True) if not fields
+    ]
+    if db is not None and missing:
+        async for rebuilt in rebuild_states(db, detector, missing):
+            states.update(rebuilt)
+    return states
+
+
+async def save_detector_states(
+    redis_client: Redis, detector: Detector, states: dict[uuid.UUID, DetectorState]
+) -> None:
+    """Writes the detector state of many users in a single round trip."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id, state in states.items():
+            pipe.hset(
+                detector_state_key(user_id, detector),
+                mapping=detector.dump_state(state),
+            )
+        await pipe.execute()
+
+
+def recent_amounts_query(
+    history: int, user_ids: list[uuid.UUID] | None = None
+) -> Select:
+    """
+    Selects the last `history` amounts of every user, or of the given ones,
+    grouped by user and oldest first. The rows are ranked per user with
+    ROW_NUMBER(), so all users are served by one scan.
+    """
+    rank = (
+        func.row_number()
+        .over(
+            partition_by=Transaction.user_id,
+            order_by=(Transaction.txn_date.desc(), Transaction.id.desc()),
+        )
+        .label("rank")
+    )
+    ranked = select(Transaction.user_id, Transaction.amount, rank)
+    if user_ids is not None:
+        ranked = ranked.where(Transaction.user_id.in_(user_ids))
+    ranked = ranked.subquery()
+    return (
+        select(ranked.c.user_id, ranked.c.amount)
+        .where(ranked.c.rank <= history)
+        .order_by(ranked.c.user_id, ranked.c.rank.desc())
+    )
+
+
+async def rebuild_states(
+    db: AsyncSession | AsyncConnection,
+    detector: Detector,
+    user_ids: list[uuid.UUID] | None = None,
+    chunk_users: int = 1000,
+    fetch_size: int = 10_000,
+) -> AsyncGenerator[dict[uuid.UUID, DetectorState], None]:
+    """
+    Rebuilds the detector state of every user, or of the given ones, by
+    scoring their last `detector.history_size` stored amounts. Users without
+    transactions are left out. Yields the states `chunk_users` users at a time.
+    """
+    query = recent_amounts_query(detector.history_size, user_ids)
+    result = await db.stream(query.execution_options(yield_per=fetch_size))
+
+    chunk: dict[uuid.UUID, DetectorState] = {}
+    current: uuid.UUID | None = None
+    amounts_cents: list[int] = []
+
+    def finish_user() -> None:
+        state = detector.new_state()
+        detector.score_batch(np.array(amounts_cents, dtype=np.int64), state)
+        chunk[current] = state
+        amounts_cents.clear()
+
+    async for user_id, amount in result:
+        if user_id != current:
+            if current is not None:
+                finish_user()
+            if len(chunk) >= chunk_users:
+                yield chunk
+                chunk = {}
+            current = user_id
+        amounts_cents.append(int(amount.scaleb(2)))
+    if current is not None:
+        finish_user()
+    if chunk:
+        yield chunk
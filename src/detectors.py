@@ -0,0 +1,333 @@
+"""
+Anomaly detectors.
+
+Every detector keeps a small, fixed-size state per user and scores amounts
+in integer paise against the state built from the amounts before them. The
+live simulator and the offline scripts share `score_batch`, so a user's
+flags are the same whichever path scored them, and the state can be carried
+from one chunk or one event to the next.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, ClassVar
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.anomaly import (
+    MIN_TXNS_FOR_ANOMALY_CHECK,
+    ROLLING_WINDOW_SIZE,
+    rolling_anomaly_flags,
+)
+from src.config import CONFIG
+
+DetectorState = dict[str, Any]
+
+# Scales a median absolute deviation to a standard deviation for normal data
+MAD_TO_STD = 1.4826
+
+
+class Detector(ABC):
+    name: ClassVar[str]
+
+    @abstractmethod
+    def new_state(self) -> DetectorState:
+        """State of a user with no transactions yet."""
+
+    @abstractmethod
+    def score_batch(
+        self, amounts_cents: np.ndarray, state: DetectorState
+    ) -> np.ndarray:
+        """
+        Flags each amount against the state of the amounts before it, in
+        order, and advances `state` in place past the last one.
+
+        :return: A boolean array, True where the amount is an anomaly.
+        """
+
+    @abstractmethod
+    def typical_amount(self, state: DetectorState) -> float:
+        """The amount, in paise, the detector currently expects."""
+
+    @property
+    def history_size(self) -> int:
+        """
+        How many of a user's latest amounts rebuild their state. Exact for
+        the windowed detectors, an approximation for the others.
+        """
+        return CONFIG.ANOMALY_REBUILD_HISTORY
+
+    def score(self, amount_cents: int, state: DetectorState) -> bool:
+        """Single amount version of `score_batch`."""
+        flags = self.score_batch(np.array([amount_cents], dtype=np.int64), state)
+        return bool(flags[0])
+
+    def dump_state(self, state: DetectorState) -> dict[str, str]:
+        """Serializes the state to the fields of a Redis hash."""
+        return {
+            field: _dump_window(value) if isinstance(value, np.ndarray) else repr(value)
+            for field, value in state.items()
+        }
+
+    def load_state(self, fields: dict[str, str]) -> DetectorState:
+        """Reverse of `dump_state`. An empty hash gives a new state."""
+        state = self.new_state()
+        for field, default in state.items():
+            if field not in fields:
+                continue
+            if isinstance(default, np.ndarray):
+                state[field] = _load_window(fields[field])
+            else:
+                state[field] = type(default)(fields[field])
+        return state
+
+
+def _dump_window(window: np.ndarray) -> str:
+    return ",".join(map(str, window.tolist()))
+
+
+def _load_window(value: str) -> np.ndarray:
+    if not value:
+        return np.empty(0, dtype=np.int64)
+    return np.array(value.split(","), dtype=np.int64)
+
+
+class RollingMeanDetector(Detector):
+    """
+    Flags an amount above `ANOMALY_MULTIPLIER` times the mean of the last
+    `ROLLING_WINDOW_SIZE` amounts. State: those amounts.
+    """
+
+    name = "rolling_mean"
+
+    def new_state(self) -> DetectorState:
+        return {"window": np.empty(0, dtype=np.int64)}
+
+    def score_batch(
+        self, amounts_cents: np.ndarray, state: DetectorState
+    ) -> np.ndarray:
+        flags = rolling_anomaly_flags(amounts_cents, state["window"])
+        window = np.concatenate([state["window"], amounts_cents])
+        state["window"] = window[-ROLLING_WINDOW_SIZE:].astype(np.int64)
+        return flags
+
+    @property
+    def history_size(self) -> int:
+        return ROLLING_WINDOW_SIZE
+
+    def typical_amount(self, state: DetectorState) -> float:
+        window = state["window"]
+        return float(window.mean()) if len(window) else 0.0
+
+
+def _linear_recurrence(inputs: np.ndarray, decay: float, initial: float) -> np.ndarray:
+    """
+    Returns y where y[t] = decay * y[t - 1] + inputs[t] and y[-1] = initial.
+
+    Solved in closed form one block at a time, which keeps the powers of
+    `decay` in range.
+    """
+    block = 64
+    powers = decay ** np.arange(block + 1)
+    out = np.empty(len(inputs), dtype=np.float64)
+    previous = initial
+    for start in range(0, len(inputs), block):
+        chunk = inputs[start : start + block]
+        size = len(chunk)
+        # y[t] = decay^(t+1) * previous + sum over i <= t of decay^(t-i) * u[i]
+        carried = powers[1 : size + 1] * previous
+        accumulated = powers[:size] * np.cumsum(chunk / powers[:size])
+        out[start : start + size] = carried + accumulated
+        previous = out[start + size - 1]
+    return out
+
+
+def _before(initial: float, after: np.ndarray) -> np.ndarray:
+    """Shifts per-amount values seen after each amount to before it."""
+    return np.concatenate([[initial], after[:-1]])
+
+
+class EWMADetector(Detector):
+    """
+    Flags an amount more than `threshold` standard deviations above an
+    exponentially weighted mean. State: count, mean and variance.
+    """
+
+    name = "ewma"
+
+    def __init__(self, alpha: float, threshold: float):
+        if not 0 < alpha <= 0.9:
+            raise ValueError("alpha must be in (0, 0.9]")
+        self.alpha = alpha
+        self.threshold = threshold
+
+    def new_state(self) -> DetectorState:
+        return {"count": 0, "mean": 0.0, "var": 0.0}
+
+    def score_batch(
+        self, amounts_cents: np.ndarray, state: DetectorState
+    ) -> np.ndarray:
+        if len(amounts_cents) == 0:
+            return np.zeros(0, dtype=bool)
+        amounts = amounts_cents.astype(np.float64)
+        alpha, decay = self.alpha, 1 - self.alpha
+        # The first amount of a user seeds the mean
+        mean = state["mean"] if state["count"] else float(amounts[0])
+
+        means = _linear_recurrence(alpha * amounts, decay, mean)
+        means_before = _before(mean, means)
+        deviations = amounts - means_before
+        variances = _linear_recurrence(
+            decay * alpha * deviations**2, decay, state["var"]
+        )
+        variances_before = _before(state["var"], variances)
+        counts_before = state["count"] + np.arange(len(amounts))
+
+        state["count"] += len(amounts)
+        state["mean"] = float(means[-1])
+        state["var"] = float(variances[-1])
+        return (counts_before >= MIN_TXNS_FOR_ANOMALY_CHECK) & (
+            deviations > self.threshold * np.sqrt(variances_before)
+        )
+
+    def typical_amount(self, state: DetectorState) -> float:
+        return state["mean"]
+
+
+class WelfordDetector(Detector):
+    """
+    Flags an amount more than `threshold` standard deviations above the mean
+    of every amount before it. State: Welford's count, mean and sum of
+    squared deviations. A batch is merged in one step with Chan's update.
+    """
+
+    name = "welford"
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+    def new_state(self) -> DetectorState:
+        return {"count": 0, "mean": 0.0, "m2": 0.0}
+
+    def score_batch(
+        self, amounts_cents: np.ndarray, state: DetectorState
+    ) -> np.ndarray:
+        if len(amounts_cents) == 0:
+            return np.zeros(0, dtype=bool)
+        amounts = amounts_cents.astype(np.float64)
+        count, mean, m2 = state["count"], state["mean"], state["m2"]
+
+        # Prefix statistics of the batch, shifted to limit cancellation
+        shift = mean if count else float(amounts[0])
+        shifted = amounts - shift
+        sizes = np.arange(1, len(amounts) + 1)
+        sums = np.cumsum(shifted)
+        prefix_m2 = np.maximum(np.cumsum(shifted**2) - sums**2 / sizes, 0.0)
+
+        totals = count + sizes
+        delta = sums / sizes - (mean - shift)
+        means = mean + delta * sizes / totals
+        m2s = m2 + prefix_m2 + delta**2 * count * sizes / totals
+
+        counts_before = totals - 1
+        means_before = _before(mean, means)
+        m2s_before = _before(m2, m2s)
+        stds_before = np.sqrt(m2s_before / np.maximum(counts_before - 1, 1))
+
+        state["count"] = int(totals[-1])
+        state["mean"] = float(means[-1])
+        state["m2"] = float(m2s[-1])
+        return (counts_before >= MIN_TXNS_FOR_ANOMALY_CHECK) & (
+            amounts - means_before > self.threshold * stds_before
+        )
+
+    def typical_amount(self, state: DetectorState) -> float:
+        return state["mean"]
+
+
+class MADDetector(Detector):
+    """
+    Flags an amount more than `threshold` robust standard deviations above
+    the median of the last `window` amounts, the deviation being estimated
+    from their median absolute deviation. Large spikes barely move either,
+    unlike a mean. State: those amounts.
+    """
+
+    name = "mad"
+
+    # Windows whose medians are computed at once, bounds the memory used
+    _CHUNK = 4096
+
+    def __init__(self, window: int, threshold: float):
+        self.window = window
+        self.threshold = threshold
+
+    def new_state(self) -> DetectorState:
+        return {"window": np.empty(0, dtype=np.int64)}
+
+    def score_batch(
+        self, amounts_cents: np.ndarray, state: DetectorState
+    ) -> np.ndarray:
+        history = state["window"]
+        values = np.concatenate([history, amounts_cents]).astype(np.int64)
+        # Amount i is scored against values[max(0, p - window):p]
+        positions = np.arange(len(history), len(values))
+        medians = np.zeros(len(positions))
+        mads = np.zeros(len(positions))
+
+        # Users with fewer amounts than a window
+        short = positions < self.window
+        for i in np.flatnonzero(short & (positions >= MIN_TXNS_FOR_ANOMALY_CHECK)):
+            median, mad = _median_mad(values[None, : positions[i]])
+            medians[i], mads[i] = median[0], mad[0]
+
+        full = np.flatnonzero(~short)
+        if len(full):
+            windows = sliding_window_view(values, self.window)
+            for start in range(0, len(full), self._CHUNK):
+                index = full[start : start + self._CHUNK]
+                medians[index], mads[index] = _median_mad(
+                    windows[positions[index] - self.window]
+                )
+
+        state["window"] = values[-self.window :]
+        counts = np.minimum(positions, self.window)
+        return (
+            (counts >= MIN_TXNS_FOR_ANOMALY_CHECK)
+            & (mads > 0)
+            & (amounts_cents - medians > self.threshold * MAD_TO_STD * mads)
+        )
+
+    @property
+    def history_size(self) -> int:
+        return self.window
+
+    def typical_amount(self, state: DetectorState) -> float:
+        window = state["window"]
+        return float(np.median(window)) if len(window) else 0.0
+
+
+def _median_mad(windows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    medians = np.median(windows, axis=1)
+    mads = np.median(np.abs(windows - medians[:, None]), axis=1)
+    return medians, mads
+
+
+DETECTORS: dict[str, type[Detector]] = {
+    detector.name: detector
+    for detector in (RollingMeanDetector, EWMADetector, WelfordDetector, MADDetector)
+}
+
+
+def create_detector(name: str | None = None) -> Detector:
+    """Builds the detector `name`, `ANOMALY_DETECTOR` by default, from the settings."""
+    name = name or CONFIG.ANOMALY_DETECTOR
+    if name == EWMADetector.name:
+        return EWMADetector(CONFIG.ANOMALY_EWMA_ALPHA, CONFIG.ANOMALY_Z_THRESHOLD)
+    if name == WelfordDetector.name:
+        return WelfordDetector(CONFIG.ANOMALY_Z_THRESHOLD)
+    if name == MADDetector.name:
+        return MADDetector(CONFIG.ANOMALY_MAD_WINDOW, CONFIG.ANOMALY_Z_THRESHOLD)
+    if name == RollingMeanDetector.name:
+        return RollingMeanDetector()
+    raise ValueError(f"Unknown anomaly detector: {name}")
@@ -0,0 +1,95 @@
+import re
+import uuid
+
+from redis.asyncio import Redis
+
+from src.redis import lua_script
+
+# Appends an event to the user's capped stream and refreshes its expiry. With
+# a channel, also publishes the event as "<id>\n<data>" for the other workers.
+# The channel is an argument, not a key, so the only key is the stream and the
+# script runs on Redis Cluster. Returns the event id assigned by Redis.
+_APPEND_SCRIPT = lua_script("""
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'data', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if ARGV[4] then
+    redis.call('PUBLISH', ARGV[4], id .. '\\n' .. ARGV[2])
+end
+return id
+""")
+
+_EVENT_ID = re.compile(r"\d+-\d+")
+
+
+def event_stream_key(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}:event_stream"
+
+
+def events_channel(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}:events"
+
+
+def format_event(event_id: str, data: str) -> str:
+    """SSE frame of an event, its id is what a client sends as Last-Event-ID."""
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+def frame_event_id(frame: str) -> str | None:
+    """Id of an event frame, None for comments and other frames."""
+    if not frame.startswith("id: "):
+        return None
+    return frame[4 : frame.index("\n")]
+
+
+def parse_published(message: str) -> str:
+    """SSE frame of an event published by `append_events`."""
+    event_id, data = message.split("\n", 1)
+    return format_event(event_id, data)
+
+
+def is_event_id(value: str) -> bool:
+    return _EVENT_ID.fullmatch(value) is not None
+
+
+def event_id_order(event_id: str) -> tuple[int, int]:
+    """Sort key of a stream id, ids of one stream increase in this order."""
+    millis, sequence = event_id.split("-")
+    return int(millis), int(sequence)
+
+
+async def append_events(
+    redis_client: Redis,
+    events: dict[uuid.UUID, str],
+    maxlen: int,
+    ttl_seconds: int,
+    publish: bool = False,
+) -> dict[uuid.UUID, str]:
+    """
+    Appends each user's event to their replay stream in one round trip,
+    publishing it to the user's channel as well if `publish` is set.
+
+    :return: The id of each user's event.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id, data in events.items():
+            args = [maxlen, data, ttl_seconds]
+            if publish:
+                args.append(events_channel(user_id))
+            await _APPEND_SCRIPT(
+                keys=[event_stream_key(user_id)], args=args, client=pipe
+            )
+        event_ids = await pipe.execute()
+    return dict(zip(events, event_ids, strict=True))
+
+
+async def read_events_after(
+    redis_client: Redis, user_id: uuid.UUID, last_event_id: str, count: int
+) -> list[str]:
+    """
+    Returns the frames of the user's events after `last_event_id`, oldest
+    first, as far back as the stream still holds them.
+    """
+    entries = await redis_client.xrange(
+        event_stream_key(user_id), min=f"({last_event_id}", count=count
+    )
+    return [format_event(event_id, fields["data"]) for event_id, fields in entries]
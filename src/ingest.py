@@ -0,0 +1,245 @@
+import json
+import logging
+import uuid
+from collections import Counter, defaultdict
+from datetime import UTC
+
+import numpy as np
+import orjson
+from pydantic import TypeAdapter
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.cache import bump_transactions_version
+from src.config import CONFIG
+from src.detector_state import load_detector_states, save_detector_states
+from src.detectors import Detector, DetectorState
+from src.leases import detector_lock_key, release_leases, wait_for_leases
+from src.metrics import stage
+from src.models import Transaction, TransactionCreate
+from src.rollups import rollup_rows, upsert_rollups
+from src.user_registry import register_users
+
+logger = logging.getLogger(__name__)
+
+_ROWS = TypeAdapter(list[TransactionCreate])
+
+COPY_COLUMNS = [
+    "id",
+    "user_id",
+    "amount",
+    "currency",
+    "txn_date",
+    "status",
+    "meta_data",
+]
+
+
+class BatchTooLargeError(Exception):
+    """Raised when a batch has more rows or bytes than a request may carry."""
+
+
+class DuplicateTransactionsError(Exception):
+    """
+    Raised when transaction ids repeat within a batch, or, with `stored`,
+    belong to transactions already stored.
+    """
+
+    def __init__(self, ids: list[uuid.UUID], stored: bool):
+        self.ids = ids
+        self.stored = stored
+        where = "already stored" if stored else "repeated in the batch"
+        super().__init__(f"Transaction ids {where}: {', '.join(map(str, ids))}")
+
+
+class UsersBusyError(Exception):
+    """
+    Raised when the detector state lock of some of a batch's users stayed
+    held by other batches, or the simulator, for as long as a batch waits.
+    """
+
+    def __init__(self, user_ids: list[uuid.UUID]):
+        self.user_ids = user_ids
+        super().__init__(
+            f"Transactions of users {', '.join(map(str, user_ids))} are being "
+            "produced or ingested by another request."
+        )
+
+
+def parse_transactions(
+    body: bytes, ndjson: bool, max_rows: int
+) -> list[TransactionCreate]:
+    """
+    Validates a JSON array, or one JSON object per line, in a single pass.
+    Raises a pydantic ValidationError locating every invalid row.
+
+    :raises BatchTooLargeError: If there are more than `max_rows` rows,
+        before any of them is validated.
+    """
+    if ndjson:
+        lines = [line for line in body.splitlines() if line.strip()]
+        if len(lines) > max_rows:
+            raise BatchTooLargeError(f"At most {max_rows} transactions per request.")
+        body = b"[" + b",".join(lines) + b"]"
+    try:
+        rows = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        # Let pydantic report where the JSON is invalid
+        rows = None
+    if isinstance(rows, list) and len(rows) > max_rows:
+        raise BatchTooLargeError(f"At most {max_rows} transactions per request.")
+    txns = _ROWS.validate_json(body) if rows is None else _ROWS.validate_python(rows)
+    for txn in txns:
+        if txn.txn_date.tzinfo is None:
+            txn.txn_date = txn.txn_date.replace(tzinfo=UTC)
+    return txns
+
+
+async def score_transactions(
+    redis_client: Redis,
+    detector: Detector,
+    txns: list[TransactionCreate],
+    db: AsyncSession | None = None,
+) -> tuple[list[bool], dict[uuid.UUID, DetectorState]]:
+    """
+    Scores the transactions against their users' detector state, read in one
+    pipelined call. Each user's rows are scored as one array, in txn_date
+    order, after everything scored for that user before. With `db`, states
+    missing from Redis are rebuilt from the stored transactions first.
+
+    :return: The flags in input order and the advanced states, not saved yet.
+    """
+    rows_by_user: dict[uuid.UUID, list[int]] = defaultdict(list)
+    for i, txn in enumerate(txns):
+        rows_by_user[txn.user_id].append(i)
+
+    states = await load_detector_states(redis_client, detector, list(rows_by_user), db)
+
+    flags = [False] * len(txns)
+    for user_id, rows in rows_by_user.items():
+        rows.sort(key=lambda i: txns[i].txn_date)
+        amounts_cents = np.array(
+            [int(txns[i].amount.scaleb(2)) for i in rows], dtype=np.int64
+        )
+        user_flags = detector.score_batch(amounts_cents, states[user_id])
+        for i, flag in zip(rows, user_flags.tolist(), strict=True):
+            flags[i] = flag
+    return flags, states
+
+
+async def check_duplicate_ids(db: AsyncSession, txns: list[TransactionCreate]) -> None:
+    """
+    Rejects a batch reusing a transaction id, so a retried batch fails
+    before it is scored again.
+
+    :raises DuplicateTransactionsError: If an id repeats or is already stored.
+    """
+    counts = Counter(txn.id for txn in txns)
+    repeated = [txn_id for txn_id, count in counts.items() if count > 1]
+    if repeated:
+        raise DuplicateTransactionsError(repeated, stored=False)
+    stored = await db.execute(select(Transaction.id).where(Transaction.id.in_(counts)))
+    stored_ids = list(dict.fromkeys(stored.scalars()))
+    if stored_ids:
+        raise DuplicateTransactionsError(stored_ids, stored=True)
+
+
+async def insert_transactions(db: AsyncSession, txns: list[TransactionCreate]) -> None:
+    """
+    Inserts the transactions with COPY on Postgres, or a multi-row INSERT
+    elsewhere, along with their users and daily rollups, and commits.
+    """
+    await register_users(db, {txn.user_id for txn in txns})
+    if db.bind.dialect.name == "postgresql":
+        conn = await db.connection()
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Transaction.__tablename__,
+            records=[
+                (
+                    txn.id,
+                    txn.user_id,
+                    txn.amount,
+                    txn.currency,
+                    txn.txn_date,
+                    txn.status,
+                    json.dumps(txn.meta_data),
+                )
+                for txn in txns
+            ],
+            columns=COPY_COLUMNS,
+        )
+    else:
+        await db.execute(insert(Transaction), [txn.model_dump() for txn in txns])
+    await upsert_rollups(db, rollup_rows(txns))
+    await db.commit()
+
+
+async def ingest_transactions(
+    db: AsyncSession,
+    redis_client: Redis,
+    detector: Detector,
+    txns: list[TransactionCreate],
+) -> list[bool]:
+    """
+    Scores and stores a batch of transactions, returns their anomaly flags.
+    The detector states are only saved once the rows are committed, so a
+    failed insert leaves them untouched. Once committed the batch counts as
+    ingested: failing to save the states or invalidate the cache is logged.
+
+    Each user's detector state is read, advanced and written back while the
+    batch holds the user's detector lock, which the simulator takes for its
+    ticks as well. Batches overlapping on some users wait for each other, for
+    up to `TXN_INGEST_LEASE_WAIT_MS`, rather than losing each other's updates.
+
+    :raises DuplicateTransactionsError: If a transaction id repeats or is
+        already stored.
+    :raises UsersBusyError: If the lock of one of the users stayed held for
+        the whole wait.
+    """
+    user_ids = list(dict.fromkeys(txn.user_id for txn in txns))
+    owner = f"ingest:{uuid.uuid4().hex}"
+    busy = await wait_for_leases(
+        redis_client,
+        user_ids,
+        owner,
+        CONFIG.TXN_INGEST_LEASE_TTL_MS,
+        CONFIG.TXN_INGEST_LEASE_WAIT_MS,
+        key=detector_lock_key,
+    )
+    if busy:
+        raise UsersBusyError(busy)
+    try:
+        return await _ingest_leased(db, redis_client, detector, txns)
+    finally:
+        try:
+            await release_leases(redis_client, user_ids, owner, detector_lock_key)
+        except RedisError:
+            logger.exception("Failed to release the ingest locks, they will expire")
+
+
+async def _ingest_leased(
+    db: AsyncSession,
+    redis_client: Redis,
+    detector: Detector,
+    txns: list[TransactionCreate],
+) -> list[bool]:
+    await check_duplicate_ids(db, txns)
+    with stage("ingest_score"):
+        flags, states = await score_transactions(redis_client, detector, txns, db)
+    for txn, flag in zip(txns, flags, strict=True):
+        txn.meta_data = {**(txn.meta_data or {}), "is_anomaly": flag}
+    with stage("ingest_insert"):
+        await insert_transactions(db, txns)
+
+    try:
+        await save_detector_states(redis_client, detector, states)
+    except RedisError:
+        logger.exception("Failed to save the detector state of ingested users")
+    try:
+        await bump_transactions_version(redis_client, set(states))
+    except RedisError:
+        logger.exception("Failed to invalidate cached transactions")
+    return flags
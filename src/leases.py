@@ -0,0 +1,113 @@
+import asyncio
+import random
+import uuid
+from collections.abc import Callable
+
+from redis.asyncio import Redis
+
+from src.redis import lua_script
+
+# Takes the lease if it is free, or extends it if we already hold it.
+# Returns 1 when the caller holds the lease afterwards, 0 otherwise.
+_ACQUIRE_SCRIPT = lua_script("""
+local owner = redis.call('GET', KEYS[1])
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+""")
+
+# Deletes the lease only if the caller still holds it
+_RELEASE_SCRIPT = lua_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def producer_lease_key(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}:producer_lease"
+
+
+def detector_lock_key(user_id: uuid.UUID) -> str:
+    """
+    Held around each read, advance and write back of a user's detector state,
+    by the simulator and by batch ingestion alike.
+    """
+    return f"user:{user_id}:detector_lock"
+
+
+async def acquire_leases(
+    redis_client: Redis,
+    user_ids: list[uuid.UUID],
+    owner: str,
+    ttl_ms: int,
+    key: Callable[[uuid.UUID], str] = producer_lease_key,
+) -> list[uuid.UUID]:
+    """
+    Acquires or renews the lease of every user in one round trip, the
+    producer lease unless another `key` is given.
+    Returns the users whose lease is held by `owner`.
+    """
+    if not user_ids:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            await _ACQUIRE_SCRIPT(
+                keys=[key(user_id)], args=[owner, ttl_ms], client=pipe
+            )
+        results = await pipe.execute()
+    return [user_id for user_id, held in zip(user_ids, results, strict=True) if held]
+
+
+async def wait_for_leases(
+    redis_client: Redis,
+    user_ids: list[uuid.UUID],
+    owner: str,
+    ttl_ms: int,
+    wait_ms: int,
+    key: Callable[[uuid.UUID], str] = producer_lease_key,
+) -> list[uuid.UUID]:
+    """
+    Acquires the lease of every user or of none, retrying with a jittered,
+    doubling backoff for up to `wait_ms`. Whatever was taken in a round that
+    missed some leases is released before the next one, so two callers
+    waiting for overlapping users cannot deadlock.
+
+    :return: The users whose lease is still held by someone else, empty once
+        `owner` holds them all.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_ms / 1000
+    backoff = 0.005
+    while True:
+        leased = await acquire_leases(redis_client, user_ids, owner, ttl_ms, key)
+        if len(leased) == len(user_ids):
+            return []
+        await release_leases(redis_client, leased, owner, key)
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return sorted(set(user_ids) - set(leased), key=str)
+        await asyncio.sleep(min(remaining, backoff * random.uniform(0.5, 1.5)))
+        backoff = min(backoff * 2, 0.05)
+
+
+async def release_leases(
+    redis_client: Redis,
+    user_ids: list[uuid.UUID],
+    owner: str,
+    key: Callable[[uuid.UUID], str] = producer_lease_key,
+) -> None:
+    """Releases the leases `owner` holds so another worker can take over."""
+    if not user_ids:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            await _RELEASE_SCRIPT(keys=[key(user_id)], args=[owner], client=pipe)
+        await pipe.execute()
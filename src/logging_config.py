@@ -1,15 +1,123 @@
+import atexit
+import copy
 import logging
 import logging.config
+import queue
+import threading
+import time
+from datetime import UTC, datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
+import orjson
 
-def setup_logging():
+from src.config import CONFIG
+from src.metrics import LOG_RECORDS_DROPPED
+
+_listener: QueueListener | None = None
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread, which does the actual I/O. When
+    the queue is full the record is dropped rather than waiting for room.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the arguments are merged here, as they may change once the
+        # call returns. The queue stays in process, so the traceback is left
+        # for the listener's formatters.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("queue_full").inc()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rate` records per second from each logging call
+    site, in bursts of up to `burst`. Warnings and errors always pass. The
+    first record let through after some were suppressed says how many.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # Call site -> (tokens, last refill, records suppressed since)
+        self._buckets: dict[tuple[str, int], tuple[float, float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, refilled, suppressed = self._buckets.get(site, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - refilled) * self.rate)
+            if tokens < 1:
+                self._buckets[site] = (tokens, now, suppressed + 1)
+                LOG_RECORDS_DROPPED.labels("rate_limited").inc()
+                return False
+            self._buckets[site] = (tokens - 1, now, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, for log collectors."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=UTC),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return orjson.dumps(entry, option=orjson.OPT_UTC_Z).decode()
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging() -> QueueListener:
     """
     Configures logging for the application using Python's standard logging module.
+
+    Loggers only put records on a bounded queue, a listener thread formats
+    and writes them, so console and file I/O never run on the event loop.
+    Returns the listener, which is stopped, flushing the queue, at exit.
     """
+    global _listener
+    if _listener is None:
+        atexit.register(_stop_listener)
+    else:
+        _stop_listener()
+
     # Create logs directory if it doesn't exist
     Path("logs").mkdir(exist_ok=True)
 
+    formatter = "json" if CONFIG.LOG_FORMAT == "json" else "default"
+    queue_filters = []
+    if CONFIG.LOG_RATE_LIMIT_PER_SECOND > 0:
+        queue_filters.append("rate_limit")
+
     # Define the logging configuration dictionary
     LOGGING_CONFIG = {
         "version": 1,
@@ -18,26 +126,44 @@ def setup_logging():
             "default": {
                 "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
             },
+            "json": {"()": JSONFormatter},
+        },
+        "filters": {
+            "rate_limit": {
+                "()": RateLimitFilter,
+                "rate": CONFIG.LOG_RATE_LIMIT_PER_SECOND,
+                "burst": CONFIG.LOG_RATE_LIMIT_BURST,
+            },
         },
         "handlers": {
             "console": {
                 "class": "logging.StreamHandler",
-                "level": "INFO",
-                "formatter": "default",
+                "level": CONFIG.LOG_LEVEL,
+                "formatter": formatter,
             },
             "error_file": {
                 "class": "logging.handlers.RotatingFileHandler",
                 "level": "ERROR",
-                "formatter": "default",
+                "formatter": formatter,
                 "filename": "logs/error.log",
                 "maxBytes": 1024 * 1024,  # 1 MB
                 "backupCount": 10,
                 "encoding": "utf8",
             },
+            "queue": {
+                "class": "src.logging_config.NonBlockingQueueHandler",
+                "handlers": ["console", "error_file"],
+                "queue": {"()": queue.Queue, "maxsize": CONFIG.LOG_QUEUE_SIZE},
+                "respect_handler_level": True,
+                "filters": queue_filters,
+            },
         },
-        "root": {"level": "INFO", "handlers": ["console", "error_file"]},
+        "root": {"level": CONFIG.LOG_LEVEL, "handlers": ["queue"]},
     }
 
     # Apply the configuration
     logging.config.dictConfig(LOGGING_CONFIG)
+    _listener = logging.getHandlerByName("queue").listener
+    _listener.start()
     logging.getLogger(__name__).info("Logging configured.")
+    return _listener
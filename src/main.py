@@ -1,42 +1,167 @@
+import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import APIRouter, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 
+from src import IMPORT_STARTED
+from src.batch_writer import close_batch_writer, init_batch_writer
+from src.config import CONFIG
+from src.database import dispose_engines, prewarm_engines
 from src.logging_config import setup_logging
+from src.metrics import STARTUP_SECONDS
+from src.partitions import close_partition_maintenance, init_partition_maintenance
+from src.redis import close_redis_pool, init_redis_pool, prewarm_redis_pool
+from src.responses import ORJSONResponse
+from src.routers.metrics import router as metrics_router
 from src.routers.sse import router as sse_router
 from src.routers.transaction import router as transaction_router
 from src.routers.users import router as users_router
+from src.simulator import close_simulator, init_simulator
+from src.sse import close_connection_manager, init_connection_manager
 
-setup_logging()
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+STARTUP_SECONDS.labels("import").set(IMPORT_SECONDS)
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    title="Anomaly Detector",
-    description="Transaction anomaly detection",
-)
+router = APIRouter()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# First wait before retrying a failed prewarm, doubled up to the maximum
+PREWARM_RETRY_SECONDS = 1.0
+PREWARM_RETRY_MAX_SECONDS = 30.0
 
-app.include_router(transaction_router)
-app.include_router(sse_router)
-app.include_router(users_router)
 
+async def _prewarm() -> list[str]:
+    """
+    Opens the database and Redis connections the first requests would
+    otherwise wait for. Returns the targets that failed, which are logged.
+    """
+    results = await asyncio.gather(
+        prewarm_engines(CONFIG.DB_PREWARM_CONNECTIONS),
+        prewarm_redis_pool(CONFIG.REDIS_PREWARM_CONNECTIONS),
+        return_exceptions=True,
+    )
+    failed = []
+    for target, result in zip(("database", "redis"), results, strict=True):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not prewarm the {target} connections: {result}")
+            failed.append(target)
+    return failed
 
-@app.get("/", include_in_schema=False)
+
+async def _retry_prewarm(app: FastAPI) -> None:
+    """Retries a failed prewarm with a doubling backoff until it succeeds."""
+    delay = PREWARM_RETRY_SECONDS
+    while app.state.prewarm_failed:
+        await asyncio.sleep(delay)
+        app.state.prewarm_failed = await _prewarm()
+        delay = min(delay * 2, PREWARM_RETRY_MAX_SECONDS)
+    logger.info("Prewarmed the connections after retrying")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    init_redis_pool()
+    app.state.prewarm_failed = await _prewarm()
+    retry_task = None
+    if app.state.prewarm_failed:
+        retry_task = asyncio.create_task(_retry_prewarm(app), name="prewarm-retry")
+    init_partition_maintenance()
+    init_batch_writer()
+    init_simulator()
+    init_connection_manager()
+    # Built now rather than by the first request for the docs
+    app.openapi()
+
+    startup_seconds = time.perf_counter() - started
+    STARTUP_SECONDS.labels("startup").set(startup_seconds)
+    app.state.startup_seconds = startup_seconds
+    app.state.ready = True
+    logger.info(
+        f"Started in {startup_seconds:.3f}s, importing took {IMPORT_SECONDS:.3f}s"
+    )
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        if retry_task is not None:
+            retry_task.cancel()
+            try:
+                await retry_task
+            except asyncio.CancelledError:
+                pass
+        close_connection_manager()
+        await close_simulator()
+        await close_batch_writer()
+        await close_partition_maintenance()
+        await close_redis_pool()
+        await dispose_engines()
+
+
+@router.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse(url="/docs")
 
 
-@app.get("/health")
+@router.get("/health")
 async def health():
-    logger.info("Health check endpoint was called.")
+    logger.debug("Health check endpoint was called.")
     return {"health": "ok"}
+
+
+@router.get("/ready")
+async def ready(request: Request):
+    """
+    Readiness probe: 200 once startup, connection prewarming included, has
+    finished, 503 before that and once shutdown has begun. A failed prewarm
+    is retried in the background, the probe answers 503 until it succeeds.
+    """
+    state = request.app.state
+    if not state.ready:
+        return ORJSONResponse({"ready": False}, status_code=503)
+    if state.prewarm_failed:
+        return ORJSONResponse(
+            {"ready": False, "prewarm_failed": state.prewarm_failed},
+            status_code=503,
+        )
+    return {
+        "ready": True,
+        "import_seconds": IMPORT_SECONDS,
+        "startup_seconds": request.app.state.startup_seconds,
+    }
+
+
+def create_app() -> FastAPI:
+    """Builds the application. Its services start and stop with the lifespan."""
+    setup_logging()
+
+    app = FastAPI(
+        title="Anomaly Detector",
+        description="Transaction anomaly detection",
+        lifespan=lifespan,
+    )
+    app.state.ready = False
+    app.state.prewarm_failed = []
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.include_router(router)
+    app.include_router(transaction_router)
+    app.include_router(sse_router)
+    app.include_router(users_router)
+    app.include_router(metrics_router)
+    return app
+
+
+app = create_app()
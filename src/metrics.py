@@ -0,0 +1,108 @@
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.context_managers import Timer
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# 100 µs to 2.5 s, most stages take well under a millisecond
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+STAGE_SECONDS = Histogram(
+    "anomaly_stage_duration_seconds",
+    "Time spent in each stage of the hot paths",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_STATEMENT_SECONDS = Histogram(
+    "anomaly_db_statement_duration_seconds",
+    "Execution time of database statements, by statement type",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+STARTUP_SECONDS = Gauge(
+    "anomaly_startup_seconds",
+    "Time taken to import the application and to run its startup",
+    ["phase"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "anomaly_log_records_dropped",
+    "Log records dropped by the rate limit or with the log queue full",
+    ["reason"],
+)
+TXN_BATCH_RETRIES = Counter(
+    "anomaly_txn_batch_retries", "Failed transaction batch inserts that were retried"
+)
+TXN_BATCH_ROWS_SHED = Counter(
+    "anomaly_txn_batch_rows_shed",
+    "Transactions dropped after their batch exhausted its retries",
+)
+SSE_CONNECTIONS = Gauge("anomaly_sse_connections", "Open SSE connections")
+SSE_REJECTIONS = Counter(
+    "anomaly_sse_rejections",
+    "SSE connections refused by a connection cap",
+    ["limit"],
+)
+SSE_DROPPED_FRAMES = Counter(
+    "anomaly_sse_dropped_frames", "Frames dropped from full SSE client queues"
+)
+SSE_EVICTIONS = Counter(
+    "anomaly_sse_evictions", "Slow SSE clients disconnected with a full queue"
+)
+
+_DB_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+# Labelled children are looked up once, recording is then a lock and two adds
+_stage_histograms: dict[str, Histogram] = {}
+_db_histograms: dict[str, Histogram] = {}
+
+
+def stage(name: str) -> Timer:
+    """
+    Times a block into the stage histogram.
+
+        with stage("simulate"):
+            ...
+    """
+    histogram = _stage_histograms.get(name)
+    if histogram is None:
+        histogram = _stage_histograms[name] = STAGE_SECONDS.labels(name)
+    return histogram.time()
+
+
+def _db_histogram(statement: str) -> Histogram:
+    operation = statement.lstrip()[:6].upper()
+    if operation not in _DB_OPERATIONS:
+        operation = "OTHER"
+    histogram = _db_histograms.get(operation)
+    if histogram is None:
+        histogram = _db_histograms[operation] = DB_STATEMENT_SECONDS.labels(operation)
+    return histogram
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Records the execution time of every statement run through `engine`."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        _db_histogram(statement).observe(elapsed)
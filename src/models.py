@@ -1,10 +1,19 @@
 import uuid
-from datetime import UTC, datetime, timedelta
+from datetime import UTC, date, datetime, timedelta
 from decimal import Decimal
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import BaseModel
-from sqlalchemy import JSON, TIMESTAMP, Index
+from pydantic import Field as PydanticField
+from sqlalchemy import (
+    DDL,
+    JSON,
+    TIMESTAMP,
+    Index,
+    PrimaryKeyConstraint,
+    event,
+    func,
+)
 from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlmodel import Column, Field, SQLModel
 
@@ -28,20 +37,94 @@ class Transaction(TransactionBase, table=True):
 
     __tablename__ = "transactions"
 
-    # Composite index for the primary query pattern
+    # Matches the (txn_date DESC, id DESC) sort key and the cursor of the
+    # primary query pattern, so a page is a backward range scan with no sort.
+    # On Postgres the table is range partitioned by txn_date, partitions are
+    # managed by src.partitions.
     __table_args__ = (
-        Index("ix_user_date_amount_id", "user_id", "txn_date", "amount", "id"),
+        PrimaryKeyConstraint("id", "txn_date"),
+        Index("ix_user_date_id", "user_id", "txn_date", "id"),
+        {"postgresql_partition_by": "RANGE (txn_date)"},
     )
 
     id: uuid.UUID = Field(
         default_factory=uuid.uuid4,
         primary_key=True,
-        index=True,
         nullable=False,
     )
+    # Part of the primary key, since a partitioned table's unique constraints
+    # have to include the partition key
+    txn_date: datetime = Field(
+        sa_column=Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False)
+    )
     user_id: uuid.UUID = Field(sa_column=Column(UUID(as_uuid=True), nullable=False))
 
 
+class TransactionCreate(TransactionBase):
+    """A row of POST /transactions/batch, the id is generated when omitted"""
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4)
+
+
+class IngestResult(BaseModel):
+    id: uuid.UUID
+    is_anomaly: bool
+
+
+class BatchIngestResponse(BaseModel):
+    inserted: int
+    anomalies: int
+    # In the order of the request rows
+    results: list[IngestResult]
+
+
+# Holds rows that fall outside every monthly partition, see src.partitions
+event.listen(
+    Transaction.__table__,
+    "after_create",
+    DDL(
+        f"CREATE TABLE {Transaction.__tablename__}_default "
+        f"PARTITION OF {Transaction.__tablename__} DEFAULT"
+    ).execute_if(dialect="postgresql"),
+)
+
+
+class User(SQLModel, table=True):
+    """Registry of users that have transactions, kept up to date on insert"""
+
+    __tablename__ = "users"
+
+    id: uuid.UUID = Field(sa_column=Column(UUID(as_uuid=True), primary_key=True))
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(tz=UTC),
+        sa_column=Column(
+            TIMESTAMP(timezone=True), nullable=False, server_default=func.now()
+        ),
+    )
+
+
+class DailyRollup(SQLModel, table=True):
+    """Per-user totals of one UTC day, updated with every insert"""
+
+    __tablename__ = "transaction_daily_rollups"
+
+    user_id: uuid.UUID = Field(sa_column=Column(UUID(as_uuid=True), primary_key=True))
+    day: date = Field(primary_key=True)
+    txn_count: int = 0
+    amount_sum: Decimal = Field(
+        default=Decimal("0.00"), max_digits=20, decimal_places=2
+    )
+    anomaly_count: int = 0
+    paid_count: int = 0
+    paid_amount: Decimal = Field(
+        default=Decimal("0.00"), max_digits=20, decimal_places=2
+    )
+    failed_count: int = 0
+    failed_amount: Decimal = Field(
+        default=Decimal("0.00"), max_digits=20, decimal_places=2
+    )
+
+
 class TransactionFilters(BaseModel):
     user_id: uuid.UUID
     from_date: datetime | None = datetime.now(tz=UTC) - timedelta(days=30)
@@ -52,10 +135,63 @@ class TransactionFilters(BaseModel):
     cursor: str | None = None
 
 
+class ExportFilters(TransactionFilters):
+    format: Literal["ndjson", "csv"] = "ndjson"
+    gzip: bool = False
+
+
 class ListTransactionsResponse(BaseModel):
     transactions: list[Transaction]
     cursor: str
 
 
+class SummaryFilters(BaseModel):
+    user_id: uuid.UUID
+    from_date: date | None = None
+    to_date: date | None = None
+    granularity: Literal["day", "month"] = "day"
+
+
+class SummaryBucket(BaseModel):
+    # First day of the bucket
+    period: date
+    txn_count: int
+    amount_sum: Decimal
+    anomaly_count: int
+    paid_count: int
+    paid_amount: Decimal
+    failed_count: int
+    failed_amount: Decimal
+
+
+class TransactionSummaryResponse(BaseModel):
+    user_id: uuid.UUID
+    granularity: Literal["day", "month"]
+    buckets: list[SummaryBucket]
+
+
+class UserFilters(BaseModel):
+    limit: int = PydanticField(default=100, ge=1, le=1000)
+    cursor: uuid.UUID | None = None
+    include_count: bool = False
+
+
 class ListUsersResponse(BaseModel):
     users: list[uuid.UUID]
+    cursor: str
+    count: int | None = None
+
+
+class StreamFilters(BaseModel):
+    user_id: list[uuid.UUID] = []
+    anomalies_only: bool = False
+
+
+class StreamSubscriptions(BaseModel):
+    user_ids: list[uuid.UUID]
+
+
+class StreamSessionResponse(BaseModel):
+    session_id: str
+    user_ids: list[uuid.UUID]
+    anomalies_only: bool
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import re
+import uuid
+from datetime import UTC, datetime
+from itertools import batched
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from src.cache import bump_transactions_version
+from src.config import CONFIG
+from src.database import engine
+from src.models import DailyRollup, Transaction
+from src.redis import get_redis_pool
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = Transaction.__tablename__
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+_PARTITION_NAME = re.compile(rf"^{PARENT_TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+# Arbitrary advisory lock key, so only one worker maintains partitions at a time
+_MAINTENANCE_LOCK_KEY = 7_204_511
+
+# Users whose cached pages are invalidated per Redis round trip
+_INVALIDATE_CHUNK = 1000
+
+
+def month_start(moment: datetime) -> datetime:
+    """Returns the start of the UTC month containing `moment`."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    moment = moment.astimezone(UTC)
+    return datetime(moment.year, moment.month, 1, tzinfo=UTC)
+
+
+def add_months(start: datetime, months: int) -> datetime:
+    index = start.year * 12 + start.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=UTC)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT_TABLE}_p{start:%Y_%m}"
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    """False for a transactions table created before partitioning was added."""
+    return bool(
+        await conn.scalar(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass(:parent))"
+            ),
+            {"parent": PARENT_TABLE},
+        )
+    )
+
+
+async def list_partitions(conn: AsyncConnection) -> list[datetime]:
+    """Returns the start of every monthly partition attached to the table."""
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:parent)"
+        ),
+        {"parent": PARENT_TABLE},
+    )
+    starts = []
+    for name in result.scalars():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            starts.append(datetime(int(match[1]), int(match[2]), 1, tzinfo=UTC))
+    return sorted(starts)
+
+
+async def create_partition(conn: AsyncConnection, start: datetime) -> str:
+    """
+    Creates the monthly partition starting at `start`.
+
+    Rows of that month already sitting in the default partition are moved
+    into the new table before it is attached, since Postgres refuses to
+    attach a range the default partition has rows for.
+    """
+    name = partition_name(start)
+    lower = start.isoformat()
+    upper = add_months(start, 1).isoformat()
+
+    await conn.execute(
+        text(
+            f"CREATE TABLE {name} "
+            f"(LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    await conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE txn_date >= :lower AND txn_date < :upper RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        {"lower": start, "upper": add_months(start, 1)},
+    )
+    await conn.execute(
+        text(
+            f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        )
+    )
+    return name
+
+
+async def ensure_partitions(
+    conn: AsyncConnection, start: datetime, end: datetime
+) -> list[str]:
+    """
+    Creates the missing monthly partitions covering `start` to `end`.
+    Returns the names of the partitions created.
+    """
+    existing = set(await list_partitions(conn))
+    created = []
+    month = month_start(start)
+    while month <= end:
+        if month not in existing:
+            created.append(await create_partition(conn, month))
+        month = add_months(month, 1)
+    return created
+
+
+async def users_with_rows(
+    conn: AsyncConnection, start: datetime, end: datetime
+) -> set[uuid.UUID]:
+    """
+    Returns the users with transactions from `start` up to `end`, read from
+    the daily rollups rather than by scanning the transactions.
+    """
+    result = await conn.execute(
+        select(DailyRollup.user_id)
+        .where(DailyRollup.day >= start.date(), DailyRollup.day < end.date())
+        .distinct()
+    )
+    return set(result.scalars())
+
+
+async def expire_partitions(
+    conn: AsyncConnection, before: datetime, drop: bool
+) -> tuple[list[str], set[uuid.UUID]]:
+    """
+    Detaches the monthly partitions that end at or before `before`, and
+    drops them when `drop` is set. Detached partitions stay around as plain
+    tables, ready to be archived.
+
+    :return: The names of the expired partitions and the users who had
+        transactions in them.
+    """
+    expired = []
+    users: set[uuid.UUID] = set()
+    for start in await list_partitions(conn):
+        end = add_months(start, 1)
+        if end > before:
+            continue
+        name = partition_name(start)
+        users |= await users_with_rows(conn, start, end)
+        await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+        if drop:
+            await conn.execute(text(f"DROP TABLE {name}"))
+        expired.append(name)
+    return expired, users
+
+
+async def maintain_partitions(
+    db_engine: AsyncEngine,
+    now: datetime | None = None,
+    redis_client: redis.Redis | None = None,
+) -> None:
+    """
+    Creates the partitions for the current month and `TXN_PARTITIONS_AHEAD`
+    months after it, then expires the ones past the retention. When a Redis
+    client is given, the cached /transactions pages of the users who had rows
+    in the expired partitions are invalidated once that is committed.
+    """
+    current = month_start(now or datetime.now(tz=UTC))
+    async with db_engine.begin() as conn:
+        locked = await conn.scalar(
+            select(func.pg_try_advisory_xact_lock(_MAINTENANCE_LOCK_KEY))
+        )
+        if not locked:
+            return
+        if not await is_partitioned(conn):
+            logger.warning(f"{PARENT_TABLE} is not partitioned, skipping maintenance")
+            return
+
+        created = await ensure_partitions(
+            conn, current, add_months(current, CONFIG.TXN_PARTITIONS_AHEAD)
+        )
+        expired: list[str] = []
+        expired_users: set[uuid.UUID] = set()
+        if CONFIG.TXN_PARTITION_RETENTION_MONTHS is not None:
+            expired, expired_users = await expire_partitions(
+                conn,
+                add_months(current, -CONFIG.TXN_PARTITION_RETENTION_MONTHS),
+                drop=CONFIG.TXN_PARTITION_EXPIRY == "drop",
+            )
+
+    if created:
+        logger.info(f"Created partitions: {', '.join(created)}")
+    if expired:
+        action = "Dropped" if CONFIG.TXN_PARTITION_EXPIRY == "drop" else "Detached"
+        logger.info(f"{action} partitions: {', '.join(expired)}")
+    if expired_users and redis_client is not None:
+        try:
+            for chunk in batched(expired_users, _INVALIDATE_CHUNK):
+                await bump_transactions_version(redis_client, set(chunk))
+        except RedisError:
+            logger.exception("Failed to invalidate cached transactions")
+
+
+class PartitionMaintainer:
+    """Runs `maintain_partitions` at startup and then on a fixed interval."""
+
+    def __init__(
+        self,
+        db_engine: AsyncEngine,
+        interval_seconds: int,
+        redis_client: redis.Redis | None = None,
+    ):
+        self.db_engine = db_engine
+        self.interval_seconds = interval_seconds
+        self.redis_client = redis_client
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="partition-maintenance")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await maintain_partitions(
+                    self.db_engine, redis_client=self.redis_client
+                )
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            await asyncio.sleep(self.interval_seconds)
+
+
+_maintainer: PartitionMaintainer | None = None
+
+
+def init_partition_maintenance() -> None:
+    """
+    Starts the partition maintenance task, on Postgres only.
+    Called once from the application lifespan.
+    """
+    global _maintainer
+    if _maintainer is None and engine.dialect.name == "postgresql":
+        _maintainer = PartitionMaintainer(
+            engine,
+            CONFIG.TXN_PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+            redis_client=redis.Redis(connection_pool=get_redis_pool()),
+        )
+        _maintainer.start()
+
+
+async def close_partition_maintenance() -> None:
+    global _maintainer
+    if _maintainer is not None:
+        await _maintainer.stop()
+        _maintainer = None
@@ -1,19 +1,116 @@
+import asyncio
+import time
 from collections.abc import AsyncGenerator
 
 import redis.asyncio as redis
+from redis.commands.core import AsyncScript
 
 from src.config import CONFIG
 
 
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """
+    Blocking connection pool that keeps track of how long callers wait
+    for a free connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(*args, **kwargs)
+        finally:
+            waited = time.perf_counter() - start
+            self.wait_count += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self) -> dict[str, int | float]:
+        """Returns a snapshot of the pool usage."""
+        return {
+            "max_connections": self.max_connections,
+            "in_use": len(self._in_use_connections),
+            "idle": len(self._available_connections),
+            "wait_count": self.wait_count,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+def lua_script(source: str) -> AsyncScript:
+    """
+    Wraps a Lua script once at import time instead of on every call. Its SHA1
+    is computed here; each call passes the client or pipeline to run it on,
+    and the script is loaded into Redis on first use.
+    """
+    return AsyncScript(None, source.encode("utf-8"))
+
+
+_pool: InstrumentedConnectionPool | None = None
+
+
+def init_redis_pool() -> InstrumentedConnectionPool:
+    """
+    Creates the process-wide Redis connection pool.
+    Called once from the application lifespan.
+    """
+    global _pool
+    if _pool is None:
+        _pool = InstrumentedConnectionPool.from_url(
+            CONFIG.REDIS_URL,
+            max_connections=CONFIG.REDIS_MAX_CONNECTIONS,
+            timeout=CONFIG.REDIS_POOL_TIMEOUT_SECONDS,
+            encoding="utf-8",
+            decode_responses=True,
+        )
+    return _pool
+
+
+async def prewarm_redis_pool(connections: int) -> None:
+    """
+    Opens up to `connections` connections, at most the pool size, and
+    returns them to the pool, so the first requests do not pay for connecting.
+    """
+    pool = get_redis_pool()
+    count = min(connections, pool.max_connections)
+    results = await asyncio.gather(
+        *(pool.get_connection() for _ in range(count)), return_exceptions=True
+    )
+    for result in results:
+        if not isinstance(result, BaseException):
+            await pool.release(result)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+async def close_redis_pool() -> None:
+    """Disconnects every connection held by the pool."""
+    global _pool
+    if _pool is not None:
+        await _pool.aclose()
+        _pool = None
+
+
+def get_redis_pool() -> InstrumentedConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Redis connection pool has not been initialised.")
+    return _pool
+
+
 async def get_redis() -> AsyncGenerator[redis.Redis, None]:
     """
     Dependency to get a Redis client.
-    Ensures the client is always closed after the request.
+    The client borrows connections from the shared pool, so closing it
+    does not close the underlying connections.
     """
-    redis_client = redis.from_url(
-        CONFIG.REDIS_URL, encoding="utf-8", decode_responses=True
-    )
+    redis_client = redis.Redis(connection_pool=get_redis_pool())
     try:
         yield redis_client
     finally:
-        await redis_client.close()
+        await redis_client.aclose()
@@ -0,0 +1,67 @@
+import uuid
+from collections.abc import Awaitable, Callable
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# UTC datetimes end in "Z", matching what pydantic writes for the same values
+_OPTIONS = orjson.OPT_UTC_Z
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        # Sent as a string, like pydantic does, so no precision is lost
+        return str(value)
+    if isinstance(value, uuid.UUID):
+        # asyncpg returns its own UUID subclass, which orjson does not accept
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encodes `content` with orjson. Datetimes and UUIDs are handled natively,
+    Decimals and UUID subclasses are written as strings.
+    """
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with `dumps`, without pydantic in the way."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class EventStreamResponse(StreamingResponse):
+    """
+    Server-sent events response. `on_close` is awaited however the stream
+    ends, even when the client is gone before the first frame is sent.
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(
+        self,
+        content: Any,
+        on_close: Callable[[], Awaitable[None]],
+        headers: dict[str, str] | None = None,
+        **kwargs: Any,
+    ):
+        headers = {
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",  # Disable nginx buffering
+            **(headers or {}),
+        }
+        super().__init__(content, headers=headers, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
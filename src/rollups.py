@@ -0,0 +1,144 @@
+import uuid
+from collections.abc import Iterable
+from datetime import UTC, date
+from decimal import Decimal
+from typing import Any
+
+from sqlalchemy import Date, Integer, case, cast, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from src.models import DailyRollup, Transaction, TransactionBase
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Summed into the existing row when a day is upserted
+ROLLUP_METRICS = [
+    "txn_count",
+    "amount_sum",
+    "anomaly_count",
+    "paid_count",
+    "paid_amount",
+    "failed_count",
+    "failed_amount",
+]
+
+
+def _dialect_name(db: AsyncSession | AsyncConnection) -> str:
+    dialect = db.bind.dialect if isinstance(db, AsyncSession) else db.dialect
+    return dialect.name
+
+
+def empty_rollup(user_id: uuid.UUID, day: date) -> dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "day": day,
+        "txn_count": 0,
+        "amount_sum": Decimal("0.00"),
+        "anomaly_count": 0,
+        "paid_count": 0,
+        "paid_amount": Decimal("0.00"),
+        "failed_count": 0,
+        "failed_amount": Decimal("0.00"),
+    }
+
+
+def rollup_rows(txns: Iterable[TransactionBase]) -> list[dict[str, Any]]:
+    """Aggregates transactions into one rollup row per user and UTC day."""
+    rollups: dict[tuple[uuid.UUID, date], dict[str, Any]] = {}
+    for txn in txns:
+        txn_date = txn.txn_date
+        if txn_date.tzinfo is not None:
+            txn_date = txn_date.astimezone(UTC)
+        key = (txn.user_id, txn_date.date())
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = empty_rollup(*key)
+
+        amount = Decimal(txn.amount)
+        rollup["txn_count"] += 1
+        rollup["amount_sum"] += amount
+        if (txn.meta_data or {}).get("is_anomaly"):
+            rollup["anomaly_count"] += 1
+        if txn.status in ("paid", "failed"):
+            rollup[f"{txn.status}_count"] += 1
+            rollup[f"{txn.status}_amount"] += amount
+    return list(rollups.values())
+
+
+async def upsert_rollups(
+    db: AsyncSession | AsyncConnection, rows: list[dict[str, Any]]
+) -> None:
+    """
+    Adds the given per-day totals to the rollup table. Runs inside the
+    caller's transaction, so the rollups commit with the transactions they
+    count.
+    """
+    if not rows:
+        return
+    insert = _INSERTS[_dialect_name(db)](DailyRollup).values(rows)
+    table = DailyRollup.__table__
+    await db.execute(
+        insert.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day],
+            set_={
+                metric: table.c[metric] + insert.excluded[metric]
+                for metric in ROLLUP_METRICS
+            },
+        )
+    )
+
+
+async def rebuild_rollups(
+    db: AsyncSession | AsyncConnection, user_ids: list[uuid.UUID] | None = None
+) -> None:
+    """
+    Recomputes the rollups of the given users, or of everyone, from the
+    transactions table in a single INSERT ... SELECT.
+
+    Only the days from each user's earliest stored transaction on are
+    replaced, so the rollups of expired partitions are kept.
+    """
+    if _dialect_name(db) == "postgresql":
+
+        def to_day(txn_date):
+            return cast(func.timezone("UTC", txn_date), Date)
+    else:
+        # SQLite stores the UTC timestamp as text
+        to_day = func.date
+    day = to_day(Transaction.txn_date)
+
+    is_anomaly = Transaction.meta_data["is_anomaly"].as_boolean()
+    is_paid = Transaction.status == "paid"
+    is_failed = Transaction.status == "failed"
+    zero = Decimal("0.00")
+
+    aggregate = select(
+        Transaction.user_id,
+        day,
+        func.count(),
+        func.sum(Transaction.amount),
+        func.sum(cast(case((is_anomaly, 1), else_=0), Integer)),
+        func.sum(case((is_paid, 1), else_=0)),
+        func.sum(case((is_paid, Transaction.amount), else_=zero)),
+        func.sum(case((is_failed, 1), else_=0)),
+        func.sum(case((is_failed, Transaction.amount), else_=zero)),
+    ).group_by(Transaction.user_id, day)
+
+    # NULL for users without stored transactions, whose rollups are all kept
+    first_day = (
+        select(to_day(func.min(Transaction.txn_date)))
+        .where(Transaction.user_id == DailyRollup.user_id)
+        .scalar_subquery()
+    )
+    clear = delete(DailyRollup).where(DailyRollup.day >= first_day)
+    if user_ids is not None:
+        aggregate = aggregate.where(Transaction.user_id.in_(user_ids))
+        clear = clear.where(DailyRollup.user_id.in_(user_ids))
+
+    await db.execute(clear)
+    await db.execute(
+        DailyRollup.__table__.insert().from_select(
+            ["user_id", "day", *ROLLUP_METRICS], aggregate
+        )
+    )
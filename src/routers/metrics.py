@@ -0,0 +1,125 @@
+from collections.abc import Iterator
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+from src.batch_writer import get_batch_writer
+from src.cache import transactions_cache
+from src.database import engine, read_engine
+from src.redis import get_redis_pool
+from src.simulator import get_simulator
+
+router = APIRouter()
+
+
+class RuntimeCollector(Collector):
+    """
+    Reports pool, simulator, batch writer and cache state. Everything is
+    read when Prometheus scrapes, so the hot paths pay nothing for it.
+    """
+
+    def collect(self) -> Iterator[Metric]:
+        engines = {"primary": engine}
+        if read_engine is not engine:
+            engines["replica"] = read_engine
+        pool_gauges = [
+            GaugeMetricFamily(name, documentation, labels=["database"])
+            for name, documentation in (
+                ("anomaly_db_pool_size", "Database pool size"),
+                ("anomaly_db_pool_checked_out", "Database connections in use"),
+                (
+                    "anomaly_db_pool_overflow",
+                    "Database connections open beyond the pool size",
+                ),
+            )
+        ]
+        for database, db_engine in engines.items():
+            pool = db_engine.pool
+            for gauge, value in zip(
+                pool_gauges, (pool.size(), pool.checkedout(), pool.overflow())
+            ):
+                gauge.add_metric([database], value)
+        yield from pool_gauges
+
+        try:
+            redis_stats = get_redis_pool().stats()
+        except RuntimeError:
+            redis_stats = None
+        if redis_stats is not None:
+            yield _gauge(
+                "anomaly_redis_pool_max_connections",
+                "Redis pool size",
+                redis_stats["max_connections"],
+            )
+            yield _gauge(
+                "anomaly_redis_pool_in_use",
+                "Redis connections in use",
+                redis_stats["in_use"],
+            )
+            yield _gauge(
+                "anomaly_redis_pool_idle", "Idle Redis connections", redis_stats["idle"]
+            )
+            yield _counter(
+                "anomaly_redis_pool_wait_seconds",
+                "Time spent waiting for a Redis connection",
+                redis_stats["wait_seconds_total"],
+            )
+
+        try:
+            simulator = get_simulator()
+        except RuntimeError:
+            simulator = None
+        if simulator is not None:
+            yield _gauge(
+                "anomaly_simulator_active_users",
+                "Users with at least one SSE subscriber in this worker",
+                simulator.active_users,
+            )
+            yield _gauge(
+                "anomaly_simulator_producing_users",
+                "Users this worker simulates transactions for",
+                simulator.producing_users,
+            )
+
+        try:
+            writer = get_batch_writer()
+        except RuntimeError:
+            writer = None
+        if writer is not None:
+            yield _gauge(
+                "anomaly_batch_writer_queued",
+                "Transactions waiting to be inserted",
+                writer.queued,
+            )
+
+        cache_stats = transactions_cache.stats()
+        for name in ("hits", "misses", "coalesced"):
+            yield _counter(
+                f"anomaly_transactions_cache_{name}",
+                f"Transactions cache {name}",
+                cache_stats[name],
+            )
+        yield _gauge(
+            "anomaly_transactions_cache_inflight",
+            "Transactions pages being computed",
+            cache_stats["inflight"],
+        )
+
+
+def _gauge(name: str, documentation: str, value: float) -> GaugeMetricFamily:
+    return GaugeMetricFamily(name, documentation, value=value)
+
+
+def _counter(name: str, documentation: str, value: float) -> CounterMetricFamily:
+    return CounterMetricFamily(name, documentation, value=value)
+
+
+REGISTRY.register(RuntimeCollector())
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Exposes every metric in the Prometheus text format."""
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -1,181 +1,182 @@
 import asyncio
 import logging
-import random
 import uuid
 from collections.abc import AsyncGenerator
-from datetime import UTC, datetime
-from decimal import Decimal
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from redis.asyncio import Redis
-from sqlalchemy.ext.asyncio import AsyncSession
+from redis.exceptions import RedisError
 
-from src.database import AsyncSessionMaker
-from src.models import Transaction
+from src.config import CONFIG
+from src.event_stream import frame_event_id, is_event_id, read_events_after
+from src.models import StreamFilters, StreamSessionResponse, StreamSubscriptions
 from src.redis import get_redis
+from src.responses import EventStreamResponse
+from src.sse import (
+    ConnectionLimitError,
+    SSEConnection,
+    StreamSession,
+    get_connection_manager,
+)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-# Simulation constants
-INTERVAL_SECONDS = 2
-ROLLING_WINDOW_SIZE = 20
-MIN_TXNS_FOR_ANOMALY_CHECK = 10
-ANOMALY_CHANCE = 0.35
-ANOMALY_MULTIPLIER = 5
-
-
-async def _get_rolling_mean(
-    redis_client: Redis, user_id: uuid.UUID
-) -> tuple[Decimal, list[Decimal]]:
-    """Fetches recent transaction amounts and calculates the rolling mean."""
-    redis_key = f"user:{user_id}:txn_amounts"
-    recent_amounts_str = await redis_client.lrange(redis_key, 0, -1)
-    recent_amounts = [Decimal(a) for a in recent_amounts_str]
-
-    if not recent_amounts:
-        return Decimal(0), []
-
-    rolling_mean = sum(recent_amounts) / len(recent_amounts)
-    return rolling_mean, recent_amounts
+async def event_generator(
+    connection: SSEConnection,
+    opening: list[str],
+    replayed_through: str | None = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Yields the server-sent events delivered to the connection.
+
+    The connection is subscribed to the shared simulator, which produces the
+    users' transactions and checks them for anomalies. The `opening` frames,
+    such as events missed since the client's Last-Event-ID, are sent first,
+    and live events up to `replayed_through` are skipped. Idle streams get a
+    heartbeat comment, and a client closed for falling behind gets an error
+    event before the stream ends.
+    """
+    watching = f"user {connection.user_id}" if connection.user_id else "a session"
+    try:
+        for frame in opening:
+            yield frame
+        async for frame in connection.frames(
+            CONFIG.SSE_HEARTBEAT_SECONDS, after=replayed_through
+        ):
+            yield frame
+        if connection.close_reason != "disconnected":
+            yield f"event: error\ndata: Disconnected: {connection.close_reason}\n\n"
 
+    except asyncio.CancelledError:
+        logger.info(f"Client for {watching} disconnected.")
+        raise
+    except Exception as e:
+        logger.exception(f"Fatal error in SSE event generator for {watching}")
+        yield f"event: error\ndata: Fatal error: {str(e)}\n\n"
 
-def _simulate_transaction_amount(
-    rolling_mean: Decimal, is_potential_anomaly: bool
-) -> Decimal:
-    """Simulates a new transaction amount, potentially as an anomaly."""
-    if is_potential_anomaly:
-        # Generate a significantly larger amount than the mean or a high random value
-        base_amount = max(float(rolling_mean) * ANOMALY_MULTIPLIER, 5000.0)
-        amount = Decimal(random.uniform(base_amount, base_amount * 2))
-    else:
-        # Generate a "normal" transaction amount
-        amount = Decimal(random.uniform(10.0, 500.0))
 
-    return amount.quantize(Decimal("0.01"))
+@router.get("/sse/transactions/{user_id}")
+async def sse_transactions(
+    user_id: uuid.UUID,
+    last_event_id: str | None = Header(None),
+    redis_client: Redis = Depends(get_redis),
+):
+    """
+    Establishes an SSE connection to stream simulated transactions for a user.
 
+    Each event carries its id. A reconnecting client sending the last one
+    it received as `Last-Event-ID` is first sent the events it missed, as
+    far back as the user's replay stream goes. Responds 429 when the server
+    or the user has too many open streams.
+    """
+    manager = get_connection_manager()
+    try:
+        connection = await manager.connect(user_id)
+    except ConnectionLimitError as e:
+        raise HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": "5"}
+        )
+
+    async def on_close() -> None:
+        await manager.disconnect(connection)
+        logger.info(f"Closing SSE connection for user {user_id}")
 
-def _is_anomaly(amount: Decimal, rolling_mean: Decimal, num_recent_txns: int) -> bool:
-    """Checks if a transaction is an anomaly based on the rolling mean."""
-    return (
-        num_recent_txns >= MIN_TXNS_FOR_ANOMALY_CHECK
-        and rolling_mean > 0
-        and amount > (ANOMALY_MULTIPLIER * rolling_mean)
+    # Read after subscribing, so no event falls between the replay and live
+    replay: list[str] = []
+    if last_event_id is not None and is_event_id(last_event_id):
+        try:
+            replay = await read_events_after(
+                redis_client, user_id, last_event_id, CONFIG.SSE_REPLAY_MAXLEN
+            )
+        except RedisError:
+            logger.exception(f"Error replaying events for user {user_id}")
+        except BaseException:
+            await on_close()
+            raise
+    replayed_through = frame_event_id(replay[-1]) if replay else None
+
+    logger.info(
+        f"SSE connection established for user {user_id}, replaying {len(replay)}"
+    )
+    return EventStreamResponse(
+        event_generator(connection, [": ping\n\n", *replay], replayed_through),
+        on_close=on_close,
     )
 
 
-async def _create_and_persist_transaction(
-    db: AsyncSession, user_id: uuid.UUID, amount: Decimal, is_anomaly: bool
-) -> Transaction:
-    """Creates a new Transaction object and saves it to the database."""
-    new_txn = Transaction(
-        user_id=user_id,
-        amount=amount,
-        currency="INR",
-        txn_date=datetime.now(tz=UTC),
-        status=random.choice(["paid", "failed"]),
-        meta_data={"is_anomaly": is_anomaly},
+def _session_response(session: StreamSession) -> StreamSessionResponse:
+    return StreamSessionResponse(
+        session_id=session.id,
+        user_ids=list(session.subscriptions),
+        anomalies_only=session.anomalies_only,
     )
-    db.add(new_txn)
-    await db.commit()
-    await db.refresh(new_txn)
-    return new_txn
 
 
-async def _update_rolling_window(
-    redis_client: Redis, user_id: uuid.UUID, amount: Decimal
-):
-    """Pushes the new transaction amount to Redis and trims the list."""
-    redis_key = f"user:{user_id}:txn_amounts"
-    await redis_client.lpush(redis_key, str(amount))
-    await redis_client.ltrim(redis_key, 0, ROLLING_WINDOW_SIZE - 1)
+def _get_stream_session(session_id: str) -> StreamSession:
+    session = get_connection_manager().get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Stream session not found.")
+    return session
 
 
-async def event_generator(
-    request: Request, user_id: uuid.UUID, redis_client: Redis
-) -> AsyncGenerator[str, None]:
+@router.get("/sse/transactions")
+async def sse_transactions_multiplexed(
+    params: Annotated[StreamFilters, Query()],
+):
     """
-    Generates and yields server-sent events for new transactions.
+    Streams the transactions of many users on one connection, optionally
+    only their anomalies. Each event is named `user:<user_id>`.
 
-    This function orchestrates the simulation of transaction creation, checks for
-    anomalies, and streams the results to the client. The process stops when the
-    client disconnects.
+    The first event, `session`, carries the session id with which users are
+    added and removed while the stream stays open. Sessions live in the
+    worker serving the stream, so those requests must reach the same worker.
     """
-    logger.info(f"Starting SSE connection for user {user_id}")
+    manager = get_connection_manager()
     try:
-        yield ": ping\n\n"
-
-        while True:
-            # Check for client disconnection
-            if await request.is_disconnected():
-                logger.info(
-                    f"Client for user {user_id} disconnected. Stopping simulation."
-                )
-                break
-
-            # Create new DB session for each transaction to avoid timeout issues
-            async with AsyncSessionMaker() as db:
-                try:
-                    # 1. Get historical data for anomaly check
-                    rolling_mean, recent_amounts = await _get_rolling_mean(
-                        redis_client, user_id
-                    )
-
-                    # 2. Simulate a new transaction amount
-                    is_potential_anomaly = random.random() < ANOMALY_CHANCE
-                    amount = _simulate_transaction_amount(
-                        rolling_mean, is_potential_anomaly
-                    )
-
-                    # 3. Check if it's an anomaly
-                    is_anomaly = _is_anomaly(amount, rolling_mean, len(recent_amounts))
-
-                    # 4. Create and save the transaction
-                    new_txn = await _create_and_persist_transaction(
-                        db, user_id, amount, is_anomaly
-                    )
-
-                    # 5. Update the rolling window for the next iteration
-                    await _update_rolling_window(redis_client, user_id, new_txn.amount)
-
-                    # 6. Stream the event to the client
-                    payload = new_txn.model_dump_json()
-                    yield f"data: {payload}\n\n"
-
-                except Exception as e:
-                    logger.exception(f"Error processing transaction for user {user_id}")
-                    # Send error event to client
-                    yield f"event: error\ndata: {str(e)}\n\n"
-
-            # Wait before next iteration
-            await asyncio.sleep(INTERVAL_SECONDS)
+        session = await manager.open_session(params.user_id, params.anomalies_only)
+    except ConnectionLimitError as e:
+        raise HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": "5"}
+        )
+    logger.info(
+        f"SSE stream session {session.id} opened for {len(session.subscriptions)} users"
+    )
 
-    except asyncio.CancelledError:
-        logger.warning(f"SSE connection cancelled for user {user_id}")
-        raise
-    except Exception as e:
-        logger.exception(f"Fatal error in SSE event generator for user {user_id}")
-        yield f"event: error\ndata: Fatal error: {str(e)}\n\n"
-    finally:
-        logger.info(f"Closing SSE connection for user {user_id}")
+    async def on_close() -> None:
+        await manager.close_session(session)
+        logger.info(f"Closing SSE stream session {session.id}")
 
+    opening = _session_response(session).model_dump_json()
+    return EventStreamResponse(
+        event_generator(session.connection, [f"event: session\ndata: {opening}\n\n"]),
+        on_close=on_close,
+        headers={"X-SSE-Session": session.id},
+    )
 
-@router.get("/sse/transactions/{user_id}")
-async def sse_transactions(
-    request: Request, user_id: uuid.UUID, redis_client: Redis = Depends(get_redis)
+
+@router.post(
+    "/sse/sessions/{session_id}/subscriptions", response_model=StreamSessionResponse
+)
+async def add_stream_subscriptions(session_id: str, body: StreamSubscriptions):
+    """Adds users to an open stream session."""
+    session = _get_stream_session(session_id)
+    try:
+        await get_connection_manager().add_users(session, body.user_ids)
+    except ConnectionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return _session_response(session)
+
+
+@router.delete(
+    "/sse/sessions/{session_id}/subscriptions", response_model=StreamSessionResponse
+)
+async def remove_stream_subscriptions(
+    session_id: str, user_id: Annotated[list[uuid.UUID], Query()]
 ):
-    """
-    Establishes an SSE connection to stream simulated transactions for a user.
-    """
-    logger.info(f"SSE connection established for user {user_id}")
-    return StreamingResponse(
-        event_generator(request, user_id, redis_client),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",  # Disable nginx buffering
-        },
-    )
+    """Removes users from an open stream session."""
+    session = _get_stream_session(session_id)
+    await get_connection_manager().remove_users(session, user_id)
+    return _session_response(session)
@@ -1,68 +1,396 @@
+import csv
+import io
+import json
 import logging
-import uuid
-from datetime import datetime
-from typing import Annotated
+import zlib
+from collections.abc import AsyncGenerator, Sequence
+from datetime import date, datetime
+from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import asc
-from sqlalchemy.exc import SQLAlchemyError
+from asyncpg import PostgresError, UniqueViolationError
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import ColumnElement, Row, Select, tuple_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import desc, select
 
-from src.database import get_session
-from src.models import ListTransactionsResponse, Transaction, TransactionFilters
-from src.utils import decode_base64, encode_base64
+from src.cache import transactions_cache
+from src.config import CONFIG
+from src.database import get_read_session, get_session
+from src.detectors import create_detector
+from src.ingest import (
+    BatchTooLargeError,
+    DuplicateTransactionsError,
+    UsersBusyError,
+    ingest_transactions,
+    parse_transactions,
+)
+from src.metrics import stage
+from src.models import (
+    BatchIngestResponse,
+    DailyRollup,
+    ExportFilters,
+    ListTransactionsResponse,
+    SummaryBucket,
+    SummaryFilters,
+    Transaction,
+    TransactionCreate,
+    TransactionFilters,
+    TransactionSummaryResponse,
+)
+from src.redis import get_redis
+from src.responses import ORJSONResponse, dumps
+from src.rollups import ROLLUP_METRICS, empty_rollup
+from src.utils import decode_cursor, encode_cursor
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-@router.get("/transactions", response_model=ListTransactionsResponse)
+@router.get(
+    "/transactions",
+    response_model=ListTransactionsResponse,
+    response_class=ORJSONResponse,
+)
 async def get_transactions(
     params: Annotated[TransactionFilters, Query(...)],
-    db: AsyncSession = Depends(get_session),
+    db: AsyncSession = Depends(get_read_session),
+    primary_db: AsyncSession = Depends(get_session),
+    redis_client: Redis = Depends(get_redis),
 ):
-    try:
-        conditions = [
-            Transaction.user_id == params.user_id,
-            Transaction.txn_date >= params.from_date,
-            Transaction.txn_date <= params.to_date,
-            Transaction.amount >= params.min_amount,
-            Transaction.amount <= params.max_amount,
-        ]
-
-        if params.cursor:
-            cursor_data = decode_base64(params.cursor)
-            cursor_date = datetime.fromisoformat(cursor_data["txn_date"])
-            cursor_id = uuid.UUID(cursor_data["id"])
-            conditions.append(
-                (Transaction.txn_date < cursor_date)
-                | ((Transaction.txn_date == cursor_date) & (Transaction.id < cursor_id))
-            )
+    if CONFIG.TRANSACTIONS_CACHE_ENABLED:
+        # A page read from a lagging replica would be cached under the
+        # current version and served stale, so cache misses read the primary.
+        # Sessions connect on first use, hits never touch the database.
+        async def fetch_page() -> bytes:
+            return await _fetch_transactions(params, primary_db)
 
-        query = (
-            select(Transaction)
-            .where(*conditions)
-            .limit(params.limit)
-            .order_by(desc(Transaction.txn_date), asc(Transaction.id))
-        )
+        page = await transactions_cache.get_or_compute(redis_client, params, fetch_page)
+    else:
+        page = await _fetch_transactions(params, db)
+    return Response(content=page, media_type="application/json")
 
-        txns = list((await db.execute(query)).scalars().all())
 
-        cursor = (
-            encode_base64(
-                {
-                    "txn_date": txns[-1].txn_date.isoformat(),
-                    "id": str(txns[-1].id),
-                }
-            )
-            if txns
-            else ""
+def _filter_conditions(params: TransactionFilters) -> list[ColumnElement[bool]]:
+    conditions = [
+        Transaction.user_id == params.user_id,
+        Transaction.txn_date >= params.from_date,
+        Transaction.txn_date <= params.to_date,
+        Transaction.amount >= params.min_amount,
+        Transaction.amount <= params.max_amount,
+    ]
+
+    if params.cursor:
+        try:
+            cursor_date, cursor_id = decode_cursor(params.cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        # Row value comparison, so the index range starts right at the cursor
+        conditions.append(
+            tuple_(Transaction.txn_date, Transaction.id) < (cursor_date, cursor_id)
         )
 
-        return ListTransactionsResponse(transactions=txns, cursor=cursor)
+    return conditions
+
+
+# Same fields and order as the Transaction model dumps them
+PAGE_COLUMNS = [
+    "user_id",
+    "amount",
+    "currency",
+    "txn_date",
+    "status",
+    "meta_data",
+    "id",
+]
+
+
+def _page_query(params: TransactionFilters) -> Select:
+    return (
+        select(*(getattr(Transaction, column) for column in PAGE_COLUMNS))
+        .where(*_filter_conditions(params))
+        .limit(params.limit)
+        .order_by(desc(Transaction.txn_date), desc(Transaction.id))
+    )
+
+
+async def _fetch_transactions(params: TransactionFilters, db: AsyncSession) -> bytes:
+    """
+    Returns one page of transactions already encoded as a
+    `ListTransactionsResponse` JSON document.
+
+    Plain column tuples are selected instead of ORM entities and encoded
+    directly with orjson. The values come straight from typed columns, so
+    validating them again through pydantic would only cost time.
+    """
+    try:
+        with stage("transactions_query"):
+            rows = (await db.execute(_page_query(params))).all()
+
+        with stage("transactions_encode"):
+            txns = [dict(zip(PAGE_COLUMNS, row, strict=True)) for row in rows]
+            cursor = encode_cursor(txns[-1]["txn_date"], txns[-1]["id"]) if txns else ""
+            return dumps({"transactions": txns, "cursor": cursor})
     except SQLAlchemyError:
         logger.exception("Error fetching transaction")
         raise HTTPException(
             status_code=500, detail="Could not fetch transactions from the database."
         )
+
+
+EXPORT_COLUMNS = [
+    "id",
+    "user_id",
+    "amount",
+    "currency",
+    "txn_date",
+    "status",
+    "meta_data",
+]
+EXPORT_FETCH_SIZE = 1000
+
+
+@router.get("/transactions/summary", response_model=TransactionSummaryResponse)
+async def get_transactions_summary(
+    params: Annotated[SummaryFilters, Query(...)],
+    db: AsyncSession = Depends(get_read_session),
+):
+    """
+    Returns a user's totals per day or per month, read from the daily
+    rollups instead of the raw transactions. Days are UTC days.
+    """
+    query = (
+        select(DailyRollup)
+        .where(DailyRollup.user_id == params.user_id)
+        .order_by(DailyRollup.day)
+    )
+    if params.from_date:
+        query = query.where(DailyRollup.day >= params.from_date)
+    if params.to_date:
+        query = query.where(DailyRollup.day <= params.to_date)
+
+    try:
+        rollups = (await db.execute(query)).scalars().all()
+    except SQLAlchemyError:
+        logger.exception("Error fetching transaction summary")
+        raise HTTPException(
+            status_code=500,
+            detail="Could not fetch the transaction summary from the database.",
+        )
+
+    buckets: dict[date, dict[str, Any]] = {}
+    for rollup in rollups:
+        period = rollup.day
+        if params.granularity == "month":
+            period = period.replace(day=1)
+        bucket = buckets.setdefault(period, empty_rollup(params.user_id, period))
+        for metric in ROLLUP_METRICS:
+            bucket[metric] += getattr(rollup, metric)
+
+    return TransactionSummaryResponse(
+        user_id=params.user_id,
+        granularity=params.granularity,
+        buckets=[
+            SummaryBucket(
+                period=period, **{metric: bucket[metric] for metric in ROLLUP_METRICS}
+            )
+            for period, bucket in buckets.items()
+        ],
+    )
+
+
+@router.get("/transactions/export")
+async def export_transactions(
+    params: Annotated[ExportFilters, Query(...)],
+    db: AsyncSession = Depends(get_read_session),
+):
+    """
+    Streams every transaction matching the filters as NDJSON or CSV.
+
+    Rows are read through a server-side cursor and written out as they
+    arrive, so memory use does not grow with the size of the export. The
+    `limit` filter is ignored; a `cursor` resumes an export after that row.
+    """
+    query = (
+        select(*(getattr(Transaction, column) for column in EXPORT_COLUMNS))
+        .where(*_filter_conditions(params))
+        .order_by(desc(Transaction.txn_date), desc(Transaction.id))
+        .execution_options(yield_per=EXPORT_FETCH_SIZE)
+    )
+    format = params.format
+    encode = _encode_csv if format == "csv" else _encode_ndjson
+
+    async def body() -> AsyncGenerator[bytes, None]:
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(wbits=31) if params.gzip else None
+
+        def emit(data: bytes) -> bytes:
+            return compressor.compress(data) if compressor else data
+
+        if format == "csv":
+            yield emit(_encode_csv([EXPORT_COLUMNS]))
+        try:
+            result = await db.stream(query)
+            async for rows in result.partitions():
+                yield emit(encode(rows))
+        except SQLAlchemyError:
+            # Headers are already sent, so the client sees a truncated body
+            logger.exception("Error exporting transactions")
+        if compressor:
+            yield compressor.flush()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="transactions.{format}"'}
+    if params.gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
+
+
+def _encode_ndjson(rows: Sequence[Row]) -> bytes:
+    lines = [
+        json.dumps(
+            {
+                "id": str(txn_id),
+                "user_id": str(user_id),
+                "amount": str(amount),
+                "currency": currency,
+                "txn_date": txn_date.isoformat(),
+                "status": status,
+                "meta_data": meta_data,
+            }
+        )
+        for txn_id, user_id, amount, currency, txn_date, status, meta_data in rows
+    ]
+    lines.append("")
+    return "\n".join(lines).encode("utf-8")
+
+
+def _encode_csv(rows: Sequence[Sequence[Any]]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(_csv_value(value) for value in row)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    """
+    Reads the request body, refusing with a 413 as soon as it is known to
+    exceed `max_bytes`: from Content-Length, or while a chunked body arrives.
+    """
+    too_large = HTTPException(
+        status_code=413, detail=f"At most {max_bytes} bytes per request."
+    )
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise too_large
+    return bytes(body)
+
+
+@router.post(
+    "/transactions/batch",
+    response_model=BatchIngestResponse,
+    response_class=ORJSONResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": TransactionCreate.model_json_schema(),
+                    }
+                },
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def ingest_transactions_batch(
+    request: Request,
+    db: AsyncSession = Depends(get_session),
+    redis_client: Redis = Depends(get_redis),
+):
+    """
+    Ingests a batch of transactions, sent as a JSON array or as one JSON
+    object per line with `Content-Type: application/x-ndjson`.
+
+    The batch is validated as a whole, scored for anomalies user by user and
+    inserted in one statement. Returns the flag of every row, in the order
+    of the request.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body = await _read_body(request, CONFIG.TXN_INGEST_MAX_BYTES)
+    with stage("ingest_parse"):
+        try:
+            txns = parse_transactions(
+                body,
+                ndjson=media_type in NDJSON_TYPES,
+                max_rows=CONFIG.TXN_INGEST_MAX_ROWS,
+            )
+        except BatchTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False))
+
+    flags: list[bool] = []
+    if txns:
+        try:
+            flags = await ingest_transactions(db, redis_client, create_detector(), txns)
+        except DuplicateTransactionsError as e:
+            raise HTTPException(status_code=409 if e.stored else 422, detail=str(e))
+        except UsersBusyError as e:
+            raise HTTPException(
+                status_code=409, detail=str(e), headers={"Retry-After": "1"}
+            )
+        except (IntegrityError, UniqueViolationError):
+            # Stored by a concurrent request since the duplicate check
+            raise HTTPException(
+                status_code=409, detail="Transaction ids already stored."
+            )
+        except RedisError:
+            logger.exception("Error scoring transactions")
+            raise HTTPException(
+                status_code=503, detail="Could not score the transactions."
+            )
+        except (SQLAlchemyError, PostgresError):
+            logger.exception("Error inserting transactions")
+            raise HTTPException(
+                status_code=500,
+                detail="Could not insert the transactions into the database.",
+            )
+
+    return Response(
+        content=dumps(
+            {
+                "inserted": len(txns),
+                "anomalies": sum(flags),
+                "results": [
+                    {"id": txn.id, "is_anomaly": flag}
+                    for txn, flag in zip(txns, flags, strict=True)
+                ],
+            }
+        ),
+        media_type="application/json",
+    )
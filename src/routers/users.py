@@ -1,12 +1,13 @@
 import logging
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import distinct, select
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database import get_session
-from src.models import ListUsersResponse, Transaction
+from src.database import get_read_session
+from src.models import ListUsersResponse, User, UserFilters
 
 router = APIRouter()
 
@@ -14,14 +15,27 @@ logger = logging.getLogger(__name__)
 
 
 @router.get("/users", response_model=ListUsersResponse)
-async def get_users(db: AsyncSession = Depends(get_session)):
+async def get_users(
+    params: Annotated[UserFilters, Query(...)],
+    db: AsyncSession = Depends(get_read_session),
+):
     """
-    Returns a list of all unique user IDs present in the transactions table.
+    Returns a page of user IDs from the user registry, ordered by ID.
+    Pass the returned cursor to get the next page.
     """
     try:
-        result = await db.execute(select(distinct(Transaction.user_id)))
-        user_ids = result.scalars().all()
-        return {"users": user_ids}
+        query = select(User.id).order_by(User.id).limit(params.limit)
+        if params.cursor:
+            query = query.where(User.id > params.cursor)
+
+        user_ids = list((await db.execute(query)).scalars().all())
+        cursor = str(user_ids[-1]) if len(user_ids) == params.limit else ""
+
+        count = None
+        if params.include_count:
+            count = (await db.execute(select(func.count()).select_from(User))).scalar()
+
+        return ListUsersResponse(users=user_ids, cursor=cursor, count=count)
     except SQLAlchemyError:
         logger.exception("Error fetching user IDs")
         raise HTTPException(
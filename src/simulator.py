@@ -0,0 +1,389 @@
+import asyncio
+import logging
+import random
+import uuid
+from datetime import UTC, datetime
+from decimal import Decimal
+from typing import Literal, Protocol
+
+import redis.asyncio as redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from src.anomaly import ANOMALY_MULTIPLIER
+from src.batch_writer import TransactionBatchWriter, get_batch_writer
+from src.config import CONFIG
+from src.database import AsyncReadSessionMaker
+from src.detector_state import load_detector_states, save_detector_states
+from src.detectors import Detector, DetectorState, create_detector
+from src.event_stream import (
+    append_events,
+    events_channel,
+    format_event,
+    parse_published,
+)
+from src.leases import acquire_leases, detector_lock_key, release_leases
+from src.metrics import stage
+from src.models import Transaction
+from src.redis import get_redis_pool
+
+logger = logging.getLogger(__name__)
+
+
+# Simulation constants
+INTERVAL_SECONDS = 2
+ANOMALY_CHANCE = 0.35
+
+
+def _simulate_transaction_amount(
+    typical_amount: float, is_potential_anomaly: bool
+) -> Decimal:
+    """Simulates a new transaction amount, potentially as an anomaly."""
+    if is_potential_anomaly:
+        # Generate a significantly larger amount than usual or a high random value
+        base_amount = max(typical_amount * ANOMALY_MULTIPLIER, 5000.0)
+        amount = Decimal(random.uniform(base_amount, base_amount * 2))
+    else:
+        # Generate a "normal" transaction amount
+        amount = Decimal(random.uniform(10.0, 500.0))
+
+    return amount.quantize(Decimal("0.01"))
+
+
+async def _create_and_persist_transaction(
+    writer: TransactionBatchWriter,
+    user_id: uuid.UUID,
+    amount: Decimal,
+    is_anomaly: bool,
+) -> Transaction:
+    """
+    Creates a new Transaction object and queues it for insertion.
+    The id is generated client side, so the event can be streamed right away.
+    """
+    new_txn = Transaction(
+        user_id=user_id,
+        amount=amount,
+        currency="INR",
+        txn_date=datetime.now(tz=UTC),
+        status=random.choice(["paid", "failed"]),
+        meta_data={"is_anomaly": is_anomaly},
+    )
+    await writer.enqueue(new_txn)
+    return new_txn
+
+
+class Subscriber(Protocol):
+    """Receives a user's SSE frames, see `src.sse.SSEConnection`."""
+
+    user_id: uuid.UUID
+
+    @property
+    def connection(self) -> object:
+        """The connection the frames go to, shared by a session's subscriptions."""
+
+    def offer(self, frame: str) -> None:
+        """Takes a frame without waiting, a slow subscriber must not stall the tick."""
+
+
+class TransactionSimulator:
+    """
+    Produces simulated transactions for every user that has at least one
+    SSE subscriber.
+
+    A single timer ticks all active users together: amounts are simulated in
+    one batch, scored by the anomaly detector, and each user's event is fanned
+    out to all of that user's subscribers. Watching the same user from several
+    connections therefore creates one transaction per tick, not one per
+    connection.
+
+    Each tick takes the detector lock of its users, the one batch ingestion
+    takes as well, reads their states from Redis, advances them and writes
+    them back, each in one pipelined call, so neither overwrites the other's
+    updates. A user whose lock is held by an ingesting batch skips the tick.
+    With a `session_maker`, a state missing from Redis is rebuilt from the
+    user's stored transactions.
+
+    Every event is appended to the user's capped Redis stream, whose id it
+    carries, so reconnecting clients can replay what they missed.
+
+    With `fanout="redis"` several workers can serve the same user. Only the
+    worker holding the user's producer lease simulates transactions, and it
+    publishes them to the user's Redis channel. Every worker with subscribers
+    for the user relays that channel to its own SSE clients.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        writer: TransactionBatchWriter,
+        interval_seconds: float = INTERVAL_SECONDS,
+        fanout: Literal["local", "redis"] = "local",
+        lease_ttl_ms: int = 3 * INTERVAL_SECONDS * 1000,
+        detector: Detector | None = None,
+        replay_maxlen: int = 1000,
+        replay_ttl_seconds: int = 3600,
+        session_maker: sessionmaker[AsyncSession] | None = None,
+    ):
+        self.redis_client = redis_client
+        self.writer = writer
+        self.interval_seconds = interval_seconds
+        self.fanout = fanout
+        self.lease_ttl_ms = lease_ttl_ms
+        self.detector = detector or create_detector()
+        self.replay_maxlen = replay_maxlen
+        self.replay_ttl_seconds = replay_ttl_seconds
+        self.session_maker = session_maker
+        self.worker_id = uuid.uuid4().hex
+        # Subscribers per user; the set size is the producer's refcount
+        self._subscribers: dict[uuid.UUID, set[Subscriber]] = {}
+        self._task: asyncio.Task | None = None
+        # Users this worker currently produces for, when fanning out via Redis
+        self._leased_users: set[uuid.UUID] = set()
+        self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self._relay_task: asyncio.Task | None = None
+
+    @property
+    def active_users(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def producing_users(self) -> int:
+        """Users this worker simulates transactions for."""
+        if self.fanout == "redis":
+            return len(self._leased_users)
+        return len(self._subscribers)
+
+    async def subscribe(self, subscriber: Subscriber) -> None:
+        """
+        Registers a subscriber for its user's SSE frames. Starts the user's
+        producer if needed.
+        """
+        user_id = subscriber.user_id
+        subscribers = self._subscribers.setdefault(user_id, set())
+        subscribers.add(subscriber)
+        if self.fanout == "redis" and len(subscribers) == 1:
+            await self._pubsub.subscribe(events_channel(user_id))
+            if self._relay_task is None:
+                self._relay_task = asyncio.create_task(
+                    self._relay(), name="txn-simulator-relay"
+                )
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="txn-simulator")
+
+    async def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Removes a subscriber, stopping the user's producer on the last one."""
+        user_id = subscriber.user_id
+        subscribers = self._subscribers.get(user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if subscribers:
+            return
+
+        del self._subscribers[user_id]
+        if self.fanout == "redis":
+            await self._pubsub.unsubscribe(events_channel(user_id))
+            if user_id in self._leased_users:
+                self._leased_users.discard(user_id)
+                await release_leases(self.redis_client, [user_id], self.worker_id)
+
+    async def stop(self) -> None:
+        for task in (self._task, self._relay_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._relay_task = None
+
+        if self.fanout == "redis":
+            await release_leases(
+                self.redis_client, list(self._leased_users), self.worker_id
+            )
+            self._leased_users.clear()
+            await self._pubsub.aclose()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._subscribers:
+            started = loop.time()
+            try:
+                with stage("tick"):
+                    await self._tick()
+            except Exception as e:
+                logger.exception("Error simulating transactions")
+                self._broadcast(f"event: error\ndata: {str(e)}\n\n")
+            await asyncio.sleep(
+                max(0.0, self.interval_seconds - (loop.time() - started))
+            )
+        # No await between the check above and this line, so a concurrent
+        # subscribe either sees the running task or starts a new one.
+        self._task = None
+
+    async def _tick(self) -> None:
+        user_ids = list(self._subscribers)
+        if self.fanout == "redis":
+            # Only produce for users whose lease this worker holds
+            with stage("acquire_leases"):
+                user_ids = await acquire_leases(
+                    self.redis_client, user_ids, self.worker_id, self.lease_ttl_ms
+                )
+            self._leased_users = set(user_ids)
+        if not user_ids:
+            return
+
+        with stage("detector_lock"):
+            user_ids = await acquire_leases(
+                self.redis_client,
+                user_ids,
+                self.worker_id,
+                self.lease_ttl_ms,
+                detector_lock_key,
+            )
+        try:
+            events = await self._produce(user_ids)
+        finally:
+            await release_leases(
+                self.redis_client, user_ids, self.worker_id, detector_lock_key
+            )
+
+        # 5. Fan the events out to every subscriber of each user
+        with stage("publish"):
+            await self._publish(events)
+
+    async def _produce(self, user_ids: list[uuid.UUID]) -> dict[uuid.UUID, str]:
+        """
+        Simulates, scores and queues one transaction per user, whose detector
+        locks the caller holds, and saves their states.
+
+        :return: The event of each user.
+        """
+        if not user_ids:
+            return {}
+
+        # 1. Load the detector states, ingested batches may have advanced them
+        with stage("detector_load"):
+            states = await self._load_detector_states(user_ids)
+
+        # 2. Simulate one amount per active user
+        with stage("simulate"):
+            amounts = {
+                user_id: _simulate_transaction_amount(
+                    self.detector.typical_amount(state) / 100,
+                    random.random() < ANOMALY_CHANCE,
+                )
+                for user_id, state in states.items()
+            }
+
+        events = {}
+        for user_id, amount in amounts.items():
+            # 3. Check if it's an anomaly
+            with stage("detect"):
+                is_anomaly = self.detector.score(int(amount.scaleb(2)), states[user_id])
+
+            # 4. Create and save the transaction
+            with stage("enqueue"):
+                new_txn = await _create_and_persist_transaction(
+                    self.writer, user_id, amount, is_anomaly
+                )
+            with stage("serialize"):
+                events[user_id] = new_txn.model_dump_json()
+
+        with stage("detector_save"):
+            await save_detector_states(self.redis_client, self.detector, states)
+        return events
+
+    async def _load_detector_states(
+        self, user_ids: list[uuid.UUID]
+    ) -> dict[uuid.UUID, DetectorState]:
+        if self.session_maker is None:
+            return await load_detector_states(
+                self.redis_client, self.detector, user_ids
+            )
+        async with self.session_maker() as db:
+            return await load_detector_states(
+                self.redis_client, self.detector, user_ids, db
+            )
+
+    async def _publish(self, events: dict[uuid.UUID, str]) -> None:
+        """
+        Appends the events to the replay streams, and publishes them when
+        fanning out via Redis, in one round trip.
+        """
+        event_ids = await append_events(
+            self.redis_client,
+            events,
+            self.replay_maxlen,
+            self.replay_ttl_seconds,
+            publish=self.fanout == "redis",
+        )
+        if self.fanout == "local":
+            for user_id, data in events.items():
+                self._deliver(user_id, format_event(event_ids[user_id], data))
+
+    async def _relay(self) -> None:
+        """Relays the users' Redis channels to the local subscribers."""
+        while self._pubsub.subscribed:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except Exception:
+                logger.exception("Error reading transaction events from Redis")
+                await asyncio.sleep(self.interval_seconds)
+                continue
+            if message is not None:
+                user_id = uuid.UUID(message["channel"].split(":")[1])
+                self._deliver(user_id, parse_published(message["data"]))
+        self._relay_task = None
+
+    def _deliver(self, user_id: uuid.UUID, frame: str) -> None:
+        for subscriber in self._subscribers.get(user_id, ()):
+            subscriber.offer(frame)
+
+    def _broadcast(self, frame: str) -> None:
+        """Offers the frame once per connection, whatever the users it watches."""
+        offered = set()
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                if subscriber.connection not in offered:
+                    offered.add(subscriber.connection)
+                    subscriber.offer(frame)
+
+
+_simulator: TransactionSimulator | None = None
+
+
+def init_simulator() -> TransactionSimulator:
+    """
+    Creates the process-wide simulator.
+    Called once from the application lifespan, after the Redis pool and the
+    batch writer are up.
+    """
+    global _simulator
+    if _simulator is None:
+        _simulator = TransactionSimulator(
+            redis.Redis(connection_pool=get_redis_pool()),
+            get_batch_writer(),
+            fanout=CONFIG.SSE_FANOUT_MODE,
+            lease_ttl_ms=CONFIG.PRODUCER_LEASE_TTL_MS,
+            replay_maxlen=CONFIG.SSE_REPLAY_MAXLEN,
+            replay_ttl_seconds=CONFIG.SSE_REPLAY_TTL_SECONDS,
+            session_maker=AsyncReadSessionMaker,
+        )
+    return _simulator
+
+
+async def close_simulator() -> None:
+    global _simulator
+    if _simulator is not None:
+        await _simulator.stop()
+        _simulator = None
+
+
+def get_simulator() -> TransactionSimulator:
+    if _simulator is None:
+        raise RuntimeError("Transaction simulator has not been initialised.")
+    return _simulator
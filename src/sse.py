@@ -0,0 +1,353 @@
+import asyncio
+import logging
+import uuid
+from collections.abc import AsyncGenerator
+from typing import Literal
+
+import orjson
+
+from src.config import CONFIG
+from src.event_stream import event_id_order, frame_event_id
+from src.metrics import (
+    SSE_CONNECTIONS,
+    SSE_DROPPED_FRAMES,
+    SSE_EVICTIONS,
+    SSE_REJECTIONS,
+)
+from src.simulator import TransactionSimulator, get_simulator
+
+logger = logging.getLogger(__name__)
+
+SlowConsumerPolicy = Literal["drop_oldest", "disconnect"]
+
+# Sent on idle streams, so proxies keep them open and dead clients are noticed
+HEARTBEAT_FRAME = ": ping\n\n"
+
+
+class ConnectionLimitError(Exception):
+    """Raised when a new SSE connection would exceed a connection cap."""
+
+
+class SSEConnection:
+    """
+    One SSE client and the bounded queue of frames waiting to be sent to it.
+
+    Producers hand frames over with `offer`, which never waits. When the
+    queue is full the client is too slow: `"drop_oldest"` discards its oldest
+    frame to make room, `"disconnect"` closes the connection. Either way the
+    frames held for a client never exceed `max_queued`, which may be changed
+    while the connection is open.
+
+    `user_id` is the user streamed, None for the connection of a
+    `StreamSession`.
+    """
+
+    def __init__(
+        self,
+        user_id: uuid.UUID | None,
+        max_queued: int,
+        slow_consumer: SlowConsumerPolicy = "drop_oldest",
+    ):
+        self.user_id = user_id
+        self.max_queued = max_queued
+        self.slow_consumer = slow_consumer
+        self.label = f"user {user_id}"
+        self.dropped = 0
+        self.close_reason: str | None = None
+        # Bounded by `offer`, so the end of stream marker always fits
+        self._queue: asyncio.Queue[str | None] = asyncio.Queue()
+
+    @property
+    def closed(self) -> bool:
+        return self.close_reason is not None
+
+    @property
+    def connection(self) -> "SSEConnection":
+        return self
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def offer(self, frame: str) -> None:
+        """Queues a frame for the client, applying the slow consumer policy."""
+        if self.closed:
+            return
+        if self._queue.qsize() >= self.max_queued:
+            if self.slow_consumer == "disconnect":
+                SSE_EVICTIONS.inc()
+                logger.warning(f"Disconnecting slow SSE client of {self.label}")
+                self.close("slow consumer")
+                return
+            # More than one after `max_queued` was lowered
+            while self._queue.qsize() >= self.max_queued:
+                self._queue.get_nowait()
+                self.dropped += 1
+                SSE_DROPPED_FRAMES.inc()
+        self._queue.put_nowait(frame)
+
+    def close(self, reason: str) -> None:
+        """Discards the queued frames and ends the stream after the current one."""
+        if self.closed:
+            return
+        self.close_reason = reason
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def frames(
+        self, heartbeat_seconds: float, after: str | None = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Yields the queued frames as they arrive, and a heartbeat comment after
+        `heartbeat_seconds` without one. Ends once the connection is closed.
+
+        Events up to the id `after`, already replayed to the client, are
+        skipped.
+        """
+        skip_through = event_id_order(after) if after else None
+        while True:
+            try:
+                frame = await asyncio.wait_for(self._queue.get(), heartbeat_seconds)
+            except TimeoutError:
+                yield HEARTBEAT_FRAME
+                continue
+            if frame is None:
+                return
+            event_id = frame_event_id(frame) if skip_through is not None else None
+            if event_id is not None:
+                if event_id_order(event_id) <= skip_through:
+                    continue
+                # Ids only increase, every later event is new as well
+                skip_through = None
+            yield frame
+
+
+def _is_anomaly(frame: str) -> bool:
+    data = frame[frame.index("data: ") + 6 :]
+    return bool(orjson.loads(data)["meta_data"].get("is_anomaly"))
+
+
+class StreamSession:
+    """
+    One connection carrying the events of many users, each named
+    `user:<user_id>`, optionally only the anomalies. Users are added and
+    removed by session id while the stream stays open.
+    """
+
+    def __init__(self, connection: SSEConnection, anomalies_only: bool):
+        self.id = uuid.uuid4().hex
+        self.connection = connection
+        self.connection.label = f"session {self.id}"
+        self.anomalies_only = anomalies_only
+        self.subscriptions: dict[uuid.UUID, UserSubscription] = {}
+
+
+class UserSubscription:
+    """Subscribes a stream session to one user's events."""
+
+    def __init__(self, session: StreamSession, user_id: uuid.UUID):
+        self.session = session
+        self.user_id = user_id
+
+    @property
+    def connection(self) -> SSEConnection:
+        return self.session.connection
+
+    def offer(self, frame: str) -> None:
+        # Named frames, errors, are passed on as they are
+        if not frame.startswith("event: "):
+            if self.session.anomalies_only and not _is_anomaly(frame):
+                return
+            frame = f"event: user:{self.user_id}\n{frame}"
+        self.session.connection.offer(frame)
+
+
+class SSEConnectionManager:
+    """
+    Admits SSE connections within a global and a per-user cap, subscribes
+    them to the simulator and releases everything they hold on disconnect.
+    A stream session counts as one connection, watching at most
+    `max_session_users` users. All of a session's users are delivered in the
+    same tick, so its queue holds `queue_size` frames per user watched.
+
+    The caps are checked and the connection registered without awaiting in
+    between, so concurrent requests cannot overshoot them.
+    """
+
+    def __init__(
+        self,
+        simulator: TransactionSimulator,
+        max_connections: int,
+        max_connections_per_user: int,
+        queue_size: int,
+        slow_consumer: SlowConsumerPolicy = "drop_oldest",
+        max_session_users: int = 1000,
+    ):
+        self.simulator = simulator
+        self.max_connections = max_connections
+        self.max_connections_per_user = max_connections_per_user
+        self.queue_size = queue_size
+        self.slow_consumer = slow_consumer
+        self.max_session_users = max_session_users
+        self._connections: dict[uuid.UUID, set[SSEConnection]] = {}
+        self._sessions: dict[str, StreamSession] = {}
+        self._count = 0
+
+    @property
+    def connections(self) -> int:
+        return self._count
+
+    def _admit(self) -> None:
+        if self._count >= self.max_connections:
+            SSE_REJECTIONS.labels("global").inc()
+            raise ConnectionLimitError("Too many SSE connections.")
+
+    async def connect(self, user_id: uuid.UUID) -> SSEConnection:
+        """
+        Opens a connection for the user and subscribes it to the user's events.
+
+        :raises ConnectionLimitError: If either cap is reached.
+        """
+        self._admit()
+        user_connections = self._connections.setdefault(user_id, set())
+        if len(user_connections) >= self.max_connections_per_user:
+            SSE_REJECTIONS.labels("user").inc()
+            raise ConnectionLimitError(f"Too many SSE connections for user {user_id}.")
+
+        connection = SSEConnection(user_id, self.queue_size, self.slow_consumer)
+        user_connections.add(connection)
+        self._count += 1
+        SSE_CONNECTIONS.inc()
+        try:
+            await self.simulator.subscribe(connection)
+        except BaseException:
+            await self.disconnect(connection)
+            raise
+        return connection
+
+    async def disconnect(self, connection: SSEConnection) -> None:
+        """Releases the connection's slot and subscription. Safe to call twice."""
+        user_connections = self._connections.get(connection.user_id)
+        if user_connections is None or connection not in user_connections:
+            return
+        user_connections.discard(connection)
+        if not user_connections:
+            del self._connections[connection.user_id]
+        self._count -= 1
+        SSE_CONNECTIONS.dec()
+        connection.close("disconnected")
+        await self.simulator.unsubscribe(connection)
+
+    async def open_session(
+        self, user_ids: list[uuid.UUID], anomalies_only: bool = False
+    ) -> StreamSession:
+        """
+        Opens a stream session subscribed to the users' events.
+
+        :raises ConnectionLimitError: If the global cap is reached or there
+            are too many users.
+        """
+        self._admit()
+        connection = SSEConnection(None, self.queue_size, self.slow_consumer)
+        session = StreamSession(connection, anomalies_only)
+        self._sessions[session.id] = session
+        self._count += 1
+        SSE_CONNECTIONS.inc()
+        try:
+            await self.add_users(session, user_ids)
+        except BaseException:
+            await self.close_session(session)
+            raise
+        return session
+
+    def get_session(self, session_id: str) -> StreamSession | None:
+        return self._sessions.get(session_id)
+
+    async def add_users(
+        self, session: StreamSession, user_ids: list[uuid.UUID]
+    ) -> None:
+        """
+        Subscribes the session to more users, those already watched are skipped.
+
+        :raises ConnectionLimitError: If the session would watch too many users.
+        """
+        new_users = [
+            user_id
+            for user_id in dict.fromkeys(user_ids)
+            if user_id not in session.subscriptions
+        ]
+        if len(session.subscriptions) + len(new_users) > self.max_session_users:
+            SSE_REJECTIONS.labels("session").inc()
+            raise ConnectionLimitError(
+                f"At most {self.max_session_users} users per stream session."
+            )
+        self._resize(session, len(session.subscriptions) + len(new_users))
+        for user_id in new_users:
+            subscription = UserSubscription(session, user_id)
+            session.subscriptions[user_id] = subscription
+            await self.simulator.subscribe(subscription)
+
+    async def remove_users(
+        self, session: StreamSession, user_ids: list[uuid.UUID]
+    ) -> None:
+        """Unsubscribes the session from the users, unknown ones are ignored."""
+        for user_id in user_ids:
+            subscription = session.subscriptions.pop(user_id, None)
+            if subscription is not None:
+                await self.simulator.unsubscribe(subscription)
+        self._resize(session, len(session.subscriptions))
+
+    def _resize(self, session: StreamSession, users: int) -> None:
+        session.connection.max_queued = self.queue_size * max(1, users)
+
+    async def close_session(self, session: StreamSession) -> None:
+        """Releases the session's slot and subscriptions. Safe to call twice."""
+        if self._sessions.pop(session.id, None) is None:
+            return
+        self._count -= 1
+        SSE_CONNECTIONS.dec()
+        session.connection.close("disconnected")
+        await self.remove_users(session, list(session.subscriptions))
+
+    def close_all(self, reason: str) -> None:
+        """Ends every open stream, their requests then disconnect them."""
+        for user_connections in self._connections.values():
+            for connection in user_connections:
+                connection.close(reason)
+        for session in self._sessions.values():
+            session.connection.close(reason)
+
+
+_manager: SSEConnectionManager | None = None
+
+
+def init_connection_manager() -> SSEConnectionManager:
+    """
+    Creates the process-wide SSE connection manager.
+    Called once from the application lifespan, after the simulator is up.
+    """
+    global _manager
+    if _manager is None:
+        _manager = SSEConnectionManager(
+            get_simulator(),
+            max_connections=CONFIG.SSE_MAX_CONNECTIONS,
+            max_connections_per_user=CONFIG.SSE_MAX_CONNECTIONS_PER_USER,
+            queue_size=CONFIG.SSE_QUEUE_SIZE,
+            slow_consumer=CONFIG.SSE_SLOW_CONSUMER,
+            max_session_users=CONFIG.SSE_MAX_SESSION_USERS,
+        )
+    return _manager
+
+
+def close_connection_manager() -> None:
+    global _manager
+    if _manager is not None:
+        _manager.close_all("server shutting down")
+        _manager = None
+
+
+def get_connection_manager() -> SSEConnectionManager:
+    if _manager is None:
+        raise RuntimeError("SSE connection manager has not been initialised.")
+    return _manager
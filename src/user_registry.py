@@ -0,0 +1,25 @@
+import uuid
+from collections.abc import Iterable
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from src.models import User
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+async def register_users(
+    db: AsyncSession | AsyncConnection, user_ids: Iterable[uuid.UUID]
+) -> None:
+    """
+    Adds users to the registry, ignoring the ones that are already in it.
+    Runs inside the caller's transaction, so it commits with the transactions
+    that introduced the users.
+    """
+    rows = [{"id": user_id} for user_id in user_ids]
+    if not rows:
+        return
+    dialect = db.bind.dialect if isinstance(db, AsyncSession) else db.dialect
+    insert = _INSERTS[dialect.name]
+    await db.execute(insert(User).values(rows).on_conflict_do_nothing())
@@ -1,24 +1,38 @@
 import base64
-import json
-from typing import Any
+import binascii
+import struct
+import uuid
+from datetime import UTC, datetime, timedelta
 
+# Microseconds since the epoch as a signed 64-bit int, then the raw UUID bytes
+_CURSOR = struct.Struct(">q16s")
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
 
-def encode_base64(data: dict[str, Any]) -> str:
+
+def encode_cursor(txn_date: datetime, txn_id: uuid.UUID) -> str:
     """
-    Serializes a dictionary to a JSON string, then base64 encodes it.
+    Packs the sort key of the last row of a page into an opaque cursor.
 
-    :param data: The dictionary to encode.
-    :return: A base64 encoded string.
+    :param txn_date: The row's transaction date, naive values are taken as UTC.
+    :param txn_id: The row's id.
+    :return: A 32 character URL safe string.
     """
-    json_string = json.dumps(data)
-    base64_bytes = base64.b64encode(json_string.encode("utf-8"))
-    return base64_bytes.decode("utf-8")
+    if txn_date.tzinfo is None:
+        txn_date = txn_date.replace(tzinfo=UTC)
+    micros = (txn_date - _EPOCH) // timedelta(microseconds=1)
+    packed = _CURSOR.pack(micros, txn_id.bytes)
+    return base64.urlsafe_b64encode(packed).rstrip(b"=").decode("ascii")
 
 
-def decode_base64(base64_string: str) -> dict[str, Any]:
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
     """
-    Decodes a base64 string into bytes, then deserializes the
-    JSON string to a dictionary.
+    Unpacks a cursor made by `encode_cursor`.
+
+    :raises ValueError: If the cursor is malformed.
     """
-    json_bytes = base64.b64decode(base64_string.encode("utf-8"))
-    return json.loads(json_bytes.decode("utf-8"))
+    try:
+        packed = base64.urlsafe_b64decode(cursor.encode("ascii") + b"==")
+        micros, id_bytes = _CURSOR.unpack(packed)
+        return _EPOCH + timedelta(microseconds=micros), uuid.UUID(bytes=id_bytes)
+    except (UnicodeEncodeError, binascii.Error, struct.error, OverflowError) as exc:
+        raise ValueError("Invalid cursor") from exc
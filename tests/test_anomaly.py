@@ -0,0 +1,56 @@
+from collections import deque
+from decimal import Decimal
+
+import numpy as np
+
+from src.anomaly import (
+    ANOMALY_MULTIPLIER,
+    MIN_TXNS_FOR_ANOMALY_CHECK,
+    ROLLING_WINDOW_SIZE,
+    rolling_anomaly_flags,
+)
+
+
+def _reference_flags(amounts_cents: list[int]) -> list[bool]:
+    """The per-row rolling mean check, one transaction at a time."""
+    recent_amounts = deque(maxlen=ROLLING_WINDOW_SIZE)
+    flags = []
+    for cents in amounts_cents:
+        amount = Decimal(cents) / 100
+        is_anomaly = False
+        if len(recent_amounts) >= MIN_TXNS_FOR_ANOMALY_CHECK:
+            rolling_mean = sum(recent_amounts) / len(recent_amounts)
+            is_anomaly = amount > ANOMALY_MULTIPLIER * rolling_mean
+        recent_amounts.append(amount)
+        flags.append(is_anomaly)
+    return flags
+
+
+def _amounts(size: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    spikes = rng.random(size) < 0.35
+    amounts = np.where(
+        spikes, rng.uniform(5_000, 100_000, size), rng.uniform(10, 500, size)
+    )
+    return np.rint(amounts * 100).astype(np.int64)
+
+
+def test_rolling_anomaly_flags_matches_per_row_check():
+    amounts = _amounts(2_000)
+
+    flags = rolling_anomaly_flags(amounts)
+
+    assert flags.tolist() == _reference_flags(amounts.tolist())
+    assert flags.any()
+
+
+def test_rolling_anomaly_flags_carries_history_between_chunks():
+    amounts = _amounts(1_000, seed=1)
+
+    chunks = []
+    for start in range(0, len(amounts), 64):
+        chunks.append(
+            rolling_anomaly_flags(amounts[start : start + 64], amounts[:start])
+        )
+
+    assert np.concatenate(chunks).tolist() == rolling_anomaly_flags(amounts).tolist()
@@ -0,0 +1,195 @@
+import asyncio
+import uuid
+from datetime import UTC, datetime
+from decimal import Decimal
+
+from prometheus_client import REGISTRY
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.batch_writer import _STOP, TransactionBatchWriter
+from src.models import DailyRollup, Transaction
+from tests.conftest import TestSessionMaker
+
+
+def _make_transaction(user_id: uuid.UUID) -> Transaction:
+    return Transaction(
+        user_id=user_id,
+        amount=Decimal("42.00"),
+        currency="INR",
+        txn_date=datetime.now(tz=UTC),
+        status="paid",
+        meta_data={"is_anomaly": False},
+    )
+
+
+async def _persisted_ids(user_id: uuid.UUID) -> set[uuid.UUID]:
+    async with TestSessionMaker() as session:
+        query = select(Transaction.id).where(Transaction.user_id == user_id)
+        return set((await session.execute(query)).scalars().all())
+
+
+def _flaky_session_maker(failures: int):
+    """Fails to open a session `failures` times, then opens test sessions."""
+    remaining = failures
+
+    def session_maker():
+        nonlocal remaining
+        if remaining > 0:
+            remaining -= 1
+            raise OperationalError("INSERT", {}, Exception("connection reset"))
+        return TestSessionMaker()
+
+    return session_maker
+
+
+def _counter(name: str) -> float:
+    return REGISTRY.get_sample_value(name) or 0.0
+
+
+async def test_batch_writer_flushes_after_interval(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    writer = TransactionBatchWriter(
+        TestSessionMaker, max_batch_size=100, flush_interval_ms=10, max_queue_size=10
+    )
+    writer.start()
+
+    txns = [_make_transaction(user_id) for _ in range(3)]
+    for txn in txns:
+        await writer.enqueue(txn)
+    await asyncio.sleep(0.2)
+
+    assert await _persisted_ids(user_id) == {txn.id for txn in txns}
+    await writer.stop()
+
+
+async def test_batch_writer_flushes_pending_rows_on_stop(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    writer = TransactionBatchWriter(
+        TestSessionMaker, max_batch_size=4, flush_interval_ms=60_000, max_queue_size=10
+    )
+    writer.start()
+
+    txns = [_make_transaction(user_id) for _ in range(10)]
+    for txn in txns:
+        await writer.enqueue(txn)
+    await writer.stop()
+
+    assert await _persisted_ids(user_id) == {txn.id for txn in txns}
+
+
+async def test_batch_writer_updates_daily_rollups(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    writer = TransactionBatchWriter(
+        TestSessionMaker, max_batch_size=2, flush_interval_ms=60_000, max_queue_size=10
+    )
+    writer.start()
+
+    txns = [_make_transaction(user_id) for _ in range(3)]
+    txns[0].status = "failed"
+    txns[1].meta_data = {"is_anomaly": True}
+    for txn in txns:
+        await writer.enqueue(txn)
+    await writer.stop()
+
+    async with TestSessionMaker() as session:
+        query = select(DailyRollup).where(DailyRollup.user_id == user_id)
+        rollup = (await session.execute(query)).scalar_one()
+
+    # Two batches were folded into the same day
+    assert rollup.day == txns[0].txn_date.date()
+    assert rollup.txn_count == 3
+    assert rollup.amount_sum == Decimal("126.00")
+    assert rollup.anomaly_count == 1
+    assert (rollup.paid_count, rollup.paid_amount) == (2, Decimal("84.00"))
+    assert (rollup.failed_count, rollup.failed_amount) == (1, Decimal("42.00"))
+
+
+async def test_batch_writer_retries_a_failed_batch(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    writer = TransactionBatchWriter(
+        _flaky_session_maker(2),
+        max_batch_size=100,
+        flush_interval_ms=60_000,
+        max_queue_size=10,
+        max_retries=3,
+        retry_backoff_ms=1,
+    )
+    retries = _counter("anomaly_txn_batch_retries_total")
+    writer.start()
+
+    txns = [_make_transaction(user_id) for _ in range(3)]
+    for txn in txns:
+        await writer.enqueue(txn)
+    await writer.stop()
+
+    assert await _persisted_ids(user_id) == {txn.id for txn in txns}
+    assert _counter("anomaly_txn_batch_retries_total") == retries + 2
+
+
+async def test_batch_writer_sheds_a_batch_after_its_retries(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    writer = TransactionBatchWriter(
+        _flaky_session_maker(3),
+        max_batch_size=2,
+        flush_interval_ms=60_000,
+        max_queue_size=10,
+        max_retries=2,
+        retry_backoff_ms=1,
+    )
+    shed = _counter("anomaly_txn_batch_rows_shed_total")
+    writer.start()
+
+    txns = [_make_transaction(user_id) for _ in range(4)]
+    for txn in txns:
+        await writer.enqueue(txn)
+    await writer.stop()
+
+    # The first batch failed three times, the second one went through
+    assert await _persisted_ids(user_id) == {txn.id for txn in txns[2:]}
+    assert _counter("anomaly_txn_batch_rows_shed_total") == shed + 2
+
+
+async def test_batch_writer_drains_rows_queued_behind_stop(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    writer = TransactionBatchWriter(
+        TestSessionMaker,
+        max_batch_size=100,
+        flush_interval_ms=60_000,
+        max_queue_size=10,
+    )
+
+    # A producer woken from a full queue can put its row after the stop marker
+    txns = [_make_transaction(user_id) for _ in range(2)]
+    writer._queue.put_nowait(txns[0])
+    writer._queue.put_nowait(_STOP)
+    writer._queue.put_nowait(txns[1])
+    writer.start()
+    await writer.stop()
+
+    assert await _persisted_ids(user_id) == {txn.id for txn in txns}
+
+
+async def test_batch_writer_bounds_the_users_it_remembers(db_session: AsyncSession):
+    user_ids = [uuid.uuid4() for _ in range(3)]
+    writer = TransactionBatchWriter(
+        TestSessionMaker,
+        max_batch_size=1,
+        flush_interval_ms=60_000,
+        max_queue_size=10,
+        max_known_users=2,
+    )
+    writer.start()
+
+    # The first user is forgotten, then registered again without a conflict
+    txns = [_make_transaction(user_id) for user_id in [*user_ids, user_ids[0]]]
+    for txn in txns:
+        await writer.enqueue(txn)
+    await writer.stop()
+
+    assert list(writer._known_users) == [user_ids[2], user_ids[0]]
+    persisted = set()
+    for user_id in user_ids:
+        persisted |= await _persisted_ids(user_id)
+    assert persisted == {txn.id for txn in txns}
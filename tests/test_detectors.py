@@ -0,0 +1,192 @@
+import math
+import uuid
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.anomaly import MIN_TXNS_FOR_ANOMALY_CHECK, rolling_anomaly_flags
+from src.detector_state import (
+    detector_state_key,
+    load_detector_states,
+    rebuild_states,
+    save_detector_states,
+)
+from src.detectors import (
+    DETECTORS,
+    EWMADetector,
+    MADDetector,
+    RollingMeanDetector,
+    WelfordDetector,
+    create_detector,
+)
+from src.models import Transaction
+
+
+def _amounts(size: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    spikes = rng.random(size) < 0.35
+    amounts = np.where(
+        spikes, rng.uniform(5_000, 100_000, size), rng.uniform(10, 500, size)
+    )
+    return np.rint(amounts * 100).astype(np.int64)
+
+
+def _ewma_reference(amounts: list[int], alpha: float, threshold: float) -> list[bool]:
+    count, mean, var = 0, 0.0, 0.0
+    flags = []
+    for amount in amounts:
+        if count == 0:
+            mean = amount
+        deviation = amount - mean
+        flags.append(
+            count >= MIN_TXNS_FOR_ANOMALY_CHECK
+            and deviation > threshold * math.sqrt(var)
+        )
+        increment = alpha * deviation
+        mean += increment
+        var = (1 - alpha) * (var + deviation * increment)
+        count += 1
+    return flags
+
+
+def _welford_reference(amounts: list[int], threshold: float) -> list[bool]:
+    count, mean, m2 = 0, 0.0, 0.0
+    flags = []
+    for amount in amounts:
+        std = math.sqrt(m2 / max(count - 1, 1))
+        flags.append(
+            count >= MIN_TXNS_FOR_ANOMALY_CHECK and amount - mean > threshold * std
+        )
+        count += 1
+        delta = amount - mean
+        mean += delta / count
+        m2 += delta * (amount - mean)
+    return flags
+
+
+def _mad_reference(amounts: list[int], window: int, threshold: float) -> list[bool]:
+    flags = []
+    for i, amount in enumerate(amounts):
+        recent = np.array(amounts[max(0, i - window) : i], dtype=np.float64)
+        if len(recent) < MIN_TXNS_FOR_ANOMALY_CHECK:
+            flags.append(False)
+            continue
+        median = np.median(recent)
+        mad = np.median(np.abs(recent - median))
+        flags.append(bool(mad > 0 and amount - median > threshold * 1.4826 * mad))
+    return flags
+
+
+@pytest.mark.parametrize(
+    ("detector", "reference"),
+    [
+        (RollingMeanDetector(), lambda a: rolling_anomaly_flags(np.array(a)).tolist()),
+        (EWMADetector(0.1, 3.5), lambda a: _ewma_reference(a, 0.1, 3.5)),
+        (EWMADetector(0.5, 1.0), lambda a: _ewma_reference(a, 0.5, 1.0)),
+        (WelfordDetector(1.0), lambda a: _welford_reference(a, 1.0)),
+        (MADDetector(50, 3.5), lambda a: _mad_reference(a, 50, 3.5)),
+    ],
+    ids=lambda value: getattr(value, "name", ""),
+)
+def test_score_batch_matches_per_amount_reference(detector, reference):
+    amounts = _amounts(1_500)
+    expected = reference(amounts.tolist())
+
+    state = detector.new_state()
+    assert detector.score_batch(amounts, state).tolist() == expected
+    assert any(expected)
+
+    # Chunks, single amounts and serialized states carry over the same way
+    state = detector.new_state()
+    chunks = np.array_split(amounts[:1_000], [1, 7, 300, 301])
+    flags = [detector.score_batch(chunk, state) for chunk in chunks]
+    for amount in amounts[1_000:].tolist():
+        state = detector.load_state(detector.dump_state(state))
+        flags.append([detector.score(amount, state)])
+    assert np.concatenate(flags).tolist() == expected
+
+
+def test_create_detector_knows_every_detector():
+    for name, detector_class in DETECTORS.items():
+        assert isinstance(create_detector(name), detector_class)
+    with pytest.raises(ValueError):
+        create_detector("unknown")
+
+
+async def test_detector_states_round_trip_through_redis(redis_client):
+    detector = MADDetector(50, 3.5)
+    user_ids = [uuid.uuid4(), uuid.uuid4()]
+    states = await load_detector_states(redis_client, detector, user_ids)
+    assert all(len(state["window"]) == 0 for state in states.values())
+
+    for i, state in enumerate(states.values()):
+        detector.score_batch(_amounts(100, seed=i), state)
+    await save_detector_states(redis_client, detector, states)
+
+    loaded = await load_detector_states(redis_client, detector, user_ids)
+    for user_id in user_ids:
+        assert loaded[user_id]["window"].tolist() == states[user_id]["window"].tolist()
+    fields = await redis_client.hgetall(detector_state_key(user_ids[0], detector))
+    assert list(fields) == ["window"]
+
+
+async def _store_amounts(
+    db_session: AsyncSession, user_id: uuid.UUID, amounts_cents: np.ndarray
+) -> None:
+    started = datetime.now(tz=UTC) - timedelta(days=1)
+    db_session.add_all(
+        Transaction(
+            user_id=user_id,
+            amount=Decimal(amount).scaleb(-2),
+            currency="INR",
+            txn_date=started + timedelta(minutes=i),
+            status="paid",
+        )
+        for i, amount in enumerate(amounts_cents.tolist())
+    )
+    await db_session.commit()
+
+
+async def test_rebuilt_state_matches_scoring_the_latest_amounts(
+    db_session: AsyncSession,
+):
+    detector = MADDetector(5, 3.5)
+    amounts = {uuid.uuid4(): _amounts(12, seed=i) for i in range(3)}
+    for user_id, user_amounts in amounts.items():
+        await _store_amounts(db_session, user_id, user_amounts)
+
+    chunks = [
+        chunk
+        async for chunk in rebuild_states(
+            db_session, detector, list(amounts), chunk_users=2
+        )
+    ]
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    rebuilt = {user_id: state for chunk in chunks for user_id, state in chunk.items()}
+    for user_id, user_amounts in amounts.items():
+        assert rebuilt[user_id]["window"].tolist() == user_amounts[-5:].tolist()
+
+
+async def test_missing_detector_states_are_rebuilt_on_load(
+    db_session: AsyncSession, redis_client
+):
+    detector = RollingMeanDetector()
+    cached, flushed, new = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    await _store_amounts(db_session, cached, _amounts(30, seed=1))
+    await _store_amounts(db_session, flushed, _amounts(30, seed=2))
+    cached_state = detector.new_state()
+    detector.score_batch(_amounts(3, seed=3), cached_state)
+    await save_detector_states(redis_client, detector, {cached: cached_state})
+
+    states = await load_detector_states(
+        redis_client, detector, [cached, flushed, new], db_session
+    )
+
+    assert states[cached]["window"].tolist() == cached_state["window"].tolist()
+    expected = _amounts(30, seed=2)[-detector.history_size :]
+    assert states[flushed]["window"].tolist() == expected.tolist()
+    assert len(states[new]["window"]) == 0
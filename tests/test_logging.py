@@ -0,0 +1,68 @@
+import json
+import logging
+import queue
+import sys
+
+from src import logging_config
+from src.logging_config import JSONFormatter, NonBlockingQueueHandler, RateLimitFilter
+
+
+def _record(msg: str, level: int = logging.INFO, lineno: int = 1) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, lineno, msg, None, None)
+
+
+def test_rate_limit_filter_limits_each_call_site(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(logging_config.time, "monotonic", lambda: now)
+    rate_limit = RateLimitFilter(rate=1.0, burst=2)
+
+    assert [rate_limit.filter(_record(f"{i}")) for i in range(4)] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    # Other call sites and warnings have their own allowance
+    assert rate_limit.filter(_record("other", lineno=2))
+    assert rate_limit.filter(_record("warning", level=logging.WARNING))
+
+    now += 1.0
+    record = _record("again")
+    assert rate_limit.filter(record)
+    assert record.msg == "again (2 similar messages suppressed)"
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+
+    handler.handle(_record("first"))
+    handler.handle(_record("second"))
+
+    assert handler.queue.get_nowait().msg == "first"
+    assert handler.queue.empty()
+
+
+def test_json_formatter_includes_the_traceback():
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        record = logging.LogRecord(
+            "test", logging.ERROR, __file__, 1, "failed %s", ("twice",), sys.exc_info()
+        )
+
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry["level"] == "ERROR"
+    assert entry["message"] == "failed twice"
+    assert entry["exc_info"].endswith("ValueError: bad")
+
+
+def test_zero_rate_limit_turns_the_filter_off(monkeypatch):
+    monkeypatch.setattr(logging_config.CONFIG, "LOG_RATE_LIMIT_PER_SECOND", 0)
+    root_handlers = logging.getLogger().handlers[:]
+    try:
+        logging_config.setup_logging()
+        assert logging.getHandlerByName("queue").filters == []
+    finally:
+        logging_config._stop_listener()
+        logging.getLogger().handlers[:] = root_handlers
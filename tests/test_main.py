@@ -1,5 +1,12 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
 from httpx import AsyncClient
 
+from src import database, main
+from src.config import CONFIG
+
 
 async def test_health(client: AsyncClient):
     response = await client.get("/health")
@@ -11,3 +18,106 @@ async def test_root(client: AsyncClient):
     response = await client.get("/", follow_redirects=False)
     assert response.status_code == 307
     assert response.headers["location"] == "/docs"
+
+
+async def test_ready_follows_the_lifespan(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(main, "init_partition_maintenance", lambda: None)
+    monkeypatch.setattr(CONFIG, "DB_PREWARM_CONNECTIONS", 0)
+    monkeypatch.setattr(CONFIG, "REDIS_PREWARM_CONNECTIONS", 0)
+    assert (await client.get("/ready")).status_code == 503
+
+    async with main.lifespan(main.app):
+        response = await client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["ready"] is True
+        assert response.json()["startup_seconds"] > 0
+
+    assert (await client.get("/ready")).status_code == 503
+
+
+def _failing_prewarm(monkeypatch, failures: int) -> list[int]:
+    """Makes the database prewarm fail `failures` times, returns the attempts."""
+    attempts = []
+
+    async def prewarm_engines(connections: int) -> None:
+        attempts.append(connections)
+        if len(attempts) <= failures:
+            raise ConnectionRefusedError("database is down")
+
+    async def prewarm_redis_pool(connections: int) -> None:
+        pass
+
+    monkeypatch.setattr(main, "init_partition_maintenance", lambda: None)
+    monkeypatch.setattr(main, "prewarm_engines", prewarm_engines)
+    monkeypatch.setattr(main, "prewarm_redis_pool", prewarm_redis_pool)
+    return attempts
+
+
+async def test_ready_reports_a_failed_prewarm(client: AsyncClient, monkeypatch):
+    attempts = _failing_prewarm(monkeypatch, failures=1)
+    monkeypatch.setattr(main, "PREWARM_RETRY_SECONDS", 60.0)
+
+    async with main.lifespan(main.app):
+        for _ in range(3):
+            response = await client.get("/ready")
+            assert response.status_code == 503
+            assert response.json() == {"ready": False, "prewarm_failed": ["database"]}
+        # Probes only report, the retry waits in the background
+        assert len(attempts) == 1
+
+
+async def test_failed_prewarm_is_retried_in_the_background(
+    client: AsyncClient, monkeypatch
+):
+    attempts = _failing_prewarm(monkeypatch, failures=2)
+    monkeypatch.setattr(main, "PREWARM_RETRY_SECONDS", 0.01)
+
+    async with main.lifespan(main.app):
+        for _ in range(100):
+            response = await client.get("/ready")
+            if response.status_code == 200:
+                break
+            await asyncio.sleep(0.01)
+        assert response.status_code == 200
+        assert len(attempts) == 3
+
+
+class _FakeConnection:
+    def __init__(self, fail: bool):
+        self.fail = fail
+        self.closed = False
+
+    async def start(self):
+        if self.fail:
+            raise ConnectionRefusedError("too many clients")
+        return self
+
+    async def execute(self, statement):
+        pass
+
+    async def close(self):
+        self.closed = True
+
+
+class _FakeEngine:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.connections: list[_FakeConnection] = []
+        self.pool = SimpleNamespace(size=lambda: 5)
+
+    def connect(self) -> _FakeConnection:
+        conn = _FakeConnection(fail=len(self.connections) < self.failures)
+        self.connections.append(conn)
+        return conn
+
+
+async def test_prewarm_engines_closes_the_connections_it_opened(monkeypatch):
+    db_engine = _FakeEngine(failures=2)
+    monkeypatch.setattr(database, "_engines", lambda: [db_engine])
+
+    with pytest.raises(ConnectionRefusedError):
+        await database.prewarm_engines(5)
+
+    opened = [conn for conn in db_engine.connections if not conn.fail]
+    assert len(opened) == 3
+    assert all(conn.closed for conn in opened)
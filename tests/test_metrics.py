@@ -0,0 +1,40 @@
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.metrics import instrument_engine
+from tests.conftest import USERS
+
+
+def _sample(name: str, labels: dict[str, str]) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+async def test_metrics_endpoint(client: AsyncClient):
+    labels = {"stage": "transactions_query"}
+    before = _sample("anomaly_stage_duration_seconds_count", labels)
+
+    response = await client.get("/transactions", params={"user_id": str(USERS[0])})
+    assert response.status_code == 200
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "anomaly_db_pool_checked_out" in response.text
+    assert "anomaly_transactions_cache_hits_total" in response.text
+    assert _sample("anomaly_stage_duration_seconds_count", labels) == before + 1
+
+
+async def test_instrument_engine():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    instrument_engine(engine)
+    labels = {"operation": "SELECT"}
+    before = _sample("anomaly_db_statement_duration_seconds_count", labels)
+
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        await conn.execute(text("  select 2"))
+    await engine.dispose()
+
+    assert _sample("anomaly_db_statement_duration_seconds_count", labels) == before + 2
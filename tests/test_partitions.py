@@ -0,0 +1,31 @@
+from datetime import UTC, datetime, timedelta, timezone
+
+import pytest
+
+from src.partitions import add_months, month_start, partition_name
+
+
+def test_month_start_uses_utc_months():
+    # Still October in UTC
+    ist = timezone(timedelta(hours=5, minutes=30))
+    moment = datetime(2026, 11, 1, 3, 0, tzinfo=ist)
+
+    assert month_start(moment) == datetime(2026, 10, 1, tzinfo=UTC)
+    assert month_start(datetime(2026, 10, 17, 12)) == datetime(2026, 10, 1, tzinfo=UTC)
+
+
+@pytest.mark.parametrize(
+    ("months", "expected"),
+    [
+        (0, datetime(2026, 10, 1, tzinfo=UTC)),
+        (3, datetime(2027, 1, 1, tzinfo=UTC)),
+        (-10, datetime(2025, 12, 1, tzinfo=UTC)),
+        (-22, datetime(2024, 12, 1, tzinfo=UTC)),
+    ],
+)
+def test_add_months_crosses_years(months: int, expected: datetime):
+    assert add_months(datetime(2026, 10, 1, tzinfo=UTC), months) == expected
+
+
+def test_partition_name():
+    assert partition_name(datetime(2027, 1, 1, tzinfo=UTC)) == "transactions_p2027_01"
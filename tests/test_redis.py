@@ -0,0 +1,45 @@
+import fakeredis
+import redis.asyncio as redis
+from fakeredis.aioredis import FakeAsyncRedisConnection
+
+from src import redis as src_redis
+from src.redis import InstrumentedConnectionPool, prewarm_redis_pool
+
+
+async def test_pool_reuses_connections_and_reports_stats():
+    pool = InstrumentedConnectionPool(
+        connection_class=FakeAsyncRedisConnection,
+        server=fakeredis.FakeServer(),
+        max_connections=2,
+        decode_responses=True,
+    )
+    client = redis.Redis(connection_pool=pool)
+
+    for i in range(5):
+        await client.set("key", str(i))
+    assert await client.get("key") == "4"
+
+    stats = pool.stats()
+    assert stats["max_connections"] == 2
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+    assert stats["wait_count"] == 6
+    assert stats["wait_seconds_max"] >= 0
+
+    await pool.aclose()
+
+
+async def test_prewarm_opens_connections_up_to_the_pool_size(monkeypatch):
+    pool = InstrumentedConnectionPool(
+        connection_class=FakeAsyncRedisConnection,
+        server=fakeredis.FakeServer(),
+        max_connections=3,
+        decode_responses=True,
+    )
+    monkeypatch.setattr(src_redis, "_pool", pool)
+
+    await prewarm_redis_pool(5)
+
+    assert pool.stats()["idle"] == 3
+    assert pool.stats()["in_use"] == 0
+    await pool.aclose()
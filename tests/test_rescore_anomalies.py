@@ -0,0 +1,99 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
+from fakeredis import FakeAsyncRedis, FakeServer
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+
+import rescore_anomalies
+from src.cache import transactions_version_key
+from src.config import CONFIG
+from src.models import DailyRollup, Transaction
+
+
+async def _create_database(url: str, user_ids: list[uuid.UUID]) -> None:
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        # Lets the rescoring read one connection while writing on another
+        await conn.execute(text("PRAGMA journal_mode=WAL"))
+        await conn.run_sync(SQLModel.metadata.create_all)
+        started = datetime(2026, 3, 1, tzinfo=UTC)
+        await conn.execute(
+            Transaction.__table__.insert(),
+            [
+                {
+                    "id": uuid.uuid4(),
+                    "user_id": user_id,
+                    "amount": Decimal("10000.00" if i == 15 else "100.00"),
+                    "currency": "INR",
+                    "txn_date": started + timedelta(hours=i),
+                    "status": "paid",
+                    # Stored with stale flags, the spike is not flagged yet
+                    "meta_data": {"is_anomaly": False},
+                }
+                for user_id in user_ids
+                for i in range(20)
+            ],
+        )
+    await engine.dispose()
+
+
+async def _anomalies(url: str) -> dict[uuid.UUID, int]:
+    engine = create_async_engine(url)
+    async with engine.connect() as conn:
+        flags = (await conn.execute(select(Transaction.meta_data))).scalars()
+        rollups = await conn.execute(
+            select(DailyRollup.user_id, DailyRollup.anomaly_count)
+        )
+    await engine.dispose()
+    assert sum(meta["is_anomaly"] for meta in flags) == 2
+    return dict(rollups.all())
+
+
+async def test_rescore_checkpoints_users_and_reports_failures(tmp_path, monkeypatch):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'rescore.db'}"
+    monkeypatch.setattr(CONFIG, "POSTGRES_URL", url)
+    server = FakeServer()
+    monkeypatch.setattr(
+        rescore_anomalies,
+        "_redis_client",
+        lambda: FakeAsyncRedis(server=server, decode_responses=True),
+    )
+    user_ids = [uuid.uuid4(), uuid.uuid4()]
+    await _create_database(url, user_ids)
+    checkpoint = tmp_path / "checkpoint.json"
+    done: set[str] = set()
+
+    # An unknown id fails, the other users are still rescored and checkpointed
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        scanned, changed, failed = await asyncio.to_thread(
+            rescore_anomalies.rescore_users,
+            pool,
+            ["not-a-user", *map(str, user_ids)],
+            done,
+            checkpoint,
+            "rolling_mean",
+            fetch_size=7,
+            batch_size=1,
+        )
+
+    assert (scanned, changed, failed) == (40, 2, ["not-a-user"])
+    assert rescore_anomalies.load_checkpoint(checkpoint) == set(map(str, user_ids))
+    assert await _anomalies(url) == {user_id: 1 for user_id in user_ids}
+    # Their cached pages are invalidated
+    redis_client = FakeAsyncRedis(server=server, decode_responses=True)
+    versions = [
+        await redis_client.get(transactions_version_key(user_id))
+        for user_id in user_ids
+    ]
+    assert versions == ["1", "1"]
+    await redis_client.aclose()
+
+    # Rescoring again finds nothing left to change
+    assert await asyncio.to_thread(
+        rescore_anomalies.rescore_user, str(user_ids[0]), "rolling_mean", 7, 1
+    ) == (20, 0)
@@ -0,0 +1,74 @@
+import uuid
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models import DailyRollup, Transaction
+from src.rollups import ROLLUP_METRICS, rebuild_rollups, rollup_rows, upsert_rollups
+
+
+def _transactions(user_id: uuid.UUID) -> list[Transaction]:
+    started = datetime(2026, 1, 30, 20, tzinfo=UTC)
+    return [
+        Transaction(
+            user_id=user_id,
+            amount=Decimal(f"{10 + i}.25"),
+            currency="INR",
+            txn_date=started + timedelta(hours=5 * i),
+            status=("paid", "failed", "pending")[i % 3],
+            meta_data={"is_anomaly": i % 4 == 0},
+        )
+        for i in range(24)
+    ]
+
+
+async def _rollups(db_session: AsyncSession, user_id: uuid.UUID) -> dict:
+    query = select(DailyRollup).where(DailyRollup.user_id == user_id)
+    rollups = (await db_session.execute(query)).scalars().all()
+    return {
+        rollup.day: {metric: getattr(rollup, metric) for metric in ROLLUP_METRICS}
+        for rollup in rollups
+    }
+
+
+async def test_incremental_rollups_match_a_rebuild(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    txns = _transactions(user_id)
+    db_session.add_all(txns)
+    # Upserted in chunks, as the batch writer and bulk_load do
+    for start in range(0, len(txns), 7):
+        await upsert_rollups(db_session, rollup_rows(txns[start : start + 7]))
+    await db_session.commit()
+    incremental = await _rollups(db_session, user_id)
+
+    await rebuild_rollups(db_session, [user_id])
+    await db_session.commit()
+    db_session.expire_all()
+
+    assert len(incremental) == 6
+    assert await _rollups(db_session, user_id) == incremental
+
+
+async def test_rebuild_keeps_the_rollups_of_expired_rows(db_session: AsyncSession):
+    user_id = uuid.uuid4()
+    txns = _transactions(user_id)
+    db_session.add_all(txns)
+    await upsert_rollups(db_session, rollup_rows(txns))
+    await db_session.commit()
+    before = await _rollups(db_session, user_id)
+
+    # The oldest month's rows are gone, as when its partition expires
+    await db_session.execute(
+        delete(Transaction).where(
+            Transaction.user_id == user_id,
+            Transaction.txn_date < datetime(2026, 2, 1, tzinfo=UTC),
+        )
+    )
+    await rebuild_rollups(db_session, [user_id])
+    await db_session.commit()
+    db_session.expire_all()
+
+    assert await _rollups(db_session, user_id) == before
+    assert min(before) < datetime(2026, 2, 1).date()
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import uuid
+from datetime import UTC, datetime, timedelta
+
+import numpy as np
+from fakeredis import FakeAsyncRedis, FakeServer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.anomaly import ROLLING_WINDOW_SIZE
+from src.batch_writer import TransactionBatchWriter
+from src.detector_state import detector_state_key, save_detector_states
+from src.leases import detector_lock_key
+from src.models import Transaction
+from src.simulator import TransactionSimulator
+from src.sse import SSEConnection
+from tests.conftest import TestSessionMaker
+
+
+async def _subscribe(
+    simulator: TransactionSimulator, user_id: uuid.UUID
+) -> SSEConnection:
+    connection = SSEConnection(user_id, max_queued=100)
+    await simulator.subscribe(connection)
+    return connection
+
+
+async def _next_event(connection: SSEConnection) -> dict:
+    frame = await asyncio.wait_for(anext(connection.frames(60)), timeout=1)
+    event_id, data = frame.split("\n", 1)
+    assert event_id.startswith("id: ")
+    assert data.startswith("data: ")
+    return json.loads(data.removeprefix("data: "))
+
+
+async def test_subscribers_of_same_user_share_events(simulator: TransactionSimulator):
+    user_id = uuid.uuid4()
+    first = await _subscribe(simulator, user_id)
+    second = await _subscribe(simulator, user_id)
+
+    event = await _next_event(first)
+    assert event["user_id"] == str(user_id)
+    assert await _next_event(second) == event
+    assert simulator.active_users == 1
+
+    await simulator.unsubscribe(first)
+    await simulator.unsubscribe(second)
+    assert simulator.active_users == 0
+
+
+async def test_simulator_stops_without_subscribers(simulator: TransactionSimulator):
+    user_id = uuid.uuid4()
+    connection = await _subscribe(simulator, user_id)
+    await _next_event(connection)
+
+    await simulator.unsubscribe(connection)
+    await asyncio.sleep(0.1)
+
+    assert simulator._task is None
+    assert simulator.active_users == 0
+
+
+async def test_simulator_saves_detector_state(simulator: TransactionSimulator):
+    user_id = uuid.uuid4()
+    connection = await _subscribe(simulator, user_id)
+    await _next_event(connection)
+    await _next_event(connection)
+
+    # Saved before the events are published
+    key = detector_state_key(user_id, simulator.detector)
+    state = simulator.detector.load_state(await simulator.redis_client.hgetall(key))
+    assert len(state["window"]) >= 2
+
+    # The detector lock is only held during a tick
+    assert not await simulator.redis_client.exists(detector_lock_key(user_id))
+    await simulator.unsubscribe(connection)
+
+
+async def test_simulator_keeps_states_advanced_by_ingestion(
+    simulator: TransactionSimulator,
+):
+    user_id = uuid.uuid4()
+    simulator.interval_seconds = 0.2
+    connection = await _subscribe(simulator, user_id)
+    await _next_event(connection)
+
+    # A batch ingested between two ticks
+    detector = simulator.detector
+    state = detector.new_state()
+    detector.score_batch(np.array([700, 800, 900], dtype=np.int64), state)
+    await save_detector_states(simulator.redis_client, detector, {user_id: state})
+    await _next_event(connection)
+
+    key = detector_state_key(user_id, detector)
+    state = detector.load_state(await simulator.redis_client.hgetall(key))
+    assert state["window"].tolist()[:3] == [700, 800, 900]
+    assert len(state["window"]) == 4
+    await simulator.unsubscribe(connection)
+
+
+async def test_simulator_rebuilds_missing_detector_state(
+    simulator: TransactionSimulator, db_session: AsyncSession
+):
+    user_id = uuid.uuid4()
+    started = datetime.now(tz=UTC) - timedelta(days=1)
+    db_session.add_all(
+        Transaction(
+            user_id=user_id,
+            amount=100 + i,
+            currency="INR",
+            txn_date=started + timedelta(minutes=i),
+            status="paid",
+        )
+        for i in range(ROLLING_WINDOW_SIZE + 5)
+    )
+    await db_session.commit()
+    simulator.session_maker = TestSessionMaker
+    # A single tick during the test
+    simulator.interval_seconds = 60
+
+    connection = await _subscribe(simulator, user_id)
+    await _next_event(connection)
+
+    # The stored history is scored first, the new amount joins its window
+    key = detector_state_key(user_id, simulator.detector)
+    state = simulator.detector.load_state(await simulator.redis_client.hgetall(key))
+    window = state["window"].tolist()
+    assert window[:-1] == [(106 + i) * 100 for i in range(ROLLING_WINDOW_SIZE - 1)]
+    await simulator.unsubscribe(connection)
+
+
+async def test_redis_fanout_produces_once_across_workers(db_session: AsyncSession):
+    server = FakeServer()
+    writer = TransactionBatchWriter(
+        TestSessionMaker, max_batch_size=100, flush_interval_ms=10, max_queue_size=100
+    )
+    writer.start()
+    workers = [
+        TransactionSimulator(
+            FakeAsyncRedis(server=server, decode_responses=True),
+            writer,
+            interval_seconds=0.05,
+            fanout="redis",
+        )
+        for _ in range(2)
+    ]
+
+    user_id = uuid.uuid4()
+    connections = [await _subscribe(worker, user_id) for worker in workers]
+
+    # The first worker may see one event more, published before the second
+    # worker subscribed
+    first_ids = {(await _next_event(connections[0]))["id"] for _ in range(4)}
+    second_ids = {(await _next_event(connections[1]))["id"] for _ in range(3)}
+    # Both workers relay the same stream, produced by a single lease holder
+    assert second_ids <= first_ids
+    assert sum(user_id in worker._leased_users for worker in workers) == 1
+
+    for worker, connection in zip(workers, connections, strict=True):
+        await worker.unsubscribe(connection)
+        await worker.stop()
+        await worker.redis_client.aclose()
+    await writer.stop()
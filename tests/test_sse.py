@@ -0,0 +1,235 @@
+import asyncio
+import uuid
+
+import pytest
+from httpx import AsyncClient
+from redis.asyncio import Redis
+
+from src import sse
+from src.event_stream import (
+    append_events,
+    events_channel,
+    format_event,
+    parse_published,
+    read_events_after,
+)
+from src.simulator import TransactionSimulator
+from src.sse import (
+    HEARTBEAT_FRAME,
+    ConnectionLimitError,
+    SSEConnection,
+    SSEConnectionManager,
+    StreamSession,
+    UserSubscription,
+)
+
+
+def _manager(simulator: TransactionSimulator, **kwargs) -> SSEConnectionManager:
+    options = {"max_connections": 3, "max_connections_per_user": 2, "queue_size": 10}
+    return SSEConnectionManager(simulator, **(options | kwargs))
+
+
+async def test_manager_enforces_connection_caps(simulator: TransactionSimulator):
+    manager = _manager(simulator)
+    user_id = uuid.uuid4()
+    first = await manager.connect(user_id)
+    await manager.connect(user_id)
+
+    with pytest.raises(ConnectionLimitError):
+        await manager.connect(user_id)
+    await manager.connect(uuid.uuid4())
+    with pytest.raises(ConnectionLimitError):
+        await manager.connect(uuid.uuid4())
+
+    # A disconnect frees its slot, once
+    await manager.disconnect(first)
+    await manager.disconnect(first)
+    assert manager.connections == 2
+    await manager.connect(user_id)
+
+
+async def test_disconnect_releases_the_subscription(simulator: TransactionSimulator):
+    manager = _manager(simulator)
+    connection = await manager.connect(uuid.uuid4())
+    assert simulator.active_users == 1
+
+    await manager.disconnect(connection)
+
+    assert simulator.active_users == 0
+    assert connection.closed
+
+
+def test_slow_consumer_loses_oldest_frames():
+    connection = SSEConnection(uuid.uuid4(), max_queued=3)
+    for i in range(5):
+        connection.offer(f"data: {i}\n\n")
+
+    assert connection.queued == 3
+    assert connection.dropped == 2
+
+
+async def test_slow_consumer_is_disconnected():
+    connection = SSEConnection(uuid.uuid4(), max_queued=3, slow_consumer="disconnect")
+    for i in range(5):
+        connection.offer(f"data: {i}\n\n")
+
+    assert connection.close_reason == "slow consumer"
+    # The queued frames are released, the stream ends straight away
+    assert [frame async for frame in connection.frames(60)] == []
+
+
+async def test_idle_stream_gets_heartbeats():
+    connection = SSEConnection(uuid.uuid4(), max_queued=3)
+    frames = connection.frames(0.01)
+
+    assert await anext(frames) == HEARTBEAT_FRAME
+    connection.offer("data: 1\n\n")
+    assert await anext(frames) == "data: 1\n\n"
+    connection.close("done")
+    await asyncio.wait_for(anext(frames, None), timeout=1)
+
+
+async def test_sse_endpoint_rejects_connections_over_the_cap(
+    client: AsyncClient, simulator: TransactionSimulator, monkeypatch
+):
+    manager = _manager(simulator, max_connections_per_user=1)
+    monkeypatch.setattr(sse, "_manager", manager)
+    user_id = uuid.uuid4()
+    await manager.connect(user_id)
+
+    response = await client.get(f"/sse/transactions/{user_id}")
+
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+async def test_events_are_replayed_after_last_event_id(redis_client: Redis):
+    user_id = uuid.uuid4()
+    event_ids = [
+        (await append_events(redis_client, {user_id: f"{i}"}, 100, 60))[user_id]
+        for i in range(4)
+    ]
+
+    frames = await read_events_after(redis_client, user_id, event_ids[1], 100)
+
+    assert frames == [format_event(event_ids[2], "2"), format_event(event_ids[3], "3")]
+    assert await read_events_after(redis_client, user_id, event_ids[3], 100) == []
+
+
+async def test_published_events_reach_the_channel(redis_client: Redis):
+    user_id = uuid.uuid4()
+    async with redis_client.pubsub() as pubsub:
+        await pubsub.subscribe(events_channel(user_id))
+        await pubsub.get_message(timeout=1)
+
+        events = await append_events(redis_client, {user_id: "1"}, 100, 60, True)
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+
+    assert parse_published(message["data"]) == format_event(events[user_id], "1")
+    assert await read_events_after(redis_client, user_id, "0-0", 100) == [
+        format_event(events[user_id], "1")
+    ]
+
+
+async def test_live_events_already_replayed_are_skipped():
+    connection = SSEConnection(uuid.uuid4(), max_queued=3)
+    for event_id in ("5-0", "6-0", "6-1"):
+        connection.offer(format_event(event_id, event_id))
+
+    frames = connection.frames(60, after="6-0")
+
+    assert await anext(frames) == format_event("6-1", "6-1")
+    connection.offer(format_event("7-0", "7-0"))
+    assert await anext(frames) == format_event("7-0", "7-0")
+
+
+async def test_session_names_events_by_user(simulator: TransactionSimulator):
+    manager = _manager(simulator)
+    user_ids = [uuid.uuid4(), uuid.uuid4()]
+    session = await manager.open_session(user_ids)
+
+    frames = session.connection.frames(60)
+    received = {
+        (await asyncio.wait_for(anext(frames), 1)).split("\n")[0] for _ in range(4)
+    }
+
+    assert received == {f"event: user:{user_id}" for user_id in user_ids}
+    assert simulator.active_users == 2
+
+    await manager.close_session(session)
+    assert simulator.active_users == 0
+    assert manager.connections == 0
+
+
+async def test_session_queue_grows_with_its_users(simulator: TransactionSimulator):
+    manager = _manager(simulator, slow_consumer="disconnect", max_session_users=50)
+    user_ids = [uuid.uuid4() for _ in range(25)]
+    session = await manager.open_session(user_ids)
+
+    # A tick delivers a frame per user, more than `queue_size` in one go
+    async with asyncio.timeout(1):
+        while session.connection.queued < len(user_ids):
+            await asyncio.sleep(0.01)
+
+    assert not session.connection.closed
+    assert session.connection.max_queued == 10 * len(user_ids)
+    await manager.remove_users(session, user_ids[5:])
+    assert session.connection.max_queued == 10 * 5
+    await manager.close_session(session)
+
+
+async def test_session_gets_one_error_frame_per_tick(
+    simulator: TransactionSimulator, monkeypatch
+):
+    # Ticks never finish, so only the broadcast below is queued
+    stalled = asyncio.Event()
+    monkeypatch.setattr(simulator, "_tick", stalled.wait)
+    manager = _manager(simulator)
+    session = await manager.open_session([uuid.uuid4() for _ in range(3)])
+    connection = await manager.connect(uuid.uuid4())
+
+    simulator._broadcast("event: error\ndata: boom\n\n")
+
+    assert session.connection.queued == 1
+    assert connection.queued == 1
+    stalled.set()
+    await manager.close_session(session)
+    await manager.disconnect(connection)
+
+
+def test_anomalies_only_session_drops_other_events():
+    session = StreamSession(SSEConnection(None, max_queued=10), anomalies_only=True)
+    subscription = UserSubscription(session, uuid.uuid4())
+    for is_anomaly in ("false", "true"):
+        subscription.offer(
+            format_event("1-0", f'{{"meta_data":{{"is_anomaly":{is_anomaly}}}}}')
+        )
+
+    assert session.connection.queued == 1
+
+
+async def test_session_subscriptions_endpoints(
+    client: AsyncClient, simulator: TransactionSimulator, monkeypatch
+):
+    manager = _manager(simulator, max_session_users=2)
+    monkeypatch.setattr(sse, "_manager", manager)
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    session = await manager.open_session([first])
+    path = f"/sse/sessions/{session.id}/subscriptions"
+
+    response = await client.post(path, json={"user_ids": [str(second)]})
+    assert response.status_code == 200
+    assert response.json()["user_ids"] == [str(first), str(second)]
+
+    response = await client.post(path, json={"user_ids": [str(third)]})
+    assert response.status_code == 429
+
+    response = await client.delete(path, params={"user_id": [str(first)]})
+    assert response.json()["user_ids"] == [str(second)]
+    assert simulator.active_users == 1
+
+    response = await client.post(
+        "/sse/sessions/unknown/subscriptions", json={"user_ids": [str(third)]}
+    )
+    assert response.status_code == 404
+    await manager.close_session(session)
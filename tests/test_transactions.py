@@ -1,3 +1,8 @@
+import asyncio
+import csv
+import io
+import json
+import uuid
 from datetime import UTC, datetime, timedelta
 from decimal import Decimal
 from urllib.parse import urlencode
@@ -5,10 +10,25 @@ from urllib.parse import urlencode
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient
-from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlmodel import SQLModel, select
 
-from src.models import Transaction
-from tests.conftest import USERS
+from src import ingest
+from src.cache import TransactionsCache, bump_transactions_version, transactions_cache
+from src.config import CONFIG
+from src.database import get_read_session
+from src.detector_state import load_detector_states
+from src.detectors import WelfordDetector
+from src.leases import acquire_leases, detector_lock_key, release_leases
+from src.main import app
+from src.models import ListTransactionsResponse, Transaction, TransactionFilters
+from src.rollups import rebuild_rollups
+from src.routers.transaction import _page_query
+from src.utils import encode_cursor
+from tests.conftest import USERS, TestSessionMaker
 
 
 @pytest.fixture(scope="module")
@@ -161,3 +181,441 @@ async def test_get_transactions_with_amount_filter(
     assert len(data["transactions"]) == 5
     for txn in data["transactions"]:
         assert min_amount <= float(txn["amount"]) <= max_amount
+
+
+async def test_get_transactions_pagination_breaks_date_ties_by_id(
+    client: AsyncClient, db_session: AsyncSession, fixed_utc_now: datetime
+):
+    """Test that paging through rows sharing a txn_date returns each once."""
+    user_id = USERS[1]
+    txn_date = fixed_utc_now - timedelta(hours=1)
+    db_session.add_all(
+        Transaction(
+            user_id=user_id,
+            amount=Decimal("10.00"),
+            currency="INR",
+            txn_date=txn_date,
+            status="paid",
+        )
+        for _ in range(7)
+    )
+    await db_session.commit()
+
+    params = {
+        "user_id": str(user_id),
+        "to_date": fixed_utc_now.isoformat().replace("+00:00", "Z"),
+        "limit": "3",
+    }
+    seen = []
+    while True:
+        response = await client.get(f"/transactions?{urlencode(params)}")
+        assert response.status_code == 200
+        data = response.json()
+        seen.extend(t["id"] for t in data["transactions"])
+        if not data["transactions"]:
+            break
+        params["cursor"] = data["cursor"]
+
+    assert len(seen) == len(set(seen)) == 7
+    assert seen == sorted(seen, reverse=True)
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "AAAA", "é"])
+async def test_get_transactions_rejects_invalid_cursor(client: AsyncClient, cursor):
+    params = {"user_id": str(USERS[0]), "cursor": cursor}
+
+    response = await client.get(f"/transactions?{urlencode(params)}")
+
+    assert response.status_code == 400
+
+
+async def test_get_transactions_matches_response_model(
+    client: AsyncClient, seed_transactions, fixed_utc_now: datetime
+):
+    """Test that the orjson-encoded page is a valid ListTransactionsResponse."""
+    user_id, txns = seed_transactions
+    params = {
+        "user_id": str(user_id),
+        "to_date": fixed_utc_now.isoformat().replace("+00:00", "Z"),
+        "limit": "1",
+    }
+
+    response = await client.get(f"/transactions?{urlencode(params)}")
+
+    assert response.status_code == 200
+    page = ListTransactionsResponse.model_validate_json(response.content)
+    assert str(page.transactions[0].id) == str(txns[0].id)
+    # Amounts stay strings so no precision is lost on the way
+    assert response.json()["transactions"][0]["amount"] == "100.00"
+
+
+async def test_get_transactions_is_cached_until_version_bump(
+    client: AsyncClient,
+    seed_transactions,
+    fixed_utc_now: datetime,
+    db_session: AsyncSession,
+    redis_client: Redis,
+):
+    """Test that identical requests are served from the cache until invalidated."""
+    user_id, _ = seed_transactions
+    params = {
+        "user_id": str(user_id),
+        "to_date": fixed_utc_now.isoformat().replace("+00:00", "Z"),
+    }
+    hits = transactions_cache.hits
+
+    response1 = await client.get(f"/transactions?{urlencode(params)}")
+    response2 = await client.get(f"/transactions?{urlencode(params)}")
+    assert response1.json() == response2.json()
+    assert transactions_cache.hits == hits + 1
+
+    db_session.add(
+        Transaction(
+            user_id=user_id,
+            amount=Decimal("1.00"),
+            currency="INR",
+            txn_date=fixed_utc_now - timedelta(hours=1),
+            status="paid",
+        )
+    )
+    await db_session.commit()
+    await bump_transactions_version(redis_client, {user_id})
+
+    response3 = await client.get(f"/transactions?{urlencode(params)}")
+    assert len(response3.json()["transactions"]) == 21
+
+
+async def test_cache_misses_are_computed_on_the_primary(
+    client: AsyncClient, seed_transactions, fixed_utc_now: datetime, monkeypatch
+):
+    """Test that a lagging replica's page is never cached."""
+    user_id, _ = seed_transactions
+    # A replica that has not caught up with any of the user's rows
+    replica = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with replica.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+    async def get_replica_session():
+        async with AsyncSession(replica) as session:
+            yield session
+
+    app.dependency_overrides[get_read_session] = get_replica_session
+    params = {
+        "user_id": str(user_id),
+        "to_date": fixed_utc_now.isoformat().replace("+00:00", "Z"),
+    }
+    url = f"/transactions?{urlencode(params)}"
+
+    cached = await client.get(url)
+    assert len(cached.json()["transactions"]) == 20
+
+    monkeypatch.setattr(CONFIG, "TRANSACTIONS_CACHE_ENABLED", False)
+    uncached = await client.get(url)
+    assert uncached.json()["transactions"] == []
+    await replica.dispose()
+
+
+async def test_transactions_cache_coalesces_concurrent_misses(redis_client: Redis):
+    """Test that concurrent identical misses run a single query."""
+    cache = TransactionsCache(ttl_seconds=60)
+    params = TransactionFilters(user_id=USERS[1])
+    calls = 0
+
+    async def compute() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return '{"transactions": [], "cursor": ""}'
+
+    pages = await asyncio.gather(
+        *(cache.get_or_compute(redis_client, params, compute) for _ in range(5))
+    )
+
+    assert calls == 1
+    assert len(set(pages)) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+async def test_export_transactions_ndjson(
+    client: AsyncClient, seed_transactions, fixed_utc_now: datetime
+):
+    """Test streaming every matching transaction as NDJSON."""
+    user_id, txns = seed_transactions
+    params = {
+        "user_id": str(user_id),
+        "to_date": fixed_utc_now.isoformat().replace("+00:00", "Z"),
+        "limit": "5",
+    }
+
+    response = await client.get(f"/transactions/export?{urlencode(params)}")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    # The page limit does not apply to exports
+    assert {row["id"] for row in rows} == {str(txn.id) for txn in txns}
+    dates = [row["txn_date"] for row in rows]
+    assert dates == sorted(dates, reverse=True)
+
+
+async def test_export_transactions_csv_gzip(
+    client: AsyncClient, seed_transactions, fixed_utc_now: datetime
+):
+    """Test streaming transactions as gzip compressed CSV."""
+    user_id, txns = seed_transactions
+    params = {
+        "user_id": str(user_id),
+        "to_date": fixed_utc_now.isoformat().replace("+00:00", "Z"),
+        "format": "csv",
+        "gzip": "true",
+    }
+
+    response = await client.get(f"/transactions/export?{urlencode(params)}")
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == len(txns)
+    assert {row["amount"] for row in rows} == {str(txn.amount) for txn in txns}
+
+
+async def test_get_transactions_summary(
+    client: AsyncClient, db_session: AsyncSession, seed_transactions
+):
+    """Test daily and monthly totals built from rebuilt rollups."""
+    user_id, txns = seed_transactions
+    await rebuild_rollups(db_session)
+    await db_session.commit()
+
+    params = {"user_id": str(user_id)}
+    response = await client.get(f"/transactions/summary?{urlencode(params)}")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["granularity"] == "day"
+    # 20 seeded days plus the conftest transaction a year ago
+    days = data["buckets"]
+    assert len(days) == 21
+    assert [day["period"] for day in days] == sorted(day["period"] for day in days)
+    assert sum(day["txn_count"] for day in days) == 21
+    assert sum(Decimal(day["amount_sum"]) for day in days) == Decimal("4000.00")
+    assert all(day["paid_count"] == day["txn_count"] for day in days)
+
+    params["granularity"] = "month"
+    response = await client.get(f"/transactions/summary?{urlencode(params)}")
+
+    months = response.json()["buckets"]
+    assert all(month["period"].endswith("-01") for month in months)
+    assert sum(month["txn_count"] for month in months) == 21
+    assert sum(Decimal(m["amount_sum"]) for m in months) == Decimal("4000.00")
+
+    params["from_date"] = txns[4].txn_date.date().isoformat()
+    params["granularity"] = "day"
+    response = await client.get(f"/transactions/summary?{urlencode(params)}")
+
+    assert len(response.json()["buckets"]) == 5
+
+
+def _batch_rows(user_id, amounts: list[str], start: datetime) -> list[dict]:
+    return [
+        {
+            "user_id": str(user_id),
+            "amount": amount,
+            "currency": "INR",
+            "txn_date": (start + timedelta(minutes=i)).isoformat(),
+            "status": "paid",
+        }
+        for i, amount in enumerate(amounts)
+    ]
+
+
+async def test_ingest_transactions_batch(
+    client: AsyncClient, db_session: AsyncSession, fixed_utc_now: datetime
+):
+    user_id = uuid.uuid4()
+    # Scored in txn_date order, the spike comes after ten regular amounts
+    rows = _batch_rows(user_id, ["100.00"] * 10 + ["5000.00"], fixed_utc_now)
+    rows.reverse()
+
+    response = await client.post("/transactions/batch", json=rows)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inserted"] == 11
+    assert body["anomalies"] == 1
+    assert [result["is_anomaly"] for result in body["results"]] == [True] + [False] * 10
+
+    stored = (
+        await db_session.execute(
+            select(Transaction).where(Transaction.user_id == user_id)
+        )
+    ).scalars()
+    flags = {str(txn.id): txn.meta_data["is_anomaly"] for txn in stored}
+    assert flags == {result["id"]: result["is_anomaly"] for result in body["results"]}
+
+
+async def test_ingest_transactions_batch_ndjson_continues_detector_state(
+    client: AsyncClient, fixed_utc_now: datetime
+):
+    user_id = uuid.uuid4()
+    first = _batch_rows(user_id, ["100.00"] * 10, fixed_utc_now)
+    second = _batch_rows(user_id, ["5000.00"], fixed_utc_now + timedelta(hours=1))
+
+    for rows in (first, second):
+        response = await client.post(
+            "/transactions/batch",
+            content="\n".join(json.dumps(row) for row in rows) + "\n",
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == 200
+
+    assert response.json()["results"][0]["is_anomaly"] is True
+
+
+async def test_ingest_transactions_batch_reports_invalid_rows(client: AsyncClient):
+    rows = _batch_rows(uuid.uuid4(), ["1.00", "1.001"], datetime.now(tz=UTC))
+
+    response = await client.post("/transactions/batch", json=rows)
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == [1, "amount"]
+
+
+async def test_ingest_transactions_batch_rejects_duplicate_ids(
+    client: AsyncClient, fixed_utc_now: datetime
+):
+    rows = _batch_rows(uuid.uuid4(), ["1.00", "2.00"], fixed_utc_now)
+    for row in rows:
+        row["id"] = str(uuid.uuid4())
+
+    response = await client.post("/transactions/batch", json=[rows[0], rows[0]])
+    assert response.status_code == 422
+
+    assert (await client.post("/transactions/batch", json=rows)).status_code == 200
+    # A retried batch is refused without scoring it again
+    response = await client.post("/transactions/batch", json=rows)
+    assert response.status_code == 409
+    assert rows[0]["id"] in response.json()["detail"]
+
+
+async def test_ingest_transactions_batch_survives_redis_failure_after_commit(
+    client: AsyncClient, db_session: AsyncSession, fixed_utc_now: datetime, monkeypatch
+):
+    async def fail(*args):
+        raise RedisError("down")
+
+    monkeypatch.setattr(ingest, "save_detector_states", fail)
+    monkeypatch.setattr(ingest, "bump_transactions_version", fail)
+    user_id = uuid.uuid4()
+
+    response = await client.post(
+        "/transactions/batch", json=_batch_rows(user_id, ["1.00"], fixed_utc_now)
+    )
+
+    assert response.status_code == 200
+    stored = await db_session.execute(
+        select(Transaction.id).where(Transaction.user_id == user_id)
+    )
+    assert [str(txn_id) for txn_id in stored.scalars()] == [
+        response.json()["results"][0]["id"]
+    ]
+
+
+async def test_ingest_transactions_batch_refuses_users_locked_too_long(
+    client: AsyncClient, redis_client: Redis, fixed_utc_now: datetime, monkeypatch
+):
+    monkeypatch.setattr(CONFIG, "TXN_INGEST_LEASE_WAIT_MS", 50)
+    user_id = uuid.uuid4()
+    rows = _batch_rows(user_id, ["1.00"], fixed_utc_now)
+    await acquire_leases(
+        redis_client, [user_id], "simulator", 60_000, detector_lock_key
+    )
+
+    response = await client.post("/transactions/batch", json=rows)
+
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+
+    # Released while the next batch waits for it
+    async def release() -> None:
+        await asyncio.sleep(0.01)
+        await release_leases(redis_client, [user_id], "simulator", detector_lock_key)
+
+    response, _ = await asyncio.gather(
+        client.post("/transactions/batch", json=rows), release()
+    )
+    assert response.status_code == 200
+    # The batch's own lock is released once it is stored
+    assert not await redis_client.exists(detector_lock_key(user_id))
+
+
+async def test_overlapping_ingest_batches_wait_for_each_other(
+    db_session: AsyncSession, redis_client: Redis, fixed_utc_now: datetime
+):
+    shared = [uuid.uuid4(), uuid.uuid4()]
+    detector = WelfordDetector(threshold=3.0)
+
+    async def ingest_batch() -> list[bool]:
+        rows = [
+            *_batch_rows(shared[0], ["10.00"] * 5, fixed_utc_now),
+            *_batch_rows(uuid.uuid4(), ["10.00"] * 5, fixed_utc_now),
+            *_batch_rows(shared[1], ["10.00"] * 5, fixed_utc_now),
+        ]
+        txns = ingest.parse_transactions(
+            json.dumps(rows).encode(), ndjson=False, max_rows=100
+        )
+        async with TestSessionMaker() as db:
+            return await ingest.ingest_transactions(db, redis_client, detector, txns)
+
+    await asyncio.gather(*(ingest_batch() for _ in range(8)))
+
+    # No batch overwrote the state another one had advanced
+    states = await load_detector_states(redis_client, detector, shared)
+    assert [states[user_id]["count"] for user_id in shared] == [40, 40]
+
+
+async def test_ingest_transactions_batch_refuses_oversized_batches(
+    client: AsyncClient, fixed_utc_now: datetime, monkeypatch
+):
+    monkeypatch.setattr(CONFIG, "TXN_INGEST_MAX_ROWS", 1)
+    # Refused on the row count, before the invalid amounts are validated
+    rows = _batch_rows(uuid.uuid4(), ["1.001", "1.001"], fixed_utc_now)
+
+    response = await client.post("/transactions/batch", json=rows)
+    assert response.status_code == 413
+
+    response = await client.post(
+        "/transactions/batch",
+        content="\n".join(json.dumps(row) for row in rows),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 413
+
+    monkeypatch.setattr(CONFIG, "TXN_INGEST_MAX_BYTES", 100)
+    response = await client.post("/transactions/batch", json=rows[:1])
+    assert response.status_code == 413
+    assert "bytes" in response.json()["detail"]
+
+
+async def test_page_query_is_an_index_range_scan(db_session: AsyncSession):
+    now = datetime.now(tz=UTC)
+    params = TransactionFilters(
+        user_id=USERS[0],
+        from_date=now - timedelta(days=30),
+        to_date=now,
+        cursor=encode_cursor(now, uuid.uuid4()),
+    )
+    query = _page_query(params).compile(
+        db_session.bind, compile_kwargs={"literal_binds": True}
+    )
+
+    plan = (await db_session.execute(text(f"EXPLAIN QUERY PLAN {query}"))).all()
+
+    details = [row[-1] for row in plan]
+    # The cursor is part of the index range and the order needs no sort
+    assert any(
+        "USING INDEX ix_user_date_id (user_id=? AND txn_date>? AND txn_date<?)"
+        in detail
+        for detail in details
+    )
+    assert not any("TEMP B-TREE" in detail for detail in details)
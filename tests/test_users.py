@@ -13,3 +13,23 @@ async def test_get_users(client: AsyncClient):
 
     assert response.status_code == 200
     assert users == set(USERS)
+
+
+async def test_get_users_pagination(client: AsyncClient):
+    response1 = await client.get("/users", params={"limit": 4, "include_count": True})
+    data1 = response1.json()
+    assert response1.status_code == 200
+    assert len(data1["users"]) == 4
+    assert data1["count"] == len(USERS)
+
+    users = data1["users"]
+    cursor = data1["cursor"]
+    while cursor:
+        response = await client.get("/users", params={"limit": 4, "cursor": cursor})
+        data = response.json()
+        assert data["count"] is None
+        users += data["users"]
+        cursor = data["cursor"]
+
+    assert users == sorted(users)
+    assert {uuid.UUID(u) for u in users} == set(USERS)